@@ -16,3 +16,8 @@ def set_debug(onoff = True):
     import znp
     zpi2.set_debug(onoff)
     znp.set_debug(onoff)
+
+def set_wire_trace(onoff = True, handler = None):
+    """hex dump of the frames read and written, to handler if given"""
+    import znp
+    znp.set_wire_trace(onoff, handler)
@@ -0,0 +1,164 @@
+"""
+    network address cache module
+
+    AddressCache maps IEEE (64-bit) addresses to network (16-bit) addresses 
+    and back. Entries expire after `ttl` seconds and the least recently used 
+    ones are evicted beyond `capacity`. The cache can be saved to and loaded 
+    from a JSON file, so that a restarted gateway does not need to resolve 
+    every address over the air again.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+__all__ = ['AddressCache']
+
+import logging
+log = logging.getLogger('zpi.addrcache')
+
+class AddressCache(object):
+    """
+        bidirectional IEEE <-> NWK address cache with TTL and LRU eviction
+        
+        path is the default file of save() and load(). ttl may be None for 
+        entries which never expire.
+    """
+    FILE_VERSION = 1
+    
+    def __init__(self, capacity = 4096, ttl = 24 * 3600.0, path = None):
+        if capacity < 1:
+            raise ValueError('Invalid address cache capacity: %s' % 
+                             repr(capacity))
+        
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  #ieee_addr: (nwk_addr, updated)
+        self._nwk_index = {}    #nwk_addr: ieee_addr
+        
+    def __len__(self):
+        return len(self._entries)
+        
+    def update(self, ieee_addr, nwk_addr, updated = None):
+        """ add or refresh the pair (ieee_addr, nwk_addr) """
+        if updated is None:
+            updated = time.time()
+        with self._lock:
+            entry = self._entries.pop(ieee_addr, None)
+            if entry is not None and entry[0] != nwk_addr:
+                #the device got a new network address
+                if self._nwk_index.get(entry[0]) == ieee_addr:
+                    del self._nwk_index[entry[0]]
+            
+            #another device took over the network address
+            previous = self._nwk_index.get(nwk_addr)
+            if previous is not None and previous != ieee_addr:
+                self._entries.pop(previous, None)
+            
+            self._entries[ieee_addr] = (nwk_addr, updated)
+            self._nwk_index[nwk_addr] = ieee_addr
+            while len(self._entries) > self.capacity:
+                old_ieee_addr, (old_nwk_addr, old_updated) = \
+                    self._entries.popitem(last = False)
+                if self._nwk_index.get(old_nwk_addr) == old_ieee_addr:
+                    del self._nwk_index[old_nwk_addr]
+                    
+    def _get(self, ieee_addr):
+        """ get the live entry of ieee_addr and mark it used, needs the lock """
+        entry = self._entries.pop(ieee_addr, None)
+        if entry is None:
+            return None
+        if self.ttl is not None and entry[1] + self.ttl < time.time():
+            if self._nwk_index.get(entry[0]) == ieee_addr:
+                del self._nwk_index[entry[0]]
+            return None
+        self._entries[ieee_addr] = entry
+        return entry
+        
+    def get_nwk_addr(self, ieee_addr):
+        """ get the network address of ieee_addr, None if not cached """
+        with self._lock:
+            entry = self._get(ieee_addr)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+            
+    def get_ieee_addr(self, nwk_addr):
+        """ get the IEEE address using nwk_addr, None if not cached """
+        with self._lock:
+            ieee_addr = self._nwk_index.get(nwk_addr)
+            if ieee_addr is None or self._get(ieee_addr) is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return ieee_addr
+            
+    def discard(self, ieee_addr = None, nwk_addr = None):
+        """ remove the entry of ieee_addr or of nwk_addr """
+        with self._lock:
+            if ieee_addr is None:
+                ieee_addr = self._nwk_index.get(nwk_addr)
+            entry = self._entries.pop(ieee_addr, None)
+            if entry is not None and self._nwk_index.get(entry[0]) == ieee_addr:
+                del self._nwk_index[entry[0]]
+                
+    def clear(self):
+        """ remove all the entries """
+        with self._lock:
+            self._entries.clear()
+            self._nwk_index.clear()
+            
+    def items(self):
+        """ get [(ieee_addr, nwk_addr, updated)] from the oldest used """
+        with self._lock:
+            return [(ieee_addr, nwk_addr, updated) for ieee_addr, 
+                    (nwk_addr, updated) in self._entries.iteritems()]
+            
+    def save(self, path = None):
+        """
+            write the entries to a JSON file, through a temporary file so 
+            that an interrupted save leaves the previous file intact
+        """
+        path = path or self.path
+        data = {'version': self.FILE_VERSION, 
+                'entries': [['%016X' % ieee_addr, nwk_addr, updated] 
+                            for ieee_addr, nwk_addr, updated in self.items()]}
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        if os.name == 'nt' and os.path.exists(path):
+            #rename does not replace an existing file on Windows
+            os.remove(path)
+        os.rename(temp_path, path)
+        
+    def load(self, path = None):
+        """
+            read the entries of a JSON file written by save(), expired 
+            entries are skipped; return the number of entries loaded
+        """
+        path = path or self.path
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except IOError:
+            log.info('No address cache file: %s' % path)
+            return 0
+        
+        if data.get('version') != self.FILE_VERSION:
+            raise ValueError('Unsupported address cache file version: %s' % 
+                             repr(data.get('version')))
+        
+        now = time.time()
+        count = 0
+        for ieee_addr, nwk_addr, updated in data['entries']:
+            if self.ttl is None or updated + self.ttl >= now:
+                self.update(int(ieee_addr, 16), nwk_addr, updated)
+                count += 1
+        return count
@@ -0,0 +1,257 @@
+"""
+    AF transmit scheduling module
+
+    AfTransmitQueue accepts any number of outbound AF messages, assigns their 
+    trans_id and keeps a congestion window of messages waiting for their 
+    AF_DATA_CONFIRM. The window grows by one message per window of successful 
+    confirms and is halved when ZNP reports congestion or a lost frame, so 
+    the CC2530 buffers are kept busy without overflowing.
+"""
+import collections
+import struct
+import threading
+import time
+
+from zpi.command import ZpiCommand
+from zpi.future import ZpiFuture
+from zpi.zpi2 import ZpiStatus, ZpiStatusException
+
+__all__ = ['AfTransmitQueue']
+
+import logging
+log = logging.getLogger('zpi.aftx')
+
+class _AfMessage(object):
+    """ an outbound message and the future of its AF_DATA_CONFIRM status """
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.future = ZpiFuture()
+        self.trans_id = None
+        self.tries = 0
+        self.deadline = None
+        self.sent_round = None
+
+class AfTransmitQueue(object):
+    """
+        windowed AF_DATA_REQUEST sender
+        
+        usage:
+            txq = zpi.af_transmit_queue(max_window = 16)
+            futures = [txq.submit(dst_addr, 1, 1, cluster_id, data) 
+                       for dst_addr, data in messages]
+            statuses = [future.result() for future in futures]
+        
+        A message is sent with af_data_request_auto_route(). Its future 
+        result is the Z_SUCCESS status of its AF_DATA_CONFIRM; a message 
+        still failing after `retries` retries raises ZpiStatusException 
+        (status None for a confirm timeout). The trans_ids are owned by the 
+        queue, other senders on the same Zpi should not use AF_DATA_CONFIRM.
+    """
+    #statuses shrinking the window and retrying the message
+    CONGESTION_STATUS = frozenset([ZpiStatus.ZMEM_ERROR, 
+                                   ZpiStatus.ZBUFFER_FULL, 
+                                   ZpiStatus.ZMAC_MEM_ERROR, 
+                                   ZpiStatus.ZMAC_NO_ACK,
+                                   ZpiStatus.ZAPS_NO_ACK, 
+                                   ZpiStatus.ZNWK_NO_ROUTE, 
+                                   None])   #confirm timeout
+    
+    def __init__(self, zpi, window = 4, min_window = 1, max_window = 32,
+                 confirm_timeout = 5.000, retries = 2, radius = 30):
+        if not 1 <= min_window <= window <= max_window <= 255:
+            raise ValueError('Invalid AF transmit window: %s <= %s <= %s' % (
+                             min_window, window, max_window))
+        
+        self._zpi = zpi
+        self.window = float(window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.confirm_timeout = confirm_timeout
+        self.retries = retries
+        self.radius = radius
+        
+        self.sent = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.retried = 0
+        
+        self._cond = threading.Condition()
+        self._backlog = collections.deque()
+        self._in_flight = {}    #trans_id: _AfMessage
+        self._next_trans_id = 0
+        self._round = 0         #incremented when the window shrinks
+        self._closed = False
+        self._thread = threading.Thread(target = self._run, 
+                                        name = 'AfTransmitQueue')
+        self._thread.daemon = True
+        self._thread.start()
+        
+    def submit(self, dst_addr, dst_ep, src_ep, cluster_id, data, 
+               options = 0, radius = None):
+        """ queue a message, return the ZpiFuture of its confirm status """
+        message = _AfMessage((dst_addr, dst_ep, src_ep, cluster_id), 
+                             {'options': options, 
+                              'radius': radius or self.radius, 
+                              'data': data})
+        with self._cond:
+            if self._closed:
+                raise ValueError('AF transmit queue closed.')
+            self._backlog.append(message)
+            self._cond.notify_all()
+        return message.future
+        
+    def pending(self):
+        """ number of messages queued or waiting for their confirm """
+        with self._cond:
+            return len(self._backlog) + len(self._in_flight)
+        
+    def drain(self, timeout = None):
+        """ wait until all the messages are done, return False on timeout """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._backlog or self._in_flight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+        
+    def close(self):
+        """
+            stop sending, the messages not sent yet are cancelled, so are 
+            the messages in flight whose confirm calls for a retry
+        """
+        with self._cond:
+            self._closed = True
+            backlog, self._backlog = self._backlog, collections.deque()
+            self._cond.notify_all()
+        for message in backlog:
+            message.future.cancel()
+        self._thread.join()
+        
+    def _alloc_trans_id(self):
+        """ next trans_id not in flight, needs self._cond """
+        while self._next_trans_id in self._in_flight:
+            self._next_trans_id = (self._next_trans_id + 1) & 0xff
+        trans_id = self._next_trans_id
+        self._next_trans_id = (trans_id + 1) & 0xff
+        return trans_id
+        
+    def _next_message(self):
+        """
+            wait for a message the window lets out and register it in 
+            flight, None once closed
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                
+                now = time.time()
+                for message in self._in_flight.values():
+                    if message.deadline <= now:
+                        #its done callback reports the timeout
+                        message.confirm.cancel()
+                        
+                if self._backlog and len(self._in_flight) < int(self.window):
+                    message = self._backlog.popleft()
+                    message.trans_id = self._alloc_trans_id()
+                    message.tries += 1
+                    message.sent_round = self._round
+                    message.deadline = now + self.confirm_timeout
+                    self._in_flight[message.trans_id] = message
+                    return message
+                
+                deadlines = [m.deadline for m in self._in_flight.values()]
+                self._cond.wait(max(0.001, min(deadlines) - now) 
+                                if deadlines else None)
+                
+    def _run(self):
+        """ sender thread """
+        zpi = self._zpi
+        while True:
+            message = self._next_message()
+            if message is None:
+                return
+            
+            confirm = zpi.expect_areq(ZpiCommand.AF_DATA_CONFIRM, 'trans_id', 
+                                      struct.pack('<B', message.trans_id), 
+                                      message.deadline)
+            message.confirm = confirm
+            try:
+                status = zpi.af_data_request_auto_route(
+                    *(message.args + (message.trans_id, 
+                                      message.kwargs['options'], 
+                                      message.kwargs['radius'], 
+                                      message.kwargs['data'])))
+            except Exception as e:
+                confirm.cancel()
+                self._done(message, e)
+                continue
+            
+            self.sent += 1
+            if status != ZpiStatus.Z_SUCCESS:
+                #refused before transmission, e.g. ZBUFFER_FULL
+                confirm.cancel()
+                self._confirmed(message, status)
+            else:
+                confirm.add_done_callback(
+                    lambda confirm, message = message: self._on_confirm(
+                        message, confirm))
+                
+    def _on_confirm(self, message, confirm):
+        """ confirm future done, in the reader thread """
+        if confirm.cancelled():
+            self._confirmed(message, None)
+        else:
+            status, endpoint, trans_id = self._zpi.af_data_confirm_handler(
+                confirm.result())
+            self._confirmed(message, status)
+            
+    def _confirmed(self, message, status):
+        """ adapt the window to a confirm status, retry or finish message """
+        retry = cancel = False
+        with self._cond:
+            if self._in_flight.get(message.trans_id) is not message:
+                return
+            del self._in_flight[message.trans_id]
+            
+            if status == ZpiStatus.Z_SUCCESS:
+                #additive increase, one message per window of confirms
+                self.window = min(self.max_window, 
+                                  self.window + 1.0 / self.window)
+                self.confirmed += 1
+            elif status in self.CONGESTION_STATUS:
+                #multiplicative decrease, once per round of messages
+                if message.sent_round == self._round:
+                    self._round += 1
+                    self.window = max(self.min_window, self.window / 2)
+                retry = message.tries <= self.retries
+                if retry and self._closed:
+                    #no sender left, cancelled like the backlog by close()
+                    retry, cancel = False, True
+                elif retry:
+                    self.retried += 1
+                    self._backlog.appendleft(message)
+            self._cond.notify_all()
+        
+        if cancel:
+            message.future.cancel()
+        elif status == ZpiStatus.Z_SUCCESS:
+            message.future.set_result(status)
+        elif not retry:
+            self._done(message, ZpiStatusException(
+                'AF data request failed: %s' % (
+                    ZpiStatus.status_names.get(status, 'confirm timeout'), ), 
+                status))
+            
+    def _done(self, message, exception):
+        """ fail a message """
+        with self._cond:
+            if self._in_flight.get(message.trans_id) is message:
+                del self._in_flight[message.trans_id]
+            self.failed += 1
+            self._cond.notify_all()
+        log.debug('AF message failed: %s' % exception)
+        message.future.set_exception(exception)
@@ -0,0 +1,345 @@
+"""
+    aio.py: asyncio front end of the ZPI API
+    
+    AsyncZpi reads the serial port from an asyncio event loop instead of a 
+    reader thread. Its SREQ methods return futures resolved with the handled 
+    SRSP, and AREQs are delivered through an asyncio queue:
+    
+        zpi = AsyncZpi(ser, loop)
+        version = await zpi.sys_version()
+        status = await zpi.af_data_request(...)
+        async for rx_data in zpi.areqs():
+            ...
+    
+    On python 2 the trollius backport is used (yield From(...) instead of 
+    await).
+    
+    zdo_exchange(), zdo_exchange_many(), expect_areq(), resolve_nwk_addr() 
+    and resolve_ieee_addr() return futures as well. AsyncZpi derives from 
+    ZpiBase, the Zpi helpers waiting for responses in the calling thread 
+    (pipelines, ZDO table iterators, the topology crawler, ...) are not 
+    available.
+"""
+import logging
+import threading
+import time
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from zpi.zpi2 import ZpiBase, ZpiStatus, SrspTimeoutException, \
+    AreqTimeoutException, ZpiStatusException
+from zpi.command import ZpiCommand
+from zpi.znp import wire_log
+from zpi.capture import CAPTURE_RX
+
+__all__ = ['AsyncZpi', 'AreqIterator']
+
+log = logging.getLogger('zpi.aio')
+console = logging.StreamHandler()
+formatter = logging.Formatter('[%(asctime)s] %(message)s')
+console.setFormatter(formatter)
+log.addHandler(console)
+log.setLevel(logging.INFO)
+
+def set_debug(onoff):
+    if onoff:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+
+
+class AreqIterator(object):
+    """
+        asynchronous iterator over the AREQs received by an AsyncZpi
+    """
+    def __init__(self, zpi):
+        self._zpi = zpi
+        
+    def __aiter__(self):
+        return self
+        
+    def __anext__(self):
+        return self._zpi.next_areq()
+
+class AsyncZpi(ZpiBase):
+    """
+        ZPI API on an asyncio event loop
+        
+        The serial port must provide a selectable file descriptor. All 
+        methods must be called from the event loop thread. The frames are 
+        written by the writer thread, the loop does not wait for the port.
+    """
+    RX_THREAD = False
+    
+    def __init__(self, ser, loop = None, callback = None, areq_queue_size = 0,
+                 address_cache = None):
+        """
+            callback(zpi, rx_data) is called for each AREQ in the loop thread,
+            without callback AREQs are queued, see next_areq() and areqs()
+        """
+        self._loop = loop or asyncio.get_event_loop()
+        self._areq_queue = asyncio.Queue(areq_queue_size, loop = self._loop)
+        self._areq_dropped = 0
+        self._user_callback = callback
+        
+        super(AsyncZpi, self).__init__(ser, self._areq_received, address_cache)
+        
+        if self._rx_fd is None:
+            raise ValueError('Serial port has no selectable file descriptor.')
+        self._loop.add_reader(self._rx_fd, self._on_readable)
+        
+    def close(self, timeout = None):
+        """
+            stop reading the serial port, fail the unanswered SREQs and stop 
+            the writer thread once the queued frames are written
+        """
+        if self._rx_fd is not None:
+            self._loop.remove_reader(self._rx_fd)
+            self._rx_fd = None
+        self._pending_srsp.fail_all(
+            SrspTimeoutException('AsyncZpi closed.'))
+        super(AsyncZpi, self).halt(timeout)
+        
+    def halt(self, timeout = None):
+        """ no reader thread, same as close() """
+        self.close(timeout)
+        
+    def _on_readable(self):
+        """
+            event loop reader callback, dispatch all complete frames
+        """
+        chunk = self.serial.read(self.serial.inWaiting() or 1)
+        if not chunk:
+            return
+        
+        trace = wire_log.isEnabledFor(logging.DEBUG)
+        bad_frames = self._rx_decoder.bad_frames
+        for frame in self._rx_decoder.feed(chunk):
+            if trace:
+                wire_log.debug('RX: %s', frame.raw_data.encode('hex'))
+            if len(frame.data) == 0:
+                continue
+            if self.capture is not None:
+                self.capture.record(CAPTURE_RX, frame.data)
+            
+            try:
+                if not self._filter_frame(frame.data):
+                    if self.metrics is not None:
+                        self.metrics.incr('rx_dropped_total')
+                    continue
+                rx_data = self._split_response(frame.data)
+                self._callback_dispatcher(rx_data)
+            except Exception as e:
+                log.warning('AsyncZpi:{0}'.format(e))
+        
+        if self._rx_decoder.bad_frames != bad_frames and \
+                self.metrics is not None:
+            self.metrics.incr('bad_frames_total', None, 
+                              self._rx_decoder.bad_frames - bad_frames)
+        
+    def _areq_received(self, zpi, rx_data):
+        """
+            AREQ callback of the dispatcher, runs in the loop thread
+        """
+        if self._user_callback is not None:
+            self._user_callback(zpi, rx_data)
+            return
+        
+        if self._areq_queue.full():
+            #drop the oldest AREQ to keep the reader going
+            self._areq_queue.get_nowait()
+            self._areq_dropped += 1
+        self._areq_queue.put_nowait(rx_data)
+        
+    def next_areq(self):
+        """
+            get a future of the next received AREQ (rx_data)
+        """
+        return asyncio.ensure_future(self._areq_queue.get(), loop = self._loop)
+        
+    def areqs(self):
+        """
+            asynchronous iterator of the received AREQs (rx_data)
+        """
+        return AreqIterator(self)
+        
+    @property
+    def areq_dropped(self):
+        """ number of AREQs dropped because the queue was full """
+        return self._areq_dropped
+        
+    def _create_future(self):
+        """ create an asyncio future attached to the loop """
+        try:
+            return self._loop.create_future()
+        except AttributeError:
+            return asyncio.Future(loop = self._loop)
+        
+    def _sreq_result(self, result):
+        """ a result known without SREQ, as a done asyncio future """
+        future = self._create_future()
+        future.set_result(result)
+        return future
+        
+    def _failed_future(self, exception):
+        """ a failed asyncio future """
+        future = self._create_future()
+        future.set_exception(exception)
+        return future
+        
+    def _loop_future(self, future, timeout, timeout_error):
+        """
+            get an asyncio future of the result of a ZpiFuture completed in 
+            the loop thread, the ZpiFuture is cancelled after timeout seconds 
+            (None to wait without timer) and the asyncio future fails with 
+            timeout_error; cancelling the asyncio future cancels the ZpiFuture
+        """
+        result = self._create_future()
+        
+        timer = None
+        if timeout is not None:
+            timer = self._loop.call_later(timeout, future.cancel)
+        
+        def settle(future):
+            if timer is not None:
+                timer.cancel()
+            if result.done():
+                return
+            if future.cancelled():
+                result.set_exception(timeout_error)
+                return
+            try:
+                result.set_result(future.result())
+            except Exception as e:
+                result.set_exception(e)
+        
+        def done(future):
+            if threading.current_thread() is self._tx_thread:
+                #failed write, reported by the writer thread
+                self._loop.call_soon_threadsafe(settle, future)
+            else:
+                #response dispatched in the loop thread by _on_readable()
+                settle(future)
+        future.add_done_callback(done)
+        
+        def cancelled(result):
+            if result.cancelled():
+                future.cancel()
+        result.add_done_callback(cancelled)
+        
+        return result
+        
+    def _then(self, future, func):
+        """ get an asyncio future of func(result of the asyncio future) """
+        result = self._create_future()
+        
+        def done(future):
+            if future.cancelled():
+                result.cancel()
+                return
+            try:
+                result.set_result(func(future.result()))
+            except Exception as e:
+                result.set_exception(e)
+        future.add_done_callback(done)
+        
+        return result
+        
+    def _sreq(self, zpi_cmd, srsp_handler, 
+              srsp_timeout = ZpiBase.SRSP_WAITING_TIMEOUT_DEFAULT, **kwargs):
+        """
+            send a SREQ, return an asyncio future of the handled SRSP
+        """
+        try:
+            future = self._sreq_future(zpi_cmd, srsp_handler, **kwargs)
+        except Exception as e:
+            return self._failed_future(e)
+        
+        return self._loop_future(future, srsp_timeout, SrspTimeoutException(
+            'Wait for %s SRSP timeout.' % zpi_cmd))
+        
+    def zdo_exchange(self, zdo_cmd, *args, **kwargs):
+        """
+            send the ZDO request zdo_cmd, return an asyncio future of its 
+            AREQ response processed by its zdo_*_rsp_handler
+        """
+        areq_timeout = kwargs.get('areq_timeout', 
+                                  self.AREQ_WAITING_TIMEOUT_DEFAULT)
+        try:
+            future = self.zdo_exchange_async(zdo_cmd, *args, **kwargs)
+        except Exception as e:
+            return self._failed_future(e)
+        
+        return self._loop_future(future, areq_timeout, AreqTimeoutException(
+            'Wait for %s response timeout.' % zdo_cmd))
+        
+    def zdo_exchange_many(self, requests, 
+                          areq_timeout = ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            run the ZDO exchanges [(zdo_cmd, args), ...] concurrently, return 
+            an asyncio future of their results in the order of requests, a 
+            failed exchange gives its exception instead of a result
+        """
+        return asyncio.gather(*[self.zdo_exchange(zdo_cmd, *args, 
+                                                  areq_timeout = areq_timeout) 
+                                for zdo_cmd, args in requests], 
+                              loop = self._loop, return_exceptions = True)
+        
+    def expect_areq(self, rsp_id, field_name, value, deadline = None):
+        """
+            get an asyncio future of the next AREQ rsp_id whose field_name is 
+            value (its raw bytes), failing with AreqTimeoutException at 
+            deadline (a time.time() value); cancel it to stop waiting
+        """
+        future = super(AsyncZpi, self).expect_areq(rsp_id, field_name, value, 
+                                                   deadline)
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.time())
+        return self._loop_future(future, timeout, AreqTimeoutException(
+            'Wait for %s timeout.' % rsp_id))
+        
+    @staticmethod
+    def _address(zdo_cmd, index):
+        """ get the address at index of a successful address response """
+        def address(response):
+            status = response[0]
+            if status != ZpiStatus.Z_SUCCESS:
+                raise ZpiStatusException('%s failed: %s' % (
+                    zdo_cmd, ZpiStatus.status_names.get(status, status)), 
+                    status)
+            return response[index]
+        return address
+        
+    def resolve_nwk_addr(self, ieee_addr, 
+                         areq_timeout = ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            get an asyncio future of the network address of ieee_addr, from 
+            the address cache or else through a ZDO_NWK_ADDR_REQ exchange
+        """
+        nwk_addr = self.address_cache.get_nwk_addr(ieee_addr)
+        if nwk_addr is not None:
+            return self._sreq_result(nwk_addr)
+        
+        return self._then(
+            self.zdo_exchange(ZpiCommand.ZDO_NWK_ADDR_REQ, ieee_addr, 0, 0, 
+                              areq_timeout = areq_timeout), 
+            self._address(ZpiCommand.ZDO_NWK_ADDR_REQ, 2))
+        
+    def resolve_ieee_addr(self, nwk_addr, 
+                          areq_timeout = ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            get an asyncio future of the IEEE address of nwk_addr, from the 
+            address cache or else through a ZDO_IEEE_ADDR_REQ exchange
+        """
+        ieee_addr = self.address_cache.get_ieee_addr(nwk_addr)
+        if ieee_addr is not None:
+            return self._sreq_result(ieee_addr)
+        
+        return self._then(
+            self.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, nwk_addr, 
+                              areq_timeout = areq_timeout), 
+            self._address(ZpiCommand.ZDO_IEEE_ADDR_REQ, 1))
@@ -0,0 +1,176 @@
+"""
+    wire capture module
+
+    CaptureWriter records the frames crossing the UART in a compact binary
+    capture file, once set on a Znp/Zpi:
+        zpi.capture = CaptureWriter('field.zcap')
+    and CaptureReplayer feeds the received frames of a capture back through
+    the frame path of a Zpi (_filter_frame(), _split_response() and the
+    dispatcher), as fast as possible or at their original timing, e.g. to
+    profile the decoding of a real traffic mix offline:
+        zpi = Zpi(ZnpSimulator(), callback)
+        CaptureReplayer(zpi, 'field.zcap').run()
+
+    File format: the FILE_MAGIC header, then per frame a RECORD header
+    (timestamp as float seconds, direction, data length) followed by the
+    frame data, i.e. the command bytes and the payload, little endian.
+"""
+import struct
+import threading
+import time
+
+__all__ = ['CaptureWriter', 'CaptureReplayer', 'read_capture',
+           'CAPTURE_RX', 'CAPTURE_TX']
+
+import logging
+log = logging.getLogger('zpi.capture')
+
+FILE_MAGIC = b'ZNPCAP\x01\x00'
+RECORD = struct.Struct('<dBH')
+
+CAPTURE_RX = 0  #frame read from the ZNP device
+CAPTURE_TX = 1  #frame written to the ZNP device
+
+
+class CaptureWriter(object):
+    """
+        buffered, thread safe writer of a capture file
+
+        output is a path or a binary file object. Records are joined in
+        memory and written once buffer_size bytes are pending, on flush()
+        and on close().
+    """
+    def __init__(self, output, buffer_size = 65536):
+        if isinstance(output, basestring):
+            self._file = open(output, 'wb')
+            self._owned = True
+        else:
+            self._file = output
+            self._owned = False
+        self.buffer_size = buffer_size
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._pending = [FILE_MAGIC]
+        self._pending_size = len(FILE_MAGIC)
+
+    def record(self, direction, data, timestamp = None):
+        """ append a frame, CAPTURE_RX or CAPTURE_TX """
+        if timestamp is None:
+            timestamp = time.time()
+        header = RECORD.pack(timestamp, direction, len(data))
+        with self._lock:
+            if self._pending is None:
+                return  #closed
+            self._pending.append(header)
+            self._pending.append(data)
+            self._pending_size += len(header) + len(data)
+            self.frames += 1
+            if self._pending_size >= self.buffer_size:
+                self._write()
+
+    def _write(self):
+        """ write the pending records, the lock held """
+        self._file.write(b''.join(self._pending))
+        self._pending = []
+        self._pending_size = 0
+
+    def flush(self):
+        """ write the pending records to the file """
+        with self._lock:
+            if self._pending:
+                self._write()
+            self._file.flush()
+
+    def close(self):
+        """ flush and stop recording, closing the file if opened here """
+        self.flush()
+        with self._lock:
+            self._pending = None
+            if self._owned:
+                self._file.close()
+
+
+def read_capture(source):
+    """
+        iterate the (timestamp, direction, data) frames of a capture, source
+        being a path or a binary file object
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as capture:
+            for record in read_capture(capture):
+                yield record
+        return
+
+    if source.read(len(FILE_MAGIC)) != FILE_MAGIC:
+        raise ValueError('Not a ZNP capture file.')
+    while True:
+        header = source.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return  #a capture cut short keeps its complete frames
+        timestamp, direction, size = RECORD.unpack(header)
+        data = source.read(size)
+        if len(data) < size:
+            return
+        yield timestamp, direction, data
+
+
+class CaptureReplayer(object):
+    """
+        replay the received frames of a capture through a Zpi
+
+        speed is None to replay as fast as possible, or the ratio to the
+        original timing (1.0 is real time). The frames written to the
+        device are skipped. run() returns the counters as a dictionary.
+    """
+    def __init__(self, zpi, source, speed = None):
+        self._zpi = zpi
+        self.source = source
+        self.speed = speed
+        self.frames = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def run(self):
+        """ replay the capture in the calling thread """
+        zpi = self._zpi
+        if self.speed is None:
+            #read beforehand, the file reading is not part of the replay
+            frames = [data for timestamp, direction, data
+                      in read_capture(self.source)
+                      if direction == CAPTURE_RX]
+        else:
+            frames = self._paced()
+        start = time.time()
+
+        for data in frames:
+            try:
+                if zpi._filter_frame(data):
+                    zpi._callback_dispatcher(zpi._split_response(data))
+            except Exception as e:
+                log.debug('replay error: %s', e)
+                self.errors += 1
+            self.frames += 1
+
+        self.elapsed = time.time() - start
+        return self.stats()
+
+    def _paced(self):
+        """ yield the received frames at the pace of their capture """
+        first = None
+        start = time.time()
+        for timestamp, direction, data in read_capture(self.source):
+            if direction != CAPTURE_RX:
+                continue
+            if first is None:
+                first = timestamp
+            delay = start + (timestamp - first) / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            yield data
+
+    def stats(self):
+        """ get the counters """
+        return {'frames': self.frames, 'errors': self.errors,
+                'elapsed': self.elapsed,
+                'frames_per_s': (self.frames / self.elapsed
+                                 if self.elapsed > 0 else None)}
@@ -0,0 +1,388 @@
+"""
+    ZNP command codec module
+    
+    The command and response specifications in ZpiCommands are compiled once 
+    into encoder and decoder objects, so that building or splitting a frame 
+    does not need to interpret the field list again for every frame.
+"""
+import re
+import struct
+
+__all__ = ['CommandEncoder', 'ResponseDecoder', 'ZnpResponse', 
+           'compile_commands', 'compile_responses', 'compile_len_expr']
+
+#length expressions in the form of 'k*x' or 'x'
+_LEN_EXPR = re.compile(r'^\s*(?:(\d+)\s*\*\s*)?x\s*$')
+
+def compile_len_expr(expr):
+    """
+        compile a length expression such as '2*x' into a function of x, 
+        expressions not in the 'k*x' form are compiled with eval() once
+    """
+    match = _LEN_EXPR.match(expr)
+    if match:
+        factor = int(match.group(1) or 1)
+        return lambda x: factor * x
+    
+    return eval('lambda x: %s' % expr)
+
+class _FixedRun(object):
+    """
+        a run of consecutive fixed length fields, packed with one Struct
+    """
+    def __init__(self, fields):
+        self.names = [field['name'] for field in fields]
+        self.defaults = [field.get('default') or None for field in fields]
+        self.lens = [int(field['len']) for field in fields]
+        self.items = zip(self.names, self.defaults)
+        self.struct = struct.Struct(''.join('%ds' % n for n in self.lens))
+        
+    def values(self, kwargs):
+        """
+            get the field values from kwargs or defaults, check their length
+        """
+        values = [kwargs[name] if name in kwargs else default 
+                  for name, default in self.items]
+        
+        if None in values or map(len, values) != self.lens:
+            for name, field_len, data in zip(self.names, self.lens, values):
+                if data is None:
+                    raise KeyError(
+                        'The expected field %s of length %d was not provided' 
+                        % (name, field_len))
+                if field_len and len(data) != field_len:
+                    raise ValueError(
+                        "The data provided for '%s' was not %d bytes long"\
+                        % (name, field_len))
+        
+        return values
+
+class CommandEncoder(object):
+    """
+        encoder of one ZNP command, compiled from its field specification
+        
+        Fixed length fields are packed with precompiled Structs, variable 
+        length fields use compiled length functions, the fixed leading cmd0 
+        and cmd1 bytes are kept as a ready made header.
+    """
+    def __init__(self, name, spec):
+        self.name = name
+        self.header = b''
+        self._header_run = None
+        self._steps = []
+        self._has_refs = False
+        
+        start = 0
+        if (len(spec) >= 2 and spec[0]['name'] == 'cmd0' 
+                and spec[1]['name'] == 'cmd1'
+                and spec[0].get('default') and spec[1].get('default')):
+            self.header = spec[0]['default'] + spec[1]['default']
+            self._header_run = _FixedRun(spec[:2])
+            start = 2
+        
+        run = []
+        for field in spec[start:]:
+            if isinstance(field['len'], int):
+                run.append(field)
+                continue
+            
+            if run:
+                self._steps.append(_FixedRun(run))
+                run = []
+            
+            if isinstance(field['len'], tuple):
+                self._has_refs = True
+                self._steps.append((field['name'], field.get('default'), 
+                                    field['len'][0], 
+                                    compile_len_expr(field['len'][1])))
+            else:
+                self._steps.append((field['name'], None, None, None))
+        
+        if run:
+            self._steps.append(_FixedRun(run))
+        
+    def encode(self, kwargs):
+        """
+            build the command packet (cmd0, cmd1 and data) from field values
+        """
+        header = self._header_run
+        if header and ('cmd0' in kwargs or 'cmd1' in kwargs):
+            #header bytes overridden by caller
+            packet = [header.struct.pack(*header.values(kwargs))]
+        else:
+            packet = [self.header]
+        
+        #{field_name: value} of passed fields for length expressions
+        field_dict = None
+        if self._has_refs:
+            field_dict = {}
+        
+        for step in self._steps:
+            if isinstance(step, _FixedRun):
+                values = step.values(kwargs)
+                packet.append(step.struct.pack(*values))
+                if field_dict is not None:
+                    field_dict.update(zip(step.names, values))
+                continue
+            
+            name, default, ref, len_func = step
+            if ref is None:
+                data = kwargs.get(name)
+            else:
+                data = kwargs[name] if name in kwargs else default or None
+
+                try:
+                    relative_len = struct.unpack('B', field_dict[ref])[0]
+                    field_len = len_func(relative_len)
+                except:
+                    raise ValueError('Length expression calculation failed.')
+                
+                if data is None:
+                    raise KeyError(
+                        'The expected field %s of length %d was not provided' 
+                        % (name, field_len))
+                
+                if field_len and len(data) != field_len:
+                    raise ValueError(
+                        "The data provided for '%s' was not %d bytes long"\
+                        % (name, field_len))
+            
+            if field_dict is not None:
+                field_dict[name] = data
+            
+            if data:
+                packet.append(data)
+        
+        return b''.join(packet)
+
+def compile_commands(commands):
+    """
+        compile a znp_commands dictionary into {command: CommandEncoder}
+    """
+    return dict((name, CommandEncoder(name, spec)) 
+                for name, spec in commands.iteritems())
+
+#typed struct codes by field size, other sizes are kept as bytes
+_TYPED_CODES = {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}
+
+class ZnpResponse(dict):
+    """
+        parsed response, a {field_name: bytes} dictionary as before which also 
+        keeps the frame data and the typed field values decoded along
+    """
+    def __init__(self, info, raw = None, typed = None):
+        super(ZnpResponse, self).__init__(info)
+        self.raw = raw
+        self._typed = typed
+        
+    def typed(self):
+        """
+            get {field_name: value} with integer values for fields of 1, 2, 4 
+            and 8 bytes and memoryview slices of the frame for variable length 
+            fields
+        """
+        if self._typed is None:
+            self._typed = dict(self)
+        return self._typed
+
+class ResponseDecoder(object):
+    """
+        decoder of one ZNP response, compiled from its structure specification
+        
+        Runs of fixed length fields are unpacked with one precompiled Struct 
+        each, as bytes (split) or as integers (unpack). Variable length 
+        fields use compiled length functions.
+    """
+    FIXED = 0
+    RELATIVE = 1
+    NULL_TERMINATED = 2
+    TAIL = 3
+    
+    def __init__(self, packet_id, packet):
+        self.packet_id = packet_id
+        self.name = packet['name']
+        self.parsing = packet.get('parsing')
+        self.field_names = [field['name'] for field in packet['structure']]
+        self.offsets = {}   #field_name: (offset, len) of fixed position fields
+        self._steps = []
+        
+        run = []
+        offset = 2
+        for field in packet['structure']:
+            field_len = field['len']
+            if offset is not None and (isinstance(field_len, int) or 
+                                       field_len is None):
+                self.offsets[field['name']] = (offset, field_len)
+            if isinstance(field_len, int):
+                run.append(field)
+                if offset is not None:
+                    offset += field_len
+                continue
+            
+            offset = None
+            if run:
+                self._add_run(run)
+                run = []
+            
+            if isinstance(field_len, tuple):
+                self._steps.append((self.RELATIVE, field['name'], 
+                                    field_len[0], 
+                                    compile_len_expr(field_len[1])))
+            elif field_len == 'null_terminated':
+                self._steps.append((self.NULL_TERMINATED, field['name'], 
+                                    None, None))
+            elif field_len is None:
+                self._steps.append((self.TAIL, field['name'], None, None))
+                break   #all rest data belongs to this field
+            else:
+                raise ValueError('Invalid value specified for len field!')
+        
+        if run:
+            self._add_run(run)
+        
+    def _add_run(self, fields):
+        """
+            add a run of fixed length fields
+        """
+        names = tuple(field['name'] for field in fields)
+        raw = struct.Struct('<' + ''.join('%ds' % field['len'] 
+                                          for field in fields))
+        typed = struct.Struct('<' + ''.join(
+            _TYPED_CODES.get(field['len'], '%ds' % field['len']) 
+            for field in fields))
+        self._steps.append((self.FIXED, names, raw, typed))
+        
+    def _decode(self, data, split):
+        """
+            walk the compiled steps over data, return the typed 
+            {field_name: value} and, if split, the {field_name: bytes} too
+        """
+        typed = {}
+        info = {} if split else None
+        index = 2  #start from 2 because we have 2 command bytes
+        size = len(data)
+        view = None
+        
+        for kind, name, arg0, arg1 in self._steps:
+            if kind == self.FIXED:
+                if index + arg1.size > size:
+                    raise ValueError('Response packet was shorter than expected!')
+                typed.update(zip(name, arg1.unpack_from(data, index)))
+                if split:
+                    info.update(zip(name, arg0.unpack_from(data, index)))
+                index += arg1.size
+            elif kind == self.RELATIVE:
+                try:
+                    field_len = arg1(typed[arg0])
+                except:
+                    raise ValueError('Length expression calculation failed.')
+                
+                if index + field_len > size:
+                    raise ValueError('Response packet was shorter than expected!')
+                
+                if view is None:
+                    view = memoryview(data)
+                typed[name] = view[index:index + field_len]
+                if split:
+                    info[name] = data[index:index + field_len]
+                index += field_len
+            elif kind == self.NULL_TERMINATED:
+                end = data.find(b'\x00', index)
+                if end < 0:
+                    raise ValueError('Response packet was shorter than expected!')
+                typed[name] = data[index:end]
+                if split:
+                    info[name] = typed[name]
+                index = end + 1
+            else:
+                if view is None:
+                    view = memoryview(data)
+                typed[name] = view[index:]
+                if split and index < size:
+                    info[name] = data[index:]
+                index = size
+        
+        if index < size:
+            raise ValueError('Response packet is longer than expected.'
+                'Expected: %d, got: %d bytes. ' % (index, size))
+        
+        typed['id'] = self.name
+        return typed, info
+        
+    def split(self, data):
+        """
+            split data into a {field_name: bytes} ZnpResponse, its typed 
+            values are decoded in the same pass
+        """
+        typed, info = self._decode(data, True)
+        info['id'] = self.name
+        info['cmd0'] = data[0:1]
+        info['cmd1'] = data[1:2]
+        
+        return ZnpResponse(info, data, typed)
+        
+    def unpack(self, data):
+        """
+            decode data into {field_name: value}, integers for fixed fields 
+            of 1, 2, 4 and 8 bytes, memoryview slices for variable fields
+        """
+        return self._decode(data, False)[0]
+        
+    def field_reader(self, names):
+        """
+            compile a reader of the named fields only, a function of the frame 
+            data returning {field_name: value} as unpack() does
+            
+            Fields at a fixed position are unpacked with one Struct skipping 
+            the other fields, a field after a variable length one needs the 
+            whole frame to be decoded.
+        """
+        names = tuple(names)
+        for name in names:
+            if name not in self.field_names:
+                raise ValueError('%s has no field %s' % (self.name, name))
+        
+        rsp_id = self.name
+        if not all(name in self.offsets for name in names):
+            unpack = self.unpack
+            def read(data):
+                info = unpack(data)
+                fields = dict((name, info[name]) for name in names)
+                fields['id'] = rsp_id
+                return fields
+            return read
+        
+        fixed = sorted((self.offsets[name][0], name) for name in names 
+                       if self.offsets[name][1] is not None)
+        tail = [(self.offsets[name][0], name) for name in names 
+                if self.offsets[name][1] is None]
+        fmt = '<'
+        index = 2
+        for offset, name in fixed:
+            field_len = self.offsets[name][1]
+            if offset > index:
+                fmt += '%dx' % (offset - index)
+            fmt += _TYPED_CODES.get(field_len, '%ds' % field_len)
+            index = offset + field_len
+        layout = struct.Struct(fmt)
+        fixed_names = tuple(name for offset, name in fixed)
+        size = max([2 + layout.size] + [offset for offset, name in tail])
+        
+        def read(data):
+            if len(data) < size:
+                raise ValueError('Response packet was shorter than expected!')
+            fields = dict(zip(fixed_names, layout.unpack_from(data, 2)))
+            if tail:
+                view = memoryview(data)
+                for offset, name in tail:
+                    fields[name] = view[offset:]
+            fields['id'] = rsp_id
+            return fields
+        return read
+
+def compile_responses(responses):
+    """
+        compile a znp_responses dictionary into {packet_id: ResponseDecoder}
+    """
+    return dict((packet_id, ResponseDecoder(packet_id, packet)) 
+                for packet_id, packet in responses.iteritems())
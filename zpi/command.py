@@ -2,7 +2,27 @@
     ZPI command and commands structure module
 """
 
-__all__ = ['ZpiCommand', 'ZpiCommands']
+__all__ = ['ZpiCommand', 'ZpiCommands', 'SUBSYSTEMS', 'subsystem']
+
+#ZNP subsystems, the 5 low bits of cmd0
+SUBSYSTEMS = {
+    0x00: 'RPC',
+    0x01: 'SYS',
+    0x02: 'MAC',
+    0x03: 'NWK',
+    0x04: 'AF',
+    0x05: 'ZDO',
+    0x06: 'SAPI',
+    0x07: 'UTIL',
+    0x08: 'DEBUG',
+    0x09: 'APP',
+    0x0F: 'APS',    #APS expanded commands, see ZpiCommand
+    }
+
+def subsystem(packet_id):
+    """ get the subsystem name of a packet id (cmd0 + cmd1) """
+    number = ord(packet_id[0:1]) & 0x1F
+    return SUBSYSTEMS.get(number, '0x%02x' % number)
 
 class ZpiCommand(object):
     """ ZPI command enumeration class """
@@ -125,7 +145,7 @@ class ZpiCommand(object):
     AF_REGISTER_SRSP = 'AF_REGISTER_SRSP'
     AF_DATA_REQUEST_SRSP = 'AF_DATA_REQUEST_SRSP'
     AF_DATA_REQUEST_EXT_SRSP = 'AF_DATA_REQUEST_EXT_SRSP'
-    AF_DATA_REQUEST_SRC_RTG_SRSP = AF_DATA_REQUEST_EXT_SRSP
+    AF_DATA_REQUEST_SRC_RTG_SRSP = 'AF_DATA_REQUEST_SRC_RTG_SRSP'
     AF_INTER_PAN_CTRL_SRSP = 'AF_INTER_PAN_CTRL_SRSP'
     AF_DATA_STORE_SRSP = 'AF_DATA_STORE_SRSP'
     AF_DATA_CONFIRM = 'AF_DATA_CONFIRM'
@@ -418,7 +438,7 @@ class ZpiCommands(object):
                     
         ZpiCommand.AF_DATA_REQUEST_SRC_RTG:[
             {'name': 'cmd0',        'len': 1,   'default': b'\x24'},
-            {'name': 'cmd1',        'len': 1,   'default': b'\x02'},
+            {'name': 'cmd1',        'len': 1,   'default': b'\x03'},
             {'name': 'dst_addr',    'len': 2,   'default': None},
             {'name': 'dst_ep',      'len': 1,   'default': None},
             {'name': 'src_ep',      'len': 1,   'default': None},
@@ -594,7 +614,7 @@ class ZpiCommands(object):
             {'name': 'cmd0',        'len': 1,   'default': b'\x25'},
             {'name': 'cmd1',        'len': 1,   'default': b'\x31'},  
             {'name': 'dst_addr',    'len': 2,   'default': None},
-            {'name': 'start_index', 'len': 2,   'default': None},  
+            {'name': 'start_index', 'len': 1,   'default': None},  
             ],
         ZpiCommand.ZDO_MGMT_RTG_REQ:[
             {'name': 'cmd0',        'len': 1,   'default': b'\x25'},
@@ -1030,7 +1050,13 @@ class ZpiCommands(object):
                 ]
             },    
         b'\x64\x02':{ 
-            'name': ZpiCommand.AF_DATA_REQUEST_EXT_SRSP,  #shared with AF_DATA_REQ_SRC_RTG
+            'name': ZpiCommand.AF_DATA_REQUEST_EXT_SRSP,
+            'structure':[
+                {'name': 'status',              'len': 1},
+                ]
+            },    
+        b'\x64\x03':{ 
+            'name': ZpiCommand.AF_DATA_REQUEST_SRC_RTG_SRSP,
             'structure':[
                 {'name': 'status',              'len': 1},
                 ]
@@ -1690,4 +1716,14 @@ class ZpiCommands(object):
             },   
                                                     
         }
-    
\ No newline at end of file
+
+    #reverse indexes of the tables, built once: {packet id: name}
+    command_ids = dict(
+        (spec[0]['default'] + spec[1]['default'], name) 
+        for name, spec in sorted(znp_commands.iteritems()))
+    response_ids = dict(
+        (packet_id, packet['name']) 
+        for packet_id, packet in znp_responses.iteritems())
+    subsystem_ids = dict(
+        (packet_id, subsystem(packet_id)) 
+        for packet_id in list(command_ids) + list(response_ids))
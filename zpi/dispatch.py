@@ -0,0 +1,167 @@
+"""
+    AREQ subscription module
+
+    SubscriptionTable dispatches the AREQs from their raw frame data, keyed
+    by (response id, destination endpoint, cluster id): a frame is looked up
+    by its two command bytes and, for the responses addressed to an endpoint
+    and a cluster (AF_INCOMING_MSG, AF_INCOMING_MSG_EXT, ...), by the
+    dst_ep and cluster_id bytes read at their fixed offsets. Nothing else is
+    parsed before a subscriber is found, and a subscriber only gets the
+    fields it declared.
+"""
+import struct
+import threading
+
+__all__ = ['SubscriptionTable', 'Subscription']
+
+import logging
+log = logging.getLogger('zpi.dispatch')
+
+_CLUSTER_ID = struct.Struct('<H')
+
+
+class Subscription(object):
+    """
+        a handler of the AREQs of one (response id, endpoint, cluster id),
+        endpoint and cluster_id None matching any
+
+        handler(zpi, fields) gets {field_name: value} of the declared fields
+        and 'id', integers for the fields of 1, 2, 4 and 8 bytes and
+        memoryview slices of the frame for the variable length ones, all the
+        fields if none was declared.
+    """
+    def __init__(self, rsp_id, handler, endpoint, cluster_id, fields, reader):
+        self.rsp_id = rsp_id
+        self.handler = handler
+        self.endpoint = endpoint
+        self.cluster_id = cluster_id
+        self.fields = fields
+        self.read = reader
+
+    def __repr__(self):
+        return 'Subscription(%s, %r, %r)' % (self.rsp_id, self.endpoint,
+                                             self.cluster_id)
+
+
+class SubscriptionTable(object):
+    """
+        {packet id: {(endpoint, cluster id): subscriptions}} built from the
+        compiled response decoders
+
+        The table is replaced, not modified, on every change so that the
+        reader looks it up without a lock.
+    """
+    def __init__(self, decoders):
+        self._decoders = dict((decoder.name, decoder)
+                              for decoder in decoders.itervalues())
+        self._lock = threading.Lock()
+        self._table = {}    #packet id: (addressing, {(ep, cluster): subs})
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _addressing(decoder):
+        """
+            get (dst_ep offset, cluster_id offset) of a response, None if it
+            is not addressed to an endpoint and a cluster
+        """
+        dst_ep = decoder.offsets.get('dst_ep')
+        cluster_id = decoder.offsets.get('cluster_id')
+        if dst_ep is None or cluster_id is None or dst_ep[1] != 1 or \
+                cluster_id[1] != 2:
+            return None
+        return (dst_ep[0], cluster_id[0])
+
+    def add(self, rsp_id, handler, endpoint = None, cluster_id = None,
+            fields = None):
+        """
+            subscribe handler to the AREQs rsp_id, return the Subscription
+        """
+        decoder = self._decoders.get(rsp_id)
+        if decoder is None:
+            raise ValueError('Unknown response: %s' % repr(rsp_id))
+
+        addressing = self._addressing(decoder)
+        if addressing is None and (endpoint is not None or
+                                   cluster_id is not None):
+            raise ValueError('%s has no endpoint and cluster id' % rsp_id)
+
+        if fields is None:
+            reader = decoder.unpack
+        else:
+            fields = tuple(fields)
+            reader = decoder.field_reader(fields)
+        subscription = Subscription(rsp_id, handler, endpoint, cluster_id,
+                                    fields, reader)
+
+        with self._lock:
+            table = dict(self._table)
+            subscriptions = dict(table.get(decoder.packet_id,
+                                           (addressing, {}))[1])
+            key = (endpoint, cluster_id)
+            subscriptions[key] = subscriptions.get(key, ()) + (subscription, )
+            table[decoder.packet_id] = (addressing, subscriptions)
+            self._table = table
+            self._count += 1
+        return subscription
+
+    def remove(self, subscription):
+        """ unsubscribe, return False if subscription was not subscribed """
+        decoder = self._decoders[subscription.rsp_id]
+        key = (subscription.endpoint, subscription.cluster_id)
+        with self._lock:
+            entry = self._table.get(decoder.packet_id)
+            if entry is None or subscription not in entry[1].get(key, ()):
+                return False
+
+            table = dict(self._table)
+            subscriptions = dict(entry[1])
+            subscriptions[key] = tuple(sub for sub in subscriptions[key]
+                                       if sub is not subscription)
+            if not subscriptions[key]:
+                del subscriptions[key]
+            if subscriptions:
+                table[decoder.packet_id] = (entry[0], subscriptions)
+            else:
+                del table[decoder.packet_id]
+            self._table = table
+            self._count -= 1
+        return True
+
+    def match(self, data):
+        """
+            get the subscriptions of the frame data, most specific first, an
+            empty tuple if there is none
+        """
+        entry = self._table.get(data[0:2])
+        if entry is None:
+            return ()
+
+        addressing, subscriptions = entry
+        if addressing is None:
+            return subscriptions.get((None, None), ())
+
+        ep_offset, cluster_offset = addressing
+        if len(data) <= ep_offset or len(data) < cluster_offset + 2:
+            return ()
+        endpoint = ord(data[ep_offset])
+        cluster_id = _CLUSTER_ID.unpack_from(data, cluster_offset)[0]
+        get = subscriptions.get
+        return (get((endpoint, cluster_id), ()) + get((endpoint, None), ()) +
+                get((None, cluster_id), ()) + get((None, None), ()))
+
+    def notify(self, zpi, subscriptions, data, payload = None):
+        """
+            call the handlers of subscriptions with the fields they declared,
+            payload replacing the data field when it is given
+        """
+        for subscription in subscriptions:
+            try:
+                fields = subscription.read(data)
+                if payload is not None and 'data' in fields:
+                    fields['data'] = payload
+                subscription.handler(zpi, fields)
+            except Exception as e:
+                log.warning('%r handler error: %s' % (subscription, e))
@@ -3,6 +3,52 @@
 """
 
 import struct
+import operator
+from functools import reduce
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#fcs byte values, avoid packing a new byte for every frame
+_FCS_BYTES = [struct.pack('B', i) for i in range(256)]
+
+#payload size from which the optional numpy path is used
+FCS_NUMPY_THRESHOLD = 64
+FCS_USE_NUMPY = False
+
+def fcs(buf, start = 0, end = None, init = 0):
+    """
+        XOR checksum of buf[start:end], init is XORed into the result
+        
+        8 bytes are folded at a time as 64-bit words, the remaining bytes 
+        one by one. buf may be a str, bytearray or a buffer/memoryview.
+    """
+    if end is None:
+        end = len(buf)
+    
+    size = end - start
+    if (FCS_USE_NUMPY and numpy is not None 
+            and size >= FCS_NUMPY_THRESHOLD):
+        view = numpy.frombuffer(buf, numpy.uint8, size, start)
+        return init ^ int(numpy.bitwise_xor.reduce(view))
+    
+    words = size >> 3
+    value = 0
+    if words:
+        value = reduce(operator.xor, 
+                       struct.unpack_from('<%dQ' % words, buf, start), 0)
+        value ^= value >> 32
+        value ^= value >> 16
+        value ^= value >> 8
+        value &= 0xff
+        start += words << 3
+    
+    for byte in bytearray(buf[start:end]):
+        value ^= byte
+    
+    return value ^ init
 
 class ZnpFrame(object):
     """ 
@@ -43,6 +89,8 @@ class ZnpFrame(object):
     LEN_FCS = 1
     LEN_NOTDATA = LEN_SOF + LEN_LENGTH + LEN_CMD + LEN_FCS
     
+    MAX_LEN_DATA = 250
+    
     def __init__(self, data = b''):
         self.data = data
         self.raw_data = b''
@@ -54,10 +102,8 @@ class ZnpFrame(object):
             FCS: contain all bytes before FCS excluding SOF
         """
         if self.data is not None and len(self.data) > 0:
-            fcs = self.len_data()  #first XOR with len byte
-            for i in range(0, len(self.data)):
-                fcs = fcs ^ struct.unpack('B', self.data[i])[0]
-            return struct.pack('B',fcs)
+            #first XOR with len byte
+            return _FCS_BYTES[fcs(self.data, init = self.len_data())]
         else:
             raise ValueError('self.data is empty!')
         
@@ -148,4 +194,103 @@ class ZnpFrame(object):
         self.data = data
         if not self.verify(chksum):
             raise ValueError('Invalid checksum!')
-        
\ No newline at end of file
+        
+
+
+class ZnpFrameDecoder(object):
+    """
+        incremental decoder for the received byte stream
+        
+        Chunks of any size are fed in and complete, verified frames are 
+        returned. Bytes are kept in a preallocated buffer, a bad frame (wrong 
+        FCS or length) drops its SOF and decoding resumes at the next SOF.
+    """
+    BUFFER_SIZE = 4096
+    
+    def __init__(self, size = BUFFER_SIZE):
+        self._buf = bytearray(size)
+        self._head = 0      #first unconsumed byte
+        self._tail = 0      #end of received bytes
+        self.bad_frames = 0
+        
+    def pending(self):
+        """
+            number of buffered bytes not yet decoded into a frame
+        """
+        return self._tail - self._head
+        
+    def reset(self):
+        """
+            drop all buffered bytes
+        """
+        self._head = 0
+        self._tail = 0
+        
+    def _store(self, chunk):
+        """
+            append chunk to the buffer, compact or grow it if needed
+        """
+        size = len(chunk)
+        if self._tail + size > len(self._buf):
+            pending = self._tail - self._head
+            if pending + size > len(self._buf):
+                buf = bytearray(max(2 * len(self._buf), pending + size))
+            else:
+                buf = self._buf
+            buf[0:pending] = self._buf[self._head:self._tail]
+            self._buf = buf
+            self._head = 0
+            self._tail = pending
+        
+        self._buf[self._tail:self._tail + size] = chunk
+        self._tail += size
+        
+    def feed(self, chunk):
+        """
+            feed received bytes, return a list of complete ZnpFrame objects
+        """
+        if chunk:
+            self._store(chunk)
+        
+        frames = []
+        buf = self._buf
+        sof = ZnpFrame.SOF
+        
+        while True:
+            start = buf.find(sof, self._head, self._tail)
+            if start < 0:
+                #no SOF in buffered bytes, all of them are garbage
+                self.reset()
+                break
+            
+            self._head = start
+            if self._tail - start < ZnpFrame.LEN_SOF + ZnpFrame.LEN_LENGTH:
+                break
+            
+            data_len = buf[start + 1]
+            if data_len > ZnpFrame.MAX_LEN_DATA:
+                self.bad_frames += 1
+                self._head = start + 1
+                continue
+            
+            end = start + data_len + ZnpFrame.LEN_NOTDATA
+            if end > self._tail:
+                break   #wait for more bytes
+            
+            #FCS covers LEN, CMD and DATA and is checked in place
+            if fcs(buf, start + 1, end - 1) != buf[end - 1]:
+                #bad frame, resync on the next SOF
+                self.bad_frames += 1
+                self._head = start + 1
+                continue
+            
+            frame = ZnpFrame(bytes(buf[start + 2:end - 1]))
+            frame.raw_data = bytes(buf[start:end])
+            
+            self._head = end
+            frames.append(frame)
+        
+        if self._head == self._tail:
+            self.reset()
+        
+        return frames
@@ -0,0 +1,272 @@
+"""
+    request/response correlation module
+    
+    Every request waiting for a response owns a ZpiFuture. Futures waiting 
+    for the same response id are queued in PendingRequests in the order 
+    their requests were written, so each response is handed to the request 
+    it answers. AreqWaiters does the same for AREQs matched by a field 
+    value, e.g. the ZDO_NODE_DESC_RSP sent by a given src_addr.
+"""
+import collections
+import threading
+import time
+
+__all__ = ['ZpiFuture', 'PendingRequests', 'AreqWaiters', 
+           'CancelledException']
+
+class CancelledException(Exception):
+    """ the result of a cancelled future was requested """
+    pass
+
+class ZpiFuture(object):
+    """
+        the result of a request, set from the frame reader thread
+        
+        handler is an optional function applied to the received response, it 
+        runs once in the thread that first reads the result. cancel_error is 
+        the exception class raised by result() for a cancelled future.
+    """
+    def __init__(self, key = None, handler = None, 
+                 cancel_error = CancelledException):
+        self.key = key
+        self.handler = handler
+        self.cancel_error = cancel_error
+        self.created = time.time()
+        self.finished = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._response = None
+        self._result = None
+        self._exception = None
+        self._handled = False
+        self._cancelled = False
+        
+    def _complete(self, response, exception, cancelled = False):
+        """
+            set the final state once, return False if already done
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._response = response
+            self._exception = exception
+            self._cancelled = cancelled
+            self.finished = time.time()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        
+        for callback in callbacks:
+            callback(self)
+        return True
+        
+    def set_result(self, response):
+        """ set the received response """
+        return self._complete(response, None)
+        
+    def set_exception(self, exception):
+        """ fail the request """
+        return self._complete(None, exception)
+        
+    def cancel(self):
+        """ 
+            cancel the request, a response arriving later is dropped 
+        """
+        return self._complete(None, None, True)
+        
+    def done(self):
+        """ True if a response, an exception or a cancel arrived """
+        return self._event.is_set()
+        
+    def cancelled(self):
+        """ True if the future has been cancelled """
+        return self._cancelled
+        
+    def failed(self):
+        """ True if the request, or its handler once run, failed """
+        return self._exception is not None
+        
+    def wait(self, timeout = None):
+        """ wait until done, return False on timeout """
+        return self._event.wait(timeout)
+        
+    def result(self, timeout = None):
+        """
+            wait for and return the (handled) response
+            
+            a timeout or a cancelled future raises cancel_error, a failed 
+            request or handler raises its exception
+        """
+        if not self._event.wait(timeout) or self._cancelled:
+            raise self.cancel_error('Request %r cancelled or timed out.' % 
+                                    (self.key, ))
+        
+        with self._lock:
+            if not self._handled:
+                self._handled = True
+                if self._exception is None and self.handler is not None:
+                    try:
+                        self._result = self.handler(self._response)
+                    except Exception as e:
+                        self._exception = e
+                else:
+                    self._result = self._response
+        
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+        
+    def exception(self, timeout = None):
+        """ wait and return the exception of the request, None if succeeded """
+        try:
+            self.result(timeout)
+        except self.cancel_error:
+            raise
+        except Exception as e:
+            return e
+        return None
+        
+    def add_done_callback(self, callback):
+        """ 
+            call callback(future) when done, immediately if already done 
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+class PendingRequests(object):
+    """
+        FIFO queues of futures keyed by response id
+        
+        A response goes to the oldest live future of its key, the cancelled 
+        (timed out) futures queued before it are dropped: a lost response 
+        costs only the request it belonged to. A cancelled future with no 
+        newer future queued stays CANCELLED_GRACE seconds, so that a late 
+        response is absorbed by the request it belongs to instead of being 
+        handed to the next one.
+    """
+    CANCELLED_GRACE = 2.000
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        
+    def add(self, future):
+        """ queue a future under its key """
+        with self._lock:
+            queue = self._queues.get(future.key)
+            if queue is None:
+                queue = self._queues[future.key] = collections.deque()
+            else:
+                self._purge(queue)
+            queue.append(future)
+            
+    def remove(self, future):
+        """ remove a future, e.g. its request could not be written """
+        with self._lock:
+            queue = self._queues.get(future.key)
+            if queue is not None and future in queue:
+                queue.remove(future)
+                
+    def _purge(self, queue):
+        """ 
+            drop the cancelled futures at the head of the queue, but the last 
+            queued one until its grace time expires
+        """
+        expire = time.time() - self.CANCELLED_GRACE
+        while queue and queue[0].cancelled() and (
+                len(queue) > 1 or queue[0].finished < expire):
+            queue.popleft()
+            
+    def pop(self, key):
+        """ 
+            get the oldest future waiting for key, None if there is none 
+        """
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                return None
+            self._purge(queue)
+            if not queue:
+                return None
+            return queue.popleft()
+        
+    def count(self, key = None):
+        """ number of queued futures, for key or in total """
+        with self._lock:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return sum(len(queue) for queue in self._queues.values())
+        
+    def fail_all(self, exception):
+        """ fail all queued futures, e.g. when the reader stops """
+        with self._lock:
+            futures = [future for queue in self._queues.values() 
+                       for future in queue]
+            self._queues.clear()
+        
+        for future in futures:
+            future.set_exception(exception)
+
+class AreqWaiters(PendingRequests):
+    """
+        FIFO queues of futures waiting for an AREQ
+        
+        A future is keyed by (response id, field name, field value), field 
+        value being the raw bytes of the field, and it may carry a deadline 
+        after which it is dropped even if nobody cancelled it.
+    """
+    def __init__(self):
+        super(AreqWaiters, self).__init__()
+        self._fields = {}   #response id: names of the matched fields
+        self._expired = []
+        
+    def add(self, future, deadline = None):
+        """ queue a future keyed by (response id, field name, field value) """
+        future.deadline = deadline
+        rsp_id, field_name = future.key[0:2]
+        with self._lock:
+            self._fields.setdefault(rsp_id, set()).add(field_name)
+        super(AreqWaiters, self).add(future)
+        self._cancel_expired()
+        
+    def _purge(self, queue):
+        """ also drop the futures waiting past their deadline """
+        super(AreqWaiters, self)._purge(queue)
+        expire = time.time() - self.CANCELLED_GRACE
+        while (queue and not queue[0].done() and 
+               queue[0].deadline is not None and queue[0].deadline < expire):
+            self._expired.append(queue.popleft())
+            
+    def _cancel_expired(self):
+        """ cancel the dropped futures out of the lock """
+        with self._lock:
+            expired, self._expired = self._expired, []
+        for future in expired:
+            future.cancel()
+            
+    def waits_for(self, rsp_id):
+        """ True if futures have been waiting for the AREQ rsp_id """
+        return rsp_id in self._fields
+        
+    def match(self, rx_data):
+        """ 
+            get the oldest future waiting for the AREQ rx_data, None if there 
+            is none 
+        """
+        if rx_data['id'] not in self._fields:
+            return None
+        with self._lock:
+            field_names = tuple(self._fields[rx_data['id']])
+        
+        future = None
+        for field_name in field_names:
+            value = rx_data.get(field_name)
+            if value is not None:
+                future = self.pop((rx_data['id'], field_name, value))
+                if future is not None:
+                    break
+        self._cancel_expired()
+        return future
@@ -0,0 +1,191 @@
+"""
+    metrics module
+
+    Metrics holds counters and fixed bucket histograms labelled by command.
+    It is disabled unless an instance is set on a Znp/Zpi:
+        zpi.metrics = Metrics()
+    the instrumented paths then cost one attribute test when it is None.
+
+    Recorded by Zpi:
+        sreq_total, sreq_timeouts_total, sreq_errors_total      per SREQ
+        sreq_latency_seconds            SREQ written to SRSP received
+        zdo_total, zdo_timeouts_total, zdo_errors_total         per request
+        zdo_latency_seconds             request to AREQ response received
+        rx_frames_total                 per received response
+        bad_frames_total                frames dropped on a bad FCS
+        unknown_frames_total            frames of no known response
+                                        (see Znp.DROP_UNKNOWN_FRAMES)
+        malformed_frames_total          frames not matching their response
+        rx_dropped_total                frames dropped unparsed, e.g. the
+                                        unsubscribed AREQs
+
+    snapshot() returns them as a dictionary and prometheus() in the
+    Prometheus text exposition format, which start_http_server() serves.
+"""
+import bisect
+import threading
+
+__all__ = ['Metrics', 'Histogram', 'start_http_server']
+
+#latency buckets in seconds, from the UART frame time to the timeouts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.010, 0.020, 0.050, 0.100,
+                   0.200, 0.500, 1.0, 3.0)
+
+
+class Histogram(object):
+    """ counts of the observed values per bucket upper bound """
+    def __init__(self, bounds = LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)    #last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ add a value, the caller holds the lock of its Metrics """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def buckets(self):
+        """ get [(upper bound, cumulative count)], +Inf bound last """
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'), ), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return buckets
+
+
+class Metrics(object):
+    """
+        thread safe counters and histograms, {name: {label: value}}
+
+        The label is a command (or response) id, None for the metrics
+        without label.
+    """
+    def __init__(self, buckets = LATENCY_BUCKETS, prefix = 'zpi_'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def incr(self, name, label = None, value = 1):
+        """ add value to a counter """
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = {}
+            counter[label] = counter.get(label, 0) + value
+
+    def observe(self, name, label, value):
+        """ add a value to a histogram """
+        with self._lock:
+            histograms = self._histograms.get(name)
+            if histograms is None:
+                histograms = self._histograms[name] = {}
+            histogram = histograms.get(label)
+            if histogram is None:
+                histogram = histograms[label] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def track(self, kind, label, future):
+        """
+            count a request and record its latency, timeout or error once
+            its ZpiFuture is done (a timed out future is cancelled)
+        """
+        self.incr(kind + '_total', label)
+
+        def done(future):
+            if future.cancelled():
+                self.incr(kind + '_timeouts_total', label)
+            elif future.failed():
+                self.incr(kind + '_errors_total', label)
+            else:
+                self.observe(kind + '_latency_seconds', label,
+                             future.finished - future.created)
+        future.add_done_callback(done)
+
+    def reset(self):
+        """ clear all the metrics """
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def snapshot(self):
+        """
+            get {'counters': {name: {label: value}}, 'histograms': {name:
+            {label: {'buckets': [(bound, cumulative count)], 'sum', 'count'}}}}
+        """
+        with self._lock:
+            return {
+                'counters': dict((name, dict(counter)) for name, counter
+                                 in self._counters.iteritems()),
+                'histograms': dict(
+                    (name, dict((label, {'buckets': histogram.buckets(),
+                                         'sum': histogram.sum,
+                                         'count': histogram.count})
+                                for label, histogram in histograms.iteritems()))
+                    for name, histograms in self._histograms.iteritems())}
+
+    @staticmethod
+    def _labels(label, **extra):
+        """ format the labels of a sample """
+        labels = []
+        if label is not None:
+            labels.append('command="%s"' % label)
+        for name, value in sorted(extra.iteritems()):
+            labels.append('%s="%s"' % (name, value))
+        return '{%s}' % ','.join(labels) if labels else ''
+
+    def prometheus(self):
+        """ get the metrics in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines = []
+        for name, counter in sorted(snapshot['counters'].iteritems()):
+            name = self.prefix + name
+            lines.append('# TYPE %s counter' % name)
+            for label, value in sorted(counter.iteritems()):
+                lines.append('%s%s %d' % (name, self._labels(label), value))
+
+        for name, histograms in sorted(snapshot['histograms'].iteritems()):
+            name = self.prefix + name
+            lines.append('# TYPE %s histogram' % name)
+            for label, histogram in sorted(histograms.iteritems()):
+                for bound, count in histogram['buckets']:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket%s %d' % (
+                        name, self._labels(label, le = le), count))
+                lines.append('%s_sum%s %r' % (name, self._labels(label),
+                                              histogram['sum']))
+                lines.append('%s_count%s %d' % (name, self._labels(label),
+                                                histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def start_http_server(metrics, port, address = ''):
+    """
+        serve metrics.prometheus() over HTTP from a daemon thread, return the
+        server (shutdown() stops it)
+    """
+    import BaseHTTPServer
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus()
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target = server.serve_forever,
+                              name = 'ZpiMetricsHttp')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,141 @@
+"""
+    pipelined SREQ module
+    
+    A ZpiPipeline keeps up to `window` SREQs in flight on one Zpi instance. 
+    The Zpi API methods called through the pipeline return the ZpiFuture of 
+    their SRSP instead of waiting for it.
+"""
+import collections
+import threading
+import time
+
+__all__ = ['ZpiPipeline']
+
+class ZpiPipeline(object):
+    """
+        opt-in pipelined access to the SREQ methods of a Zpi instance
+        
+        usage:
+            pipe = zpi.pipeline(window = 16)
+            futures = [pipe.af_data_request(...) for ... in ...]
+            results = pipe.gather(futures)
+        or:
+            results = pipe.map('util_assoc_find_device', 
+                               [(n, ) for n in range(count)])
+        
+        SRSPs are matched to their requests as they arrive, so requests of 
+        the same or of different command ids may be in flight together. A 
+        request without SRSP after srsp_timeout seconds is cancelled and 
+        frees its window slot, its future raises SrspTimeoutException.
+    """
+    def __init__(self, zpi, window, srsp_timeout):
+        if window < 1:
+            raise ValueError('Invalid pipeline window: %s' % repr(window))
+        
+        self._zpi = zpi
+        self.window = window
+        self.srsp_timeout = srsp_timeout
+        self._cond = threading.Condition()
+        self._in_flight = collections.deque()   #(deadline, future)
+        
+    def __getattr__(self, name):
+        """
+            get the Zpi API method `name` running in pipelined mode
+        """
+        method = getattr(self._zpi, name)
+        if not callable(method):
+            raise AttributeError('Zpi has no method %s' % name)
+        
+        def pipelined(*args, **kwargs):
+            return self._zpi._sreq_pipelined(self, method, *args, **kwargs)
+        pipelined.__name__ = name
+        return pipelined
+        
+    def _expire(self, now):
+        """
+            drop done futures and cancel the expired ones, needs self._cond
+        """
+        in_flight = self._in_flight
+        while in_flight and (in_flight[0][1].done() or in_flight[0][0] <= now):
+            deadline, future = in_flight.popleft()
+            future.cancel()
+        
+    def _count(self):
+        """ number of unanswered futures, needs self._cond """
+        return sum(1 for deadline, future in self._in_flight 
+                   if not future.done())
+        
+    def in_flight(self):
+        """ number of SREQs waiting for their SRSP """
+        with self._cond:
+            return self._count()
+        
+    def submit(self, zpi_cmd, srsp_handler, srsp_timeout = 0, **kwargs):
+        """
+            send a SREQ once a window slot is free, return its future
+        """
+        srsp_timeout = max(srsp_timeout, self.srsp_timeout)
+        with self._cond:
+            while True:
+                now = time.time()
+                self._expire(now)
+                if self._count() < self.window:
+                    break
+                self._cond.wait(self._in_flight[0][0] - now)
+            
+            future = self._zpi._sreq_future(zpi_cmd, srsp_handler, **kwargs)
+            self._in_flight.append((now + srsp_timeout, future))
+        
+        future.add_done_callback(self._on_done)
+        return future
+        
+    def _on_done(self, future):
+        """ a SRSP arrived or the request was cancelled """
+        with self._cond:
+            self._cond.notify()
+        
+    def gather(self, futures):
+        """
+            wait for futures of this pipeline, return their results in order,
+            the first failed request raises its exception
+        """
+        return [self.result(future) for future in futures]
+        
+    def result(self, future):
+        """
+            wait for the result of a future of this pipeline
+        """
+        with self._cond:
+            for deadline, queued in self._in_flight:
+                if queued is future:
+                    break
+            else:
+                deadline = None
+        
+        if deadline is not None and not future.wait(
+                max(0.0, deadline - time.time())):
+            future.cancel()
+        
+        return future.result()
+        
+    def map(self, name, args_list):
+        """
+            call the Zpi method `name` once for each argument tuple, all calls 
+            pipelined, return their results in order
+        """
+        method = getattr(self, name)
+        return self.gather([method(*args) for args in args_list])
+        
+    def drain(self):
+        """
+            wait until all in-flight requests are answered or expired
+        """
+        while True:
+            with self._cond:
+                self._expire(time.time())
+                if not self._in_flight:
+                    return
+                deadline, future = self._in_flight[0]
+            
+            if not future.wait(max(0.0, deadline - time.time())):
+                future.cancel()
@@ -0,0 +1,417 @@
+"""
+    ZNP device simulator module
+
+    ZnpSimulator stands for the serial port of a CC2530-ZNP, so that the
+    whole stack runs without a radio:
+        sim = ZnpSimulator(latency = 0.002)
+        zpi = Zpi(sim, callback)
+    or, for a process expecting a serial device, over a pseudo terminal:
+        path = sim.open_pty()
+
+    Every SREQ of znp_commands gets its SRSP, built from znp_responses with
+    status Z_SUCCESS and the request fields of the same name. The AF data
+    requests are confirmed with AF_DATA_CONFIRM and the ZDO requests of
+    Zpi.ZDO_EXCHANGES answered with their AREQ response. A handler may be
+    set per command with on(). AREQ traffic is generated with send_areq()
+    and the flood_*() methods, e.g. thousands of AF_INCOMING_MSG per second.
+"""
+import heapq
+import itertools
+import os
+import select
+import struct
+import threading
+import time
+try:
+    import fcntl
+    import termios
+except ImportError:
+    pass    #inWaiting() falls back to select()
+
+from zpi.frame import ZnpFrame, ZnpFrameDecoder
+from zpi.codec import ResponseDecoder
+from zpi.command import ZpiCommand
+from zpi.zpi2 import Zpi, ZpiStatus
+
+__all__ = ['ZnpSimulator']
+
+import logging
+log = logging.getLogger('zpi.simulator')
+
+#typed field values by field size, other sizes are given as bytes
+_TYPED_CODES = {1: '<B', 2: '<H', 4: '<L', 8: '<Q'}
+
+
+class ZnpSimulator(object):
+    """
+        in-memory serial port answering as a ZNP device
+
+        latency is the delay of the SRSPs and areq_latency the one of the
+        AREQs answering a request, in seconds or as functions returning
+        seconds. SRSPs keep the order of their SREQs, as on a real device.
+
+        devices is {nwk_addr: ieee_addr} of the simulated network, used to
+        answer the address requests and to generate traffic, ieee_addr of an
+        unknown nwk_addr is IEEE_ADDR_BASE | nwk_addr.
+    """
+    IEEE_ADDR_BASE = 0x00124B0000000000
+
+    def __init__(self, latency = 0.0, areq_latency = 0.0, devices = None):
+        self.latency = latency
+        self.areq_latency = areq_latency
+        self.devices = dict(devices) if devices is not None else {}
+        self.handlers = {}      #command: handler(sim, command, request)
+
+        self.sreqs = 0          #requests received
+        self.srsps = 0          #responses sent
+        self.areqs = 0          #AREQs sent
+        self.unknown = 0        #frames of unknown commands
+
+        self._requests = {}     #packet id: (command, request decoder)
+        for command, spec in Zpi.znp_commands.iteritems():
+            packet_id = spec[0]['default'] + spec[1]['default']
+            self._requests[packet_id] = (command, ResponseDecoder(
+                packet_id, {'name': command, 'structure': spec[2:]}))
+        self._responses = dict((packet['name'], (packet_id, packet))
+                               for packet_id, packet
+                               in Zpi.znp_responses.iteritems())
+        self._zdo_rsp = dict((command, (exchange[1], exchange[3], exchange[4]))
+                             for command, exchange
+                             in Zpi.ZDO_EXCHANGES.iteritems())
+
+        self._rx_decoder = ZnpFrameDecoder()
+        self._rx_lock = threading.Lock()
+        self._out_r, self._out_w = os.pipe()
+        self._out_fd = self._out_w
+        self._fds = [self._out_r, self._out_w]  #closed by close()
+        self._tx_cond = threading.Condition()
+        self._tx_heap = []      #(due, seq, frame)
+        self._tx_seq = itertools.count()
+        self._srsp_due = 0
+        self._running = True
+        self._threads = []
+        self._start(self._tx_loop, 'ZnpSimulatorTx')
+
+    def _start(self, target, name, *args):
+        """ start a daemon thread """
+        thread = threading.Thread(target = target, name = name, args = args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    #serial port interface
+    def fileno(self):
+        return self._out_r
+
+    def inWaiting(self):
+        try:
+            return struct.unpack('i', fcntl.ioctl(self._out_r, termios.FIONREAD,
+                                                  b'\x00' * 4))[0]
+        except (IOError, NameError):
+            ready = select.select([self._out_r], [], [], 0)[0]
+            return 1 if ready else 0
+
+    def read(self, size = 1):
+        return os.read(self._out_r, size)
+
+    def write(self, data):
+        """ receive the frames written by the host """
+        with self._rx_lock:
+            frames = list(self._rx_decoder.feed(data))
+        for frame in frames:
+            if frame.data:
+                self._request(frame.data)
+        return len(data)
+
+    def isOpen(self):
+        return self._running
+
+    def close(self, timeout = 1.0):
+        """
+            stop the simulator and its threads, the frames not sent yet are 
+            dropped. The Zpi reading it must be halted first.
+        """
+        with self._tx_cond:
+            if self._fds is None:
+                return
+            self._running = False
+            self._tx_cond.notify()
+        fds, self._fds = self._fds, None
+        
+        #the read end first, a writer blocked on a full pipe fails
+        os.close(self._out_r)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        for fd in fds[1:]:
+            os.close(fd)
+
+    def open_pty(self):
+        """
+            serve the simulated device on a pseudo terminal instead, return
+            the path of its slave side for a serial port to open
+        """
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        self._fds.extend((master, slave))
+        self._out_fd = master
+        self._start(self._pty_loop, 'ZnpSimulatorPty', master)
+        return os.ttyname(slave)
+
+    def _pty_loop(self, master):
+        """ read the frames written to the pseudo terminal """
+        while self._running:
+            if not select.select([master], [], [], 0.1)[0]:
+                continue
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                break
+            self.write(data)
+
+    #frame output
+    @staticmethod
+    def _delay(latency):
+        return latency() if callable(latency) else latency
+
+    def _send(self, frame, delay, srsp = False):
+        """ queue a frame to go out after delay seconds """
+        due = time.time() + delay
+        with self._tx_cond:
+            if srsp:
+                #SRSPs go out in the order of their SREQs
+                due = self._srsp_due = max(due, self._srsp_due)
+            heapq.heappush(self._tx_heap, (due, next(self._tx_seq), frame))
+            self._tx_cond.notify()
+
+    def _tx_loop(self):
+        """ write the due frames, several at once """
+        heap = self._tx_heap
+        while True:
+            with self._tx_cond:
+                while self._running and (not heap or heap[0][0] > time.time()):
+                    self._tx_cond.wait(heap[0][0] - time.time() if heap
+                                       else None)
+                if not self._running:
+                    return
+                now = time.time()
+                frames = []
+                while heap and heap[0][0] <= now:
+                    frames.append(heapq.heappop(heap)[2])
+
+            data = b''.join(frames)
+            try:
+                while data:
+                    data = data[os.write(self._out_fd, data):]
+            except OSError:
+                return      #closed
+
+    #response building
+    def ieee_addr(self, nwk_addr):
+        """ get the IEEE address of a simulated device """
+        return self.devices.get(nwk_addr, self.IEEE_ADDR_BASE | nwk_addr)
+
+    def nwk_addr(self, ieee_addr):
+        """ get the network address of a simulated device """
+        for nwk_addr, value in self.devices.iteritems():
+            if value == ieee_addr:
+                return nwk_addr
+        return ieee_addr & 0xFFFF
+
+    def build(self, rsp_id, **fields):
+        """
+            build the frame data of the response rsp_id, fields are integers
+            or bytes, missing ones are zero (or empty)
+        """
+        packet_id, packet = self._responses[rsp_id]
+        data = [packet_id]
+        for field in packet['structure']:
+            value = fields.get(field['name'])
+            if isinstance(value, memoryview):
+                value = value.tobytes()
+            field_len = field['len']
+            if isinstance(field_len, int):
+                if value is None:
+                    value = b'\x00' * field_len
+                elif isinstance(value, (int, long)):
+                    if field_len in _TYPED_CODES:
+                        value = struct.pack(_TYPED_CODES[field_len], value)
+                    else:
+                        value = chr(value) + b'\x00' * (field_len - 1)
+                elif len(value) != field_len:
+                    raise ValueError("The data provided for '%s' was not %d "
+                                     "bytes long" % (field['name'], field_len))
+            elif field_len == 'null_terminated':
+                value = (value or b'') + b'\x00'
+            else:
+                value = value or b''
+            data.append(bytes(value))
+        return b''.join(data)
+
+    def send_areq(self, rsp_id, delay = 0.0, **fields):
+        """ send the AREQ rsp_id, see build() """
+        self._send(ZnpFrame(self.build(rsp_id, **fields)).output(), delay)
+        self.areqs += 1
+
+    def on(self, command, handler):
+        """
+            answer command with handler(sim, command, request) instead,
+            request being {field_name: value} as ResponseDecoder.unpack()
+            returns. The handler returns [(rsp_id, {field_name: value})] of
+            the responses to send, the first one as SRSP for a SREQ, or None
+            for the default answer.
+        """
+        if handler is None:
+            self.handlers.pop(command, None)
+        else:
+            self.handlers[command] = handler
+
+    def _request(self, data):
+        """ answer a frame written by the host """
+        entry = self._requests.get(data[0:2])
+        if entry is None:
+            self.unknown += 1
+            log.warning('Unknown command: %s' % data[0:2].encode('hex'))
+            return
+
+        command, decoder = entry
+        try:
+            request = decoder.unpack(data)
+        except ValueError as e:
+            log.warning('%s: %s' % (command, e))
+            return
+        self.sreqs += 1
+
+        handler = self.handlers.get(command)
+        responses = handler(self, command, request) if handler else None
+        if responses is None:
+            responses = self._default(command, data, request)
+
+        is_sreq = (ord(data[0]) >> 5) == ZnpFrame.CMD_SREQ
+        for rsp_id, fields in responses:
+            frame = ZnpFrame(self.build(rsp_id, **fields)).output()
+            if is_sreq:
+                self._send(frame, self._delay(self.latency), True)
+                self.srsps += 1
+                is_sreq = False
+            else:
+                self._send(frame, self._delay(self.areq_latency))
+                self.areqs += 1
+
+    def _default(self, command, data, request):
+        """ the default answers of a request """
+        responses = []
+        if (ord(data[0]) >> 5) == ZnpFrame.CMD_SREQ:
+            srsp_id = chr(0x60 | (ord(data[0]) & 0x1f)) + data[1]
+            srsp = Zpi.znp_responses.get(srsp_id)
+            if srsp is None:
+                self.unknown += 1
+                return responses
+            responses.append((srsp['name'], self._fill(srsp['name'],
+                                                       request)))
+
+        if command in (ZpiCommand.AF_DATA_REQUEST,
+                       ZpiCommand.AF_DATA_REQUEST_EXT,
+                       ZpiCommand.AF_DATA_REQUEST_SRC_RTG):
+            responses.append((ZpiCommand.AF_DATA_CONFIRM, {
+                'status': ZpiStatus.Z_SUCCESS,
+                'endpoint': request['src_ep'],
+                'trans_id': request['trans_id']}))
+        elif command in self._zdo_rsp:
+            dst_name, rsp_id, match_name = self._zdo_rsp[command]
+            fields = self._fill(rsp_id, request)
+            fields[match_name] = request[dst_name]
+            responses.append((rsp_id, fields))
+        return responses
+
+    def _fill(self, rsp_id, request):
+        """
+            response fields: success status, the request fields of the same
+            name and consistent addresses of the simulated devices
+        """
+        fields = dict(request)
+        fields['status'] = ZpiStatus.Z_SUCCESS
+        if 'nwk_addr_of_interest' in request:
+            fields['nwk_addr'] = request['nwk_addr_of_interest']
+
+        names = self._responses[rsp_id][1]['structure']
+        names = set(field['name'] for field in names)
+        if 'ieee_addr' in names and 'nwk_addr' in names:
+            if 'ieee_addr' in request:
+                fields['nwk_addr'] = self.nwk_addr(request['ieee_addr'])
+            elif 'nwk_addr' in fields:
+                fields['ieee_addr'] = self.ieee_addr(fields['nwk_addr'])
+        elif 'ext_addr' in names and 'nwk_addr' in request:
+            fields['ext_addr'] = self.ieee_addr(request['nwk_addr'])
+        elif 'nwk_addr' in names and 'ext_addr' in request:
+            fields['nwk_addr'] = self.nwk_addr(request['ext_addr'])
+        return fields
+
+    #traffic generators
+    def _flood(self, frames, count, rate):
+        """ send count frames of the frames generator at rate per second """
+        interval = 1.0 / rate if rate else 0.0
+        start = time.time()
+        for index in xrange(count):
+            if not self._running:
+                return
+            if interval:
+                delay = start + index * interval - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self._send(ZnpFrame(next(frames)).output(), 0.0)
+            self.areqs += 1
+
+    def flood_af_incoming(self, count, rate = None, src_addrs = None,
+                          cluster_id = 0x0006, dst_ep = 1, src_ep = 1,
+                          payload = b'\x18\x00\x0a\x00\x00\x10\x01',
+                          wait = False):
+        """
+            send count AF_INCOMING_MSG from the devices src_addrs in turn, at
+            rate frames per second or as fast as possible, from a thread
+            unless wait is True. Return the thread.
+        """
+        if src_addrs is None:
+            src_addrs = sorted(self.devices) or [0x0001]
+
+        def frames():
+            for trans_seq, src_addr in itertools.izip(
+                    itertools.count(), itertools.cycle(src_addrs)):
+                yield self.build(ZpiCommand.AF_INCOMING_MSG,
+                                 cluster_id = cluster_id, src_addr = src_addr,
+                                 src_ep = src_ep, dst_ep = dst_ep, lqi = 200,
+                                 time_stamp = int(time.time()) & 0xFFFFFFFF,
+                                 trans_seq = trans_seq & 0xFF,
+                                 len = len(payload), data = payload)
+        return self._run(self._flood, frames(), count, rate, wait)
+
+    def announce_devices(self, count = None, rate = None, wait = False):
+        """
+            send a ZDO_END_DEVICE_ANNCE_IND for count simulated devices, all
+            of them by default, see flood_af_incoming()
+        """
+        nwk_addrs = sorted(self.devices)[0:count]
+        if count is not None and len(nwk_addrs) < count:
+            #and new devices
+            new_addrs = (nwk_addr for nwk_addr in itertools.count(1)
+                         if nwk_addr not in self.devices)
+            nwk_addrs.extend(itertools.islice(new_addrs,
+                                              count - len(nwk_addrs)))
+
+        def frames():
+            for nwk_addr in nwk_addrs:
+                yield self.build(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND,
+                                 src_addr = nwk_addr, nwk_addr = nwk_addr,
+                                 ieee_addr = self.ieee_addr(nwk_addr),
+                                 cap = 0x8e)
+        return self._run(self._flood, frames(), len(nwk_addrs), rate, wait)
+
+    def _run(self, target, frames, count, rate, wait):
+        """ run a generator, in a thread unless wait is True """
+        if wait:
+            target(frames, count, rate)
+            return None
+        return self._start(target, 'ZnpSimulatorFlood', frames, count, rate)
@@ -0,0 +1,80 @@
+"""
+    source route cache module
+
+    A concentrator using many-to-one routing receives a ZDO_SRC_RTG_IND with 
+    the relay list of every route record reaching it. SourceRouteCache keeps 
+    the latest relay list per destination, so that a message can be sent 
+    with AF_DATA_REQUEST_SRC_RTG without a route discovery.
+"""
+import collections
+import threading
+import time
+
+__all__ = ['SourceRouteCache']
+
+class SourceRouteCache(object):
+    """
+        {destination nwk_addr: relay list} with TTL and LRU eviction
+        
+        A route is invalidated when its destination or one of its relays 
+        leaves or rejoins the network. ttl may be None for routes which 
+        never expire.
+    """
+    def __init__(self, capacity = 1024, ttl = 600.0):
+        if capacity < 1:
+            raise ValueError('Invalid source route cache capacity: %s' % 
+                             repr(capacity))
+        
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._routes = collections.OrderedDict()   #dst_addr: (relays, updated)
+        
+    def __len__(self):
+        return len(self._routes)
+        
+    def update(self, dst_addr, relays):
+        """ set the relay list of the route to dst_addr """
+        with self._lock:
+            self._routes.pop(dst_addr, None)
+            self._routes[dst_addr] = (tuple(relays), time.time())
+            while len(self._routes) > self.capacity:
+                self._routes.popitem(last = False)
+                
+    def get(self, dst_addr):
+        """ get the relay list of the route to dst_addr, None if unknown """
+        with self._lock:
+            route = self._routes.pop(dst_addr, None)
+            if route is None or (self.ttl is not None and 
+                                 route[1] + self.ttl < time.time()):
+                self.misses += 1
+                return None
+            self._routes[dst_addr] = route
+            self.hits += 1
+            return route[0]
+            
+    def invalidate(self, nwk_addr):
+        """ 
+            drop the routes to nwk_addr and the routes relayed by nwk_addr,
+            return the number of routes dropped
+        """
+        with self._lock:
+            dropped = [dst_addr for dst_addr, (relays, updated) 
+                       in self._routes.iteritems() 
+                       if dst_addr == nwk_addr or nwk_addr in relays]
+            for dst_addr in dropped:
+                del self._routes[dst_addr]
+            return len(dropped)
+            
+    def clear(self):
+        """ drop all the routes """
+        with self._lock:
+            self._routes.clear()
+            
+    def items(self):
+        """ get [(dst_addr, relays)] from the oldest used """
+        with self._lock:
+            return [(dst_addr, relays) for dst_addr, (relays, updated) 
+                    in self._routes.iteritems()]
@@ -0,0 +1,161 @@
+"""
+    ZDO management table decoding module
+
+    ZDO_MGMT_LQI_RSP, ZDO_MGMT_RTG_RSP and ZDO_MGMT_NWK_DISC_RSP carry pages 
+    of fixed size records. A RecordLayout decodes a whole page (or several 
+    pages joined) in one call into a RecordTable of columns: numpy arrays 
+    viewing a structured array when numpy is available, array.array columns 
+    filled by a single struct unpack otherwise.
+"""
+import array
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['RecordLayout', 'RecordTable', 'NBR_TABLE', 'RTG_TABLE', 
+           'NWK_DISC_TABLE', 'decode_nbr_table', 'decode_rtg_table', 
+           'decode_nwk_disc_table']
+
+#decode with numpy when it is installed
+TABLES_USE_NUMPY = True
+
+_NUMPY_CODES = {'B': 'u1', 'H': '<u2', 'L': '<u4', 'Q': '<u8'}
+
+def _array_code(code):
+    """ 
+        array typecode holding the values of a struct code, None if the 
+        values have to be kept in a list 
+    """
+    for array_code in (code, 'L'):
+        try:
+            if (array.array(array_code).itemsize >= 
+                    struct.calcsize('<' + code)):
+                return array_code
+        except ValueError:
+            #no 'Q' array in python 2
+            pass
+    return None
+
+class RecordTable(dict):
+    """
+        decoded table records, {column name: column}
+        
+        count is the number of records. records is the numpy structured 
+        array the columns are views of, None without numpy.
+    """
+    def __init__(self, layout, count, columns, records = None):
+        dict.__init__(self, columns)
+        self.layout = layout
+        self.count = count
+        self.records = records
+        
+    def rows(self):
+        """ iterate the records as {column name: int} """
+        names = self.layout.column_names
+        columns = [self[name].tolist() if hasattr(self[name], 'tolist') 
+                   else self[name] for name in names]
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+class RecordLayout(object):
+    """
+        layout of a fixed size table record
+        
+        fields are the (name, struct code) of the record in wire order, 
+        bitfields the (name, field name, shift, mask) columns extracted from 
+        the packed fields.
+    """
+    def __init__(self, name, fields, bitfields = ()):
+        self.name = name
+        self.fields = tuple(fields)
+        self.bitfields = tuple(bitfields)
+        self.codes = ''.join(code for field_name, code in self.fields)
+        self.size = struct.calcsize('<' + self.codes)
+        self.column_names = tuple([field_name for field_name, code in fields] + 
+                                  [bitfield[0] for bitfield in bitfields])
+        self._array_codes = [_array_code(code) for field_name, code in fields]
+        if numpy is not None:
+            self.dtype = numpy.dtype([(field_name, _NUMPY_CODES[code]) 
+                                      for field_name, code in fields])
+        else:
+            self.dtype = None
+        
+    def decode(self, data, count = None):
+        """
+            decode count records (all the records by default) of data, data 
+            may also be the list of record slices returned by the 
+            zdo_mgmt_*_rsp_handler methods
+        """
+        if isinstance(data, (list, tuple)):
+            data = b''.join(data)
+        if count is None:
+            count = len(data) // self.size
+        if count * self.size > len(data):
+            raise ValueError('%d %s records need %d bytes, %d received' % (
+                count, self.name, count * self.size, len(data)))
+        
+        if TABLES_USE_NUMPY and self.dtype is not None:
+            return self._decode_numpy(data, count)
+        return self._decode_struct(data, count)
+    
+    def _decode_numpy(self, data, count):
+        """ view data as a structured array """
+        records = numpy.frombuffer(data, self.dtype, count)
+        columns = dict((field_name, records[field_name]) 
+                       for field_name, code in self.fields)
+        for name, field_name, shift, mask in self.bitfields:
+            columns[name] = (columns[field_name] >> shift) & mask
+        return RecordTable(self, count, columns, records)
+        
+    def _decode_struct(self, data, count):
+        """ unpack all the records at once and split the values by column """
+        values = struct.unpack_from('<' + self.codes * count, data)
+        step = len(self.fields)
+        columns = {}
+        for index, (field_name, code) in enumerate(self.fields):
+            column = values[index::step]
+            array_code = self._array_codes[index]
+            columns[field_name] = (array.array(array_code, column) 
+                                   if array_code is not None else list(column))
+        for name, field_name, shift, mask in self.bitfields:
+            columns[name] = array.array('B', [(value >> shift) & mask 
+                                              for value in columns[field_name]])
+        return RecordTable(self, count, columns)
+    
+#neighbor table entry, 22 bytes, flags holds device_type, rx_on_when_idle 
+#and relationship
+NBR_TABLE = RecordLayout('neighbor table', 
+    [('ext_pan_id', 'Q'), ('ieee_addr', 'Q'), ('nwk_addr', 'H'), 
+     ('flags', 'B'), ('permit_joining', 'B'), ('depth', 'B'), ('lqi', 'B')],
+    [('device_type', 'flags', 0, 0x03), 
+     ('rx_on_when_idle', 'flags', 2, 0x03), 
+     ('relationship', 'flags', 4, 0x07)])
+
+#routing table entry, 5 bytes, the route status is in bits 0-2 of status
+RTG_TABLE = RecordLayout('routing table',
+    [('dst_addr', 'H'), ('status', 'B'), ('next_hop', 'H')],
+    [('route_status', 'status', 0, 0x07)])
+
+#network discovery entry, 6 bytes
+NWK_DISC_TABLE = RecordLayout('network discovery',
+    [('pan_id', 'H'), ('logical_channel', 'B'), ('profile_version', 'B'), 
+     ('beacon_superframe_order', 'B'), ('permit_join', 'B')],
+    [('stack_profile', 'profile_version', 0, 0x0f), 
+     ('zigbee_version', 'profile_version', 4, 0x0f), 
+     ('beacon_order', 'beacon_superframe_order', 0, 0x0f), 
+     ('superframe_order', 'beacon_superframe_order', 4, 0x0f)])
+
+def decode_nbr_table(data, count = None):
+    """ decode ZDO_MGMT_LQI_RSP neighbor table records """
+    return NBR_TABLE.decode(data, count)
+
+def decode_rtg_table(data, count = None):
+    """ decode ZDO_MGMT_RTG_RSP routing table records """
+    return RTG_TABLE.decode(data, count)
+
+def decode_nwk_disc_table(data, count = None):
+    """ decode ZDO_MGMT_NWK_DISC_RSP network records """
+    return NWK_DISC_TABLE.decode(data, count)
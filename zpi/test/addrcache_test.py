@@ -0,0 +1,249 @@
+"""
+    address cache tests
+
+    run: python -m unittest zpi.test.addrcache_test
+"""
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.addrcache import AddressCache
+from zpi.test.fakeport import FakePort, build, srsp
+
+SYS_VERSION = b'\x21\x02'
+ZDO_NWK_ADDR_REQ = b'\x25\x00'
+ZDO_IEEE_ADDR_REQ = b'\x25\x01'
+UTIL_ADDRMGR_EXT_ADDR_LOOKUP = b'\x27\x40'
+UTIL_ADDRMGR_NWK_ADDR_LOOKUP = b'\x27\x41'
+
+class AddressCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = AddressCache(capacity = 3, ttl = 60.0)
+        self.path = None
+        
+    def tearDown(self):
+        if self.path is not None:
+            shutil.rmtree(os.path.dirname(self.path))
+            
+    def temp_path(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'addresses.json')
+        return self.path
+        
+    def test_lookups(self):
+        self.cache.update(0x00124B0000000001, 0x0001)
+        self.assertEqual(self.cache.get_nwk_addr(0x00124B0000000001), 0x0001)
+        self.assertEqual(self.cache.get_ieee_addr(0x0001), 0x00124B0000000001)
+        self.assertEqual(self.cache.get_nwk_addr(0x00124B0000000002), None)
+        self.assertEqual(self.cache.get_ieee_addr(0x0002), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+        
+    def test_new_nwk_addr(self):
+        self.cache.update(0x00124B0000000001, 0x0001)
+        self.cache.update(0x00124B0000000001, 0x0101)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get_ieee_addr(0x0001), None)
+        self.assertEqual(self.cache.get_ieee_addr(0x0101), 0x00124B0000000001)
+        
+    def test_nwk_addr_taken_over(self):
+        self.cache.update(0x00124B0000000001, 0x0001)
+        self.cache.update(0x00124B0000000002, 0x0001)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get_nwk_addr(0x00124B0000000001), None)
+        self.assertEqual(self.cache.get_ieee_addr(0x0001), 0x00124B0000000002)
+        
+    def test_lru_eviction(self):
+        for index in range(1, 4):
+            self.cache.update(0x00124B0000000000 | index, index)
+        #used, so the entry of 2 becomes the oldest
+        self.cache.get_ieee_addr(1)
+        self.cache.update(0x00124B0000000004, 4)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get_ieee_addr(2), None)
+        self.assertEqual([nwk_addr for ieee_addr, nwk_addr, updated 
+                          in self.cache.items()], [3, 1, 4])
+        
+    def test_ttl(self):
+        self.cache.update(0x00124B0000000001, 0x0001, time.time() - 61.0)
+        self.cache.update(0x00124B0000000002, 0x0002, time.time() - 59.0)
+        self.assertEqual(self.cache.get_nwk_addr(0x00124B0000000001), None)
+        self.assertEqual(self.cache.get_ieee_addr(0x0001), None)
+        self.assertEqual(self.cache.get_nwk_addr(0x00124B0000000002), 0x0002)
+        
+        cache = AddressCache(ttl = None)
+        cache.update(0x00124B0000000001, 0x0001, 0.0)
+        self.assertEqual(cache.get_nwk_addr(0x00124B0000000001), 0x0001)
+        
+    def test_discard(self):
+        self.cache.update(0x00124B0000000001, 0x0001)
+        self.cache.update(0x00124B0000000002, 0x0002)
+        self.cache.discard(ieee_addr = 0x00124B0000000001)
+        self.cache.discard(nwk_addr = 0x0002)
+        self.cache.discard(nwk_addr = 0x0003)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.get_ieee_addr(0x0001), None)
+        
+    def test_save_load(self):
+        path = self.temp_path()
+        self.cache.update(0x00124B0000000001, 0x0001)
+        self.cache.update(0x00124B0000000002, 0x0002, time.time() - 30.0)
+        self.cache.save(path)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+        
+        cache = AddressCache(ttl = 60.0, path = path)
+        self.assertEqual(cache.load(), 2)
+        self.assertEqual(cache.items(), self.cache.items())
+        
+        #expired since
+        cache = AddressCache(ttl = 10.0)
+        self.assertEqual(cache.load(path), 1)
+        self.assertEqual(cache.get_ieee_addr(0x0001), 0x00124B0000000001)
+        
+    def test_load_missing(self):
+        self.assertEqual(self.cache.load(self.temp_path()), 0)
+        
+    def test_load_version(self):
+        path = self.temp_path()
+        with open(path, 'w') as f:
+            json.dump({'version': 0, 'entries': []}, f)
+        self.assertRaises(ValueError, self.cache.load, path)
+        
+    def test_invalid_capacity(self):
+        self.assertRaises(ValueError, AddressCache, 0)
+
+#nwk_addr: ieee_addr of the devices the FakePort answers for
+DEVICES = {0x1234: 0x00124B0001020304, 0x4444: 0x00124B0000004444, 
+           0x5555: 0x00124B0000005555}
+
+class ZpiAddressCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def respond(self, data):
+        """ answer the address requests from DEVICES """
+        nwk_addrs = dict((ieee_addr, nwk_addr) 
+                         for nwk_addr, ieee_addr in DEVICES.items())
+        if data[0:2] == UTIL_ADDRMGR_EXT_ADDR_LOOKUP:
+            nwk_addr = nwk_addrs[struct.unpack('<Q', data[2:10])[0]]
+            return [build(ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP_SRSP, 
+                          nwk_addr = nwk_addr)]
+        if data[0:2] == UTIL_ADDRMGR_NWK_ADDR_LOOKUP:
+            ieee_addr = DEVICES[struct.unpack('<H', data[2:4])[0]]
+            return [build(ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP_SRSP, 
+                          ext_addr = ieee_addr)]
+        if data[0:2] == ZDO_NWK_ADDR_REQ:
+            ieee_addr = struct.unpack('<Q', data[2:10])[0]
+            return [srsp(data), build(ZpiCommand.ZDO_NWK_ADDR_RSP, 
+                                      ieee_addr = ieee_addr, 
+                                      nwk_addr = nwk_addrs[ieee_addr])]
+        if data[0:2] == ZDO_IEEE_ADDR_REQ:
+            nwk_addr = struct.unpack('<H', data[2:4])[0]
+            return [srsp(data), build(ZpiCommand.ZDO_IEEE_ADDR_RSP, 
+                                      ieee_addr = DEVICES[nwk_addr], 
+                                      nwk_addr = nwk_addr)]
+        return [srsp(data)]
+        
+    def feed(self, *datas):
+        """ 
+            send AREQs and wait for their dispatching: the reader handles 
+            the frames in order, so they are done once a later SRSP is in 
+        """
+        self.port.feed(*datas)
+        self.zpi.sys_version()
+        
+    def sreqs(self):
+        """ number of SREQs sent but the sys_version() of feed() """
+        return len([data for data in self.port.requests 
+                    if data != SYS_VERSION])
+        
+    def test_lookups(self):
+        self.assertEqual(self.zpi.util_addrmgr_nwk_addr_lookup(0x1234), 
+                         0x00124B0001020304)
+        #cached by the first lookup
+        self.assertEqual(
+            self.zpi.util_addrmgr_ext_addr_lookup(0x00124B0001020304), 0x1234)
+        self.assertEqual(self.sreqs(), 1)
+        
+    def test_ext_addr_lookup(self):
+        #the SRSP nwk_addr has 2 bytes
+        self.assertEqual(
+            self.zpi.util_addrmgr_ext_addr_lookup(0x00124B0000004444), 0x4444)
+        self.assertEqual(self.port.requests, 
+                         [UTIL_ADDRMGR_EXT_ADDR_LOOKUP + 
+                          struct.pack('<Q', 0x00124B0000004444)])
+        
+    def test_device_announce(self):
+        self.feed(build(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND, 
+                        src_addr = 0x1234, nwk_addr = 0x1234, 
+                        ieee_addr = 0x00124B0001020304))
+        self.assertEqual(self.zpi.util_addrmgr_nwk_addr_lookup(0x1234), 
+                         0x00124B0001020304)
+        self.assertEqual(self.zpi.resolve_nwk_addr(0x00124B0001020304), 
+                         0x1234)
+        self.assertEqual(self.sreqs(), 0)
+        
+    def test_neighbor_table(self):
+        records = b''.join(struct.pack('<QQHBBBB', 1, ieee_addr, nwk_addr, 
+                                       0x25, 0, 1, 200) 
+                           for nwk_addr, ieee_addr in sorted(DEVICES.items()))
+        self.feed(build(ZpiCommand.ZDO_MGMT_LQI_RSP, 
+                        nbr_table_entries = len(DEVICES), 
+                        nbr_table_list_cnt = len(DEVICES), 
+                        nbr_table_list_records = records))
+        self.assertEqual(len(self.zpi.address_cache), len(DEVICES))
+        self.assertEqual(self.zpi.address_cache.get_nwk_addr(
+            0x00124B0000005555), 0x5555)
+        
+    def test_skipped_addresses(self):
+        #unknown IEEE address, broadcast network address, failed response
+        self.feed(build(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND, 
+                        nwk_addr = 0x0001, ieee_addr = 0), 
+                  build(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND, 
+                        nwk_addr = 0xFFFD, ieee_addr = 0x00124B0000000002), 
+                  build(ZpiCommand.ZDO_NWK_ADDR_RSP, status = 0x80, 
+                        nwk_addr = 0x0003, ieee_addr = 0x00124B0000000003))
+        self.assertEqual(len(self.zpi.address_cache), 0)
+        
+    def test_zdo_response(self):
+        self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x4444)
+        self.assertEqual(self.zpi.address_cache.get_ieee_addr(0x4444), 
+                         0x00124B0000004444)
+        
+    def test_leave(self):
+        self.zpi.address_cache.update(0x00124B0001020304, 0x1234)
+        self.feed(build(ZpiCommand.ZDO_LEAVE_IND, src_addr = 0x1234, 
+                        ext_addr = 0x00124B0001020304))
+        self.assertEqual(self.zpi.address_cache.get_ieee_addr(0x1234), None)
+        
+    def test_pipelined_hit(self):
+        self.zpi.address_cache.update(0x00124B0001020304, 0x1234)
+        pipe = self.zpi.pipeline()
+        future = pipe.util_addrmgr_nwk_addr_lookup(0x1234)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 0x00124B0001020304)
+        self.assertEqual(self.sreqs(), 0)
+        #the next call of the pipeline is pipelined again
+        future = pipe.util_addrmgr_nwk_addr_lookup(0x4444)
+        self.assertEqual(future.result(1.0), 0x00124B0000004444)
+        self.assertEqual(self.sreqs(), 1)
+        
+    def test_resolve_miss(self):
+        self.assertEqual(self.zpi.resolve_ieee_addr(0x4444), 
+                         0x00124B0000004444)
+        self.assertEqual(self.zpi.resolve_nwk_addr(0x00124B0000005555), 
+                         0x5555)
+        self.assertEqual([data[0:2] for data in self.port.requests], 
+                         [ZDO_IEEE_ADDR_REQ, ZDO_NWK_ADDR_REQ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+    huge AF message tests
+
+    run: python -m unittest zpi.test.af_test
+"""
+import io
+import struct
+import time
+import unittest
+
+from zpi.zpi2 import Zpi, ZpiStatus, ZpiStatusException
+from zpi.command import ZpiCommand
+from zpi.test.fakeport import FakePort, build, srsp
+
+AF_DATA_REQUEST_EXT = b'\x24\x02'
+AF_DATA_STORE = b'\x24\x11'
+AF_DATA_RETRIEVE = b'\x24\x12'
+
+TIME_STAMP = 0x11223344
+
+def payload(length):
+    """ get a recognizable payload of length bytes """
+    return bytes(bytearray(index % 251 for index in range(length)))
+
+class LargeMsgTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = None          #ZNP buffer of the huge outgoing message
+        self.sent = []              #payloads sent
+        self.incoming = b''         #payload of the huge incoming message
+        self.retrieved = []         #(index, len) of the AF_DATA_RETRIEVEs
+        self.store_status = {}      #{index: refused AF_DATA_STORE status}
+        self.retrieve_status = ZpiStatus.Z_SUCCESS
+        self.received = []
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port,
+                       lambda zpi, rx_data: self.received.append(rx_data))
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def respond(self, data):
+        """ keep the stored payloads as ZNP does """
+        if data[0:2] == AF_DATA_REQUEST_EXT:
+            length = struct.unpack('<H', data[20:22])[0]
+            if length and len(data) == 22:
+                self.buffer = bytearray(length)
+            else:
+                self.sent.append(data[22:])
+        elif data[0:2] == AF_DATA_STORE:
+            index = struct.unpack('<H', data[2:4])[0]
+            if index in self.store_status:
+                return [build(ZpiCommand.AF_DATA_STORE_SRSP,
+                              status = self.store_status[index])]
+            if len(data) > 5:
+                self.buffer[index:index + len(data) - 5] = data[5:]
+            else:
+                self.sent.append(bytes(self.buffer[0:index]))
+        elif data[0:2] == AF_DATA_RETRIEVE:
+            index, length = struct.unpack('<HB', data[6:9])
+            self.retrieved.append((index, length))
+            if self.retrieve_status != ZpiStatus.Z_SUCCESS:
+                return [build(ZpiCommand.AF_DATA_RETRIEVE_SRSP,
+                              status = self.retrieve_status)]
+            chunk = self.incoming[index:index + length]
+            return [build(ZpiCommand.AF_DATA_RETRIEVE_SRSP, len = len(chunk),
+                          data = chunk)]
+        return [srsp(data)]
+        
+    def send_large(self, data, **kwargs):
+        return self.zpi.send_large(0x02, 0x1234, 1, 0x0000, 1, 0x0006, 7,
+                                   0, 30, data, **kwargs)
+        
+    def incoming_msg(self, length):
+        """ feed a huge AF_INCOMING_MSG_EXT, its payload left in ZNP """
+        self.port.feed(build(ZpiCommand.AF_INCOMING_MSG_EXT,
+                             cluster_id = 0x0006, time_stamp = TIME_STAMP,
+                             len = length))
+        
+    def wait_received(self, timeout = 2.0):
+        deadline = time.time() + timeout
+        while not self.received and time.time() < deadline:
+            time.sleep(0.005)
+        return self.received[0]
+        
+    def test_send_large(self):
+        data = payload(1000)
+        self.assertEqual(self.send_large(data, window = 3),
+                         ZpiStatus.Z_SUCCESS)
+        self.assertEqual(self.sent, [data])
+        #the largest chunks a frame carries
+        stores = [data for data in self.port.requests
+                  if data[0:2] == AF_DATA_STORE]
+        self.assertEqual([len(data) - 5 for data in stores],
+                         [Zpi.AF_DATA_STORE_CHUNK] * 4 +
+                         [1000 - 4 * Zpi.AF_DATA_STORE_CHUNK, 0])
+        
+    def test_send_large_file(self):
+        data = payload(600)
+        self.send_large(io.BytesIO(data))
+        self.send_large(io.BytesIO(data), length = 400)
+        self.assertEqual(self.sent, [data, data[0:400]])
+        self.assertRaises(ValueError, self.send_large, io.BytesIO(data),
+                          length = 700)
+        
+    def test_send_small(self):
+        #sent inline, nothing stored
+        self.send_large(b'abc')
+        self.assertEqual(self.sent, [b'abc'])
+        self.assertEqual(self.buffer, None)
+        
+    def test_send_large_refused(self):
+        self.store_status[Zpi.AF_DATA_STORE_CHUNK] = ZpiStatus.ZMEM_ERROR
+        try:
+            self.send_large(payload(1000))
+        except ZpiStatusException as e:
+            self.assertEqual(e.status, ZpiStatus.ZMEM_ERROR)
+        else:
+            self.fail('refused chunk')
+        self.assertEqual(self.sent, [])
+        
+    def test_receive_large(self):
+        self.incoming = payload(1000)
+        self.assertEqual(self.zpi.receive_large(TIME_STAMP, 1000, window = 3),
+                         self.incoming)
+        out = io.BytesIO()
+        self.assertEqual(self.zpi.receive_large(TIME_STAMP, 1000, out), 1000)
+        self.assertEqual(out.getvalue(), self.incoming)
+        #each retrieval ends with a zero length retrieve freeing the buffer
+        self.assertEqual([request for request in self.retrieved
+                          if request[1] == 0], [(1000, 0), (1000, 0)])
+        
+    def test_incoming_large(self):
+        self.incoming = payload(500)
+        waiter = self.zpi.expect_areq(ZpiCommand.AF_INCOMING_MSG_EXT,
+                                      'time_stamp',
+                                      struct.pack('<L', TIME_STAMP))
+        self.incoming_msg(500)
+        self.assertEqual(waiter.result(2.0)['data'], self.incoming)
+        rx_data = self.wait_received()
+        self.assertEqual(self.zpi.af_incoming_msg_ext_handler(
+            rx_data)[-1].tobytes(), self.incoming)
+        
+    def test_incoming_large_refused(self):
+        self.retrieve_status = ZpiStatus.Z_FAILURE
+        waiter = self.zpi.expect_areq(ZpiCommand.AF_INCOMING_MSG_EXT,
+                                      'time_stamp',
+                                      struct.pack('<L', TIME_STAMP))
+        self.incoming_msg(500)
+        self.assertRaises(ZpiStatusException, waiter.result, 2.0)
+        #delivered without its payload, the buffer freed all the same
+        self.assertEqual(self.wait_received().get('data', b''), b'')
+        self.assertEqual(self.retrieved[-1], (500, 0))
+
+if __name__ == '__main__':
+    unittest.main()
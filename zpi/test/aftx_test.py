@@ -0,0 +1,192 @@
+"""
+    AF transmit queue tests
+
+    run: python -m unittest zpi.test.aftx_test
+"""
+import struct
+import time
+import unittest
+
+from zpi.zpi2 import Zpi, ZpiStatus, ZpiStatusException
+from zpi.command import ZpiCommand
+from zpi.test.fakeport import FakePort, build, srsp
+
+AF_DATA_REQUEST = b'\x24\x01'
+
+class AfTransmitQueueTest(unittest.TestCase):
+    def setUp(self):
+        #{dst_addr: [confirm status]} used in order, a success once empty;
+        #a None status holds the request until confirm() is called
+        self.statuses = {}
+        self.srsp_status = {}   #{dst_addr: [AF_DATA_REQUEST_SRSP status]}
+        self.held = []          #trans_ids of the requests not confirmed yet
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        self.queue = None
+        
+    def tearDown(self):
+        if self.queue is not None:
+            self.queue.close()
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def respond(self, data):
+        if data[0:2] != AF_DATA_REQUEST:
+            return [srsp(data)]
+        dst_addr = struct.unpack('<H', data[2:4])[0]
+        trans_id = ord(data[8])
+        srsp_statuses = self.srsp_status.get(dst_addr)
+        if srsp_statuses:
+            return [build(ZpiCommand.AF_DATA_REQUEST_SRSP,
+                          status = srsp_statuses.pop(0))]
+        statuses = self.statuses.get(dst_addr)
+        status = statuses.pop(0) if statuses else ZpiStatus.Z_SUCCESS
+        if status is None:
+            self.held.append(trans_id)
+            return [srsp(data)]
+        return [srsp(data), build(ZpiCommand.AF_DATA_CONFIRM, status = status,
+                                  endpoint = 1, trans_id = trans_id)]
+        
+    def confirm(self, trans_id, status = ZpiStatus.Z_SUCCESS):
+        self.held.remove(trans_id)
+        self.port.feed(build(ZpiCommand.AF_DATA_CONFIRM, status = status,
+                             endpoint = 1, trans_id = trans_id))
+        
+    def wait_held(self, count, timeout = 1.0):
+        deadline = time.time() + timeout
+        while len(self.held) < count and time.time() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(len(self.held), count)
+        
+    def transmit_queue(self, **kwargs):
+        self.queue = self.zpi.af_transmit_queue(**kwargs)
+        return self.queue
+        
+    def submit(self, dst_addr = 0x0001):
+        return self.queue.submit(dst_addr, 1, 1, 0x0006, b'\x01\x02')
+        
+    def test_confirms(self):
+        self.transmit_queue()
+        futures = [self.submit(0x1000 + i) for i in range(20)]
+        self.assertEqual([future.result(5.0) for future in futures],
+                         [ZpiStatus.Z_SUCCESS] * 20)
+        self.assertEqual((self.queue.sent, self.queue.confirmed,
+                          self.queue.pending()), (20, 20, 0))
+        #the queue numbers the messages itself
+        trans_ids = [ord(data[8]) for data in self.port.requests
+                     if data[0:2] == AF_DATA_REQUEST]
+        self.assertEqual(len(set(trans_ids)), 20)
+        
+    def test_window_limits_in_flight(self):
+        self.statuses[0x0001] = [None] * 6
+        self.transmit_queue(window = 3)
+        futures = [self.submit() for i in range(6)]
+        self.wait_held(3)
+        time.sleep(0.05)
+        self.assertEqual(len(self.held), 3)
+        self.assertEqual(self.queue.pending(), 6)
+        
+        self.confirm(self.held[0])
+        self.assertEqual(futures[0].result(1.0), ZpiStatus.Z_SUCCESS)
+        self.wait_held(3)
+        
+    def test_window_grows(self):
+        self.transmit_queue(window = 2, max_window = 4)
+        for i in range(40):
+            self.submit()
+        self.assertTrue(self.queue.drain(5.0))
+        self.assertEqual(self.queue.window, 4)
+        
+    def test_congestion(self):
+        self.statuses[0x0001] = [ZpiStatus.ZBUFFER_FULL, ZpiStatus.ZMAC_NO_ACK]
+        self.transmit_queue(window = 8)
+        self.assertEqual(self.submit().result(5.0), ZpiStatus.Z_SUCCESS)
+        self.assertEqual(self.queue.retried, 2)
+        self.assertTrue(self.queue.window < 8)
+        #every try had its own trans_id
+        self.assertEqual(len(set(data[8] for data in self.port.requests)), 3)
+        
+    def test_refused_request(self):
+        #ZBUFFER_FULL in the SRSP, retried without confirm
+        self.srsp_status[0x0001] = [ZpiStatus.ZBUFFER_FULL]
+        self.transmit_queue(window = 8)
+        self.assertEqual(self.submit().result(5.0), ZpiStatus.Z_SUCCESS)
+        self.assertEqual((self.queue.sent, self.queue.retried), (2, 1))
+        
+    def test_retries_exhausted(self):
+        self.statuses[0x0001] = [ZpiStatus.ZNWK_NO_ROUTE] * 2
+        self.transmit_queue(retries = 1)
+        future = self.submit()
+        try:
+            future.result(5.0)
+        except ZpiStatusException as e:
+            self.assertEqual(e.status, ZpiStatus.ZNWK_NO_ROUTE)
+        else:
+            self.fail('ZpiStatusException not raised')
+        self.assertEqual(self.queue.failed, 1)
+        
+    def test_failure_status(self):
+        #not a congestion status, failed without retry
+        self.statuses[0x0001] = [ZpiStatus.Z_FAILURE]
+        self.transmit_queue()
+        self.assertRaises(ZpiStatusException, self.submit().result, 5.0)
+        self.assertEqual(self.queue.retried, 0)
+        
+    def test_confirm_timeout(self):
+        self.statuses[0x0001] = [None]
+        self.transmit_queue(confirm_timeout = 0.1)
+        self.assertEqual(self.submit().result(5.0), ZpiStatus.Z_SUCCESS)
+        self.assertEqual(self.queue.retried, 1)
+        
+    def test_close(self):
+        #nothing confirmed, the window stays full
+        self.statuses[0x0001] = [None] * 3
+        self.transmit_queue(window = 1)
+        futures = [self.submit() for i in range(3)]
+        self.wait_held(1)
+        self.queue.close()
+        self.assertTrue(futures[2].cancelled())
+        self.assertRaises(ValueError, self.submit)
+        
+        #the message in flight still gets its confirm
+        self.confirm(self.held[0])
+        self.assertEqual(futures[0].result(1.0), ZpiStatus.Z_SUCCESS)
+        
+    def test_congestion_after_close(self):
+        self.statuses[0x0001] = [None]
+        self.transmit_queue()
+        future = self.submit()
+        self.wait_held(1)
+        self.queue.close()
+        self.confirm(self.held[0], ZpiStatus.ZBUFFER_FULL)
+        self.assertTrue(self.queue.drain(1.0))
+        self.assertTrue(future.cancelled())
+        self.assertEqual(self.queue.retried, 0)
+        
+    def test_expect_areq(self):
+        confirm = self.zpi.expect_areq(ZpiCommand.AF_DATA_CONFIRM,
+                                       'trans_id', b'\x07', time.time() + 5.0)
+        self.port.feed(build(ZpiCommand.AF_DATA_CONFIRM, trans_id = 7))
+        self.assertEqual(confirm.result(1.0)['trans_id'], b'\x07')
+        
+        #a cancelled waiter lets the confirm go to the callback
+        received = []
+        self.zpi._async_callback = lambda zpi, rx_data: received.append(
+            rx_data['trans_id'])
+        confirm = self.zpi.expect_areq(ZpiCommand.AF_DATA_CONFIRM,
+                                       'trans_id', b'\x08')
+        self.assertTrue(confirm.cancel())
+        self.zpi._areq_waiters.CANCELLED_GRACE = 0
+        time.sleep(0.01)
+        self.port.feed(build(ZpiCommand.AF_DATA_CONFIRM, trans_id = 8))
+        self.zpi.sys_version()
+        self.assertEqual(received, [b'\x08'])
+        
+    def test_invalid_window(self):
+        self.assertRaises(ValueError, self.zpi.af_transmit_queue,
+                          window = 0)
+        self.assertRaises(ValueError, self.zpi.af_transmit_queue,
+                          window = 8, max_window = 4)
+
+if __name__ == '__main__':
+    unittest.main()
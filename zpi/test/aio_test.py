@@ -0,0 +1,208 @@
+"""
+    asyncio front end tests
+    
+    run: python -m unittest zpi.test.aio_test
+"""
+import io
+import struct
+import time
+import unittest
+
+try:
+    from zpi.aio import AsyncZpi, asyncio
+except ImportError:
+    AsyncZpi = None     #neither asyncio nor trollius
+
+from zpi.zpi2 import (ZpiStatus, SrspTimeoutException, AreqTimeoutException, 
+                      ZpiStatusException)
+from zpi.command import ZpiCommand
+from zpi.capture import CaptureWriter, read_capture, CAPTURE_RX, CAPTURE_TX
+from zpi.test.fakeport import FakePort, build, srsp
+
+SYS_VERSION = b'\x21\x02'
+ZDO_IEEE_ADDR_REQ = b'\x25\x01'
+
+def reset_ind(reason):
+    return build(ZpiCommand.SYS_RESET_IND, reason = reason)
+
+@unittest.skipIf(AsyncZpi is None, 'asyncio is not available')
+class AsyncZpiTest(unittest.TestCase):
+    def setUp(self):
+        self.answer = True      #answer SYS_VERSION
+        self.port = FakePort(self.respond)
+        self.loop = asyncio.new_event_loop()
+        self.zpi = AsyncZpi(self.port, self.loop)
+        
+    def tearDown(self):
+        self.zpi.close()
+        self.port.close()
+        self.loop.close()
+        
+    def respond(self, data):
+        if data[0:2] == SYS_VERSION and not self.answer:
+            return []
+        if data[0:2] == ZDO_IEEE_ADDR_REQ:
+            #0x2222 refuses the request, 0x3333 does not answer it
+            nwk_addr = struct.unpack('<H', data[2:4])[0]
+            if nwk_addr == 0x2222:
+                return [build(ZpiCommand.ZDO_IEEE_ADDR_REQ_SRSP, 
+                              status = ZpiStatus.Z_FAILURE)]
+            if nwk_addr == 0x3333:
+                return [srsp(data)]
+            return [srsp(data), build(ZpiCommand.ZDO_IEEE_ADDR_RSP, 
+                                      ieee_addr = 0x10000 | nwk_addr, 
+                                      nwk_addr = nwk_addr)]
+        return [srsp(data)]
+        
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+        
+    def pending(self):
+        """ the ZpiFutures of the SREQs sent """
+        return [future for queue in self.zpi._pending_srsp._queues.values() 
+                for future in queue]
+        
+    def test_sreq(self):
+        self.assertEqual(self.run_until_complete(self.zpi.sys_version()),
+                         (0, 0, 0, 0, 0))
+        self.assertEqual(self.port.requests, [SYS_VERSION])
+        
+    def test_srsp_timeout(self):
+        self.answer = False
+        future = self.zpi._sreq(ZpiCommand.SYS_VERSION,
+                                self.zpi._sys_version_srsp_handler, 0.05)
+        self.assertRaises(SrspTimeoutException, self.run_until_complete,
+                          future)
+        self.assertTrue(self.pending()[0].cancelled())
+        
+    def test_cancel(self):
+        #cancelling the asyncio future gives up the SREQ
+        self.answer = False
+        future = self.zpi.sys_version()
+        self.assertFalse(self.pending()[0].done())
+        future.cancel()
+        self.run_until_complete(asyncio.sleep(0, loop = self.loop))
+        self.assertTrue(self.pending()[0].cancelled())
+        
+    def test_close(self):
+        self.answer = False
+        future = self.zpi.sys_version()
+        self.zpi.close()
+        self.assertRaises(SrspTimeoutException, self.run_until_complete,
+                          future)
+        
+    def test_write_error(self):
+        #failed by the writer thread, settled in the loop thread
+        def write(data):
+            raise IOError('port closed')
+        self.port.write = write
+        self.assertRaises(IOError, self.run_until_complete, 
+                          self.zpi.sys_version())
+        self.assertNotEqual(self.zpi._tx_thread, None)
+        
+    def test_zdo_exchange(self):
+        result = self.run_until_complete(self.zpi.zdo_exchange(
+            ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x1111))
+        self.assertEqual(result[1:3], (0x11111, 0x1111))
+        
+        self.assertRaises(ZpiStatusException, self.run_until_complete, 
+                          self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, 
+                                                0x2222))
+        self.assertRaises(AreqTimeoutException, self.run_until_complete, 
+                          self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, 
+                                                0x3333, areq_timeout = 0.05))
+        
+    def test_zdo_exchange_many(self):
+        results = self.run_until_complete(self.zpi.zdo_exchange_many(
+            [(ZpiCommand.ZDO_IEEE_ADDR_REQ, (nwk_addr, )) 
+             for nwk_addr in (0x1111, 0x2222, 0x3333, 0x4444)], 
+            areq_timeout = 0.05))
+        self.assertEqual((results[0][2], results[3][2]), (0x1111, 0x4444))
+        self.assertIsInstance(results[1], ZpiStatusException)
+        self.assertIsInstance(results[2], AreqTimeoutException)
+        
+    def test_resolve(self):
+        self.assertEqual(self.run_until_complete(
+            self.zpi.resolve_ieee_addr(0x1111)), 0x11111)
+        self.assertRaises(ZpiStatusException, self.run_until_complete, 
+                          self.zpi.resolve_ieee_addr(0x2222))
+        #cached
+        future = self.zpi.resolve_nwk_addr(0x11111)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 0x1111)
+        self.assertEqual(len(self.port.requests), 2)
+        
+    def test_expect_areq(self):
+        future = self.zpi.expect_areq(ZpiCommand.AF_DATA_CONFIRM, 'trans_id', 
+                                      b'\x07')
+        self.port.feed(build(ZpiCommand.AF_DATA_CONFIRM, trans_id = 6), 
+                       build(ZpiCommand.AF_DATA_CONFIRM, trans_id = 7))
+        self.assertEqual(self.run_until_complete(future)['trans_id'], b'\x07')
+        
+        future = self.zpi.expect_areq(ZpiCommand.AF_DATA_CONFIRM, 'trans_id', 
+                                      b'\x08', time.time() + 0.05)
+        self.assertRaises(AreqTimeoutException, self.run_until_complete, 
+                          future)
+        
+        #cancelling the asyncio future cancels the waiter
+        future = self.zpi.expect_areq(ZpiCommand.AF_DATA_CONFIRM, 'trans_id', 
+                                      b'\x09')
+        future.cancel()
+        self.run_until_complete(asyncio.sleep(0, loop = self.loop))
+        self.assertTrue(self.zpi._areq_waiters.pop(
+            (ZpiCommand.AF_DATA_CONFIRM, 'trans_id', b'\x09')).cancelled())
+        
+        #the awaited AREQs are queued as well
+        self.assertEqual([self.run_until_complete(self.zpi.next_areq())
+                          ['trans_id'] for i in range(2)], [b'\x06', b'\x07'])
+        
+    def test_areq_queue(self):
+        self.port.feed(reset_ind(1), reset_ind(2))
+        for reason in (b'\x01', b'\x02'):
+            rx_data = self.run_until_complete(self.zpi.next_areq())
+            self.assertEqual(rx_data['id'], ZpiCommand.SYS_RESET_IND)
+            self.assertEqual(rx_data['reason'], reason)
+        self.assertEqual(self.zpi.areq_dropped, 0)
+        
+    def test_queue_full(self):
+        #the oldest AREQs are dropped
+        self.zpi.close()
+        self.zpi = AsyncZpi(self.port, self.loop, areq_queue_size = 2)
+        self.port.feed(*[reset_ind(reason) for reason in range(5)])
+        self.run_until_complete(self.zpi.sys_version())
+        self.assertEqual(self.zpi.areq_dropped, 3)
+        self.assertEqual(self.run_until_complete(
+            self.zpi.next_areq())['reason'], b'\x03')
+        
+    def test_callback(self):
+        received = []
+        self.zpi.close()
+        self.zpi = AsyncZpi(self.port, self.loop,
+                            lambda zpi, rx_data: received.append(rx_data))
+        self.port.feed(reset_ind(1))
+        self.run_until_complete(self.zpi.sys_version())
+        self.assertEqual([rx_data['reason'] for rx_data in received],
+                         [b'\x01'])
+        self.assertTrue(self.zpi._areq_queue.empty())
+        
+    def test_capture(self):
+        #the frames read by the loop are recorded as well
+        output = io.BytesIO()
+        self.zpi.capture = CaptureWriter(output)
+        self.port.feed(reset_ind(1))
+        self.run_until_complete(self.zpi.next_areq())
+        self.run_until_complete(self.zpi.sys_version())
+        self.zpi.capture.close()
+        self.assertEqual([(direction, data[0:2]) for timestamp, direction, 
+                          data in read_capture(io.BytesIO(output.getvalue()))], 
+                         [(CAPTURE_RX, b'\x41\x80'), (CAPTURE_TX, SYS_VERSION), 
+                          (CAPTURE_RX, b'\x61\x02')])
+        
+    def test_thread_helpers(self):
+        #the Zpi helpers waiting in the calling thread are not inherited
+        for name in ('pipeline', 'zdo_mgmt_lqi_iter', 'topology_crawler', 
+                     'af_transmit_queue', 'send_large', 'receive_large'):
+            self.assertFalse(hasattr(AsyncZpi, name), name)
+
+if __name__ == '__main__':
+    unittest.main()
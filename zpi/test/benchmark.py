@@ -0,0 +1,356 @@
+"""
+    benchmarks of the frame processing path
+
+    Each stage is measured on its own:
+        fcs             checksum, per-byte reference against folded
+        frame           ZnpFrame.output(), ZnpFrame.parse() and the
+                        incremental ZnpFrameDecoder
+        build_frame     Znp._build_frame() per command
+        split_response  Znp._split_response() per response
+        dispatch        the reader work per AREQ: _filter_frame(),
+                        _split_response() and _callback_dispatcher(), with
+                        an async callback or subscriptions
+        unknown         the same for a frame of no known response, raised 
+                        by _split_response() or dropped by _filter_frame()
+        roundtrip       sys_version() and af_data_request() against the
+                        in-process ZNP simulator
+
+    Every result gives operations per second, p50/p99 latency and, where
+    tracemalloc and its reset_peak() are available (python 3.9+), the bytes
+    allocated per operation. Python 2 has no byte counter: an interpreter
+    built with COUNT_ALLOCS (sys.getcounts()) gives the objects allocated
+    per operation instead, temporaries included. gc.get_count() and objgraph
+    only see the objects still alive, so they are not used. On a regular
+    python 2 build the alloc columns are left out.
+
+    run: python -m zpi.test.benchmark [--json results.json] [--quick]
+"""
+import argparse
+import json
+import os
+import platform
+import struct
+import sys
+import time
+import timeit
+
+from zpi.frame import ZnpFrame, ZnpFrameDecoder, fcs
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PAYLOAD_SIZES = (0, 16, 32, 64, 128, 250)
+
+def _fcs_per_byte(data, init):
+    """ the former byte-by-byte checksum, used as reference """
+    value = init
+    for i in range(0, len(data)):
+        value = value ^ struct.unpack('B', data[i])[0]
+    return value
+
+def _frames_per_second(func, number):
+    """ best of 3 runs, in calls per second """
+    best = min(timeit.repeat(func, repeat = 3, number = number))
+    return number / best if best > 0 else float('inf')
+
+def _percentile(values, fraction):
+    """ nearest rank percentile of sorted values """
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+def _alloc_bytes(func, number = 100):
+    """
+        mean bytes allocated by one call at its peak, None without
+        tracemalloc (or its reset_peak())
+    """
+    if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        return None
+
+    func()  #warm up caches
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(number):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func()
+            total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return total / float(number)
+
+def _alloc_objects(func, number = 100):
+    """
+        mean objects allocated by one call, None unless the interpreter
+        counts its allocations per type (COUNT_ALLOCS, python 2)
+    """
+    getcounts = getattr(sys, 'getcounts', None)
+    if getcounts is None:
+        return None
+
+    def allocs():
+        return sum(count[1] for count in getcounts())
+
+    func()  #warm up caches
+    #the counting allocates too, its own share is measured first
+    base = allocs()
+    overhead = allocs() - base
+    base = allocs()
+    for i in range(number):
+        func()
+    return max(allocs() - base - overhead, 0) / float(number)
+
+def measure(stage, case, func, number = 20000, samples = 1000, batch = 10):
+    """
+        benchmark func, return a result dictionary, alloc_bytes and
+        alloc_objects only when they can be measured
+
+        Throughput is the best of 3 runs of number calls. The latency
+        percentiles come from samples timed batches of batch calls each,
+        batch = 1 timing every call (e.g. for round trips).
+    """
+    timer = timeit.default_timer
+    latencies = []
+    for i in range(samples):
+        start = timer()
+        for j in range(batch):
+            func()
+        latencies.append((timer() - start) / batch)
+    latencies.sort()
+
+    result = {'stage': stage,
+              'case': case,
+              'ops_per_s': _frames_per_second(func, number),
+              'p50_us': _percentile(latencies, 0.50) * 1e6,
+              'p99_us': _percentile(latencies, 0.99) * 1e6}
+    alloc_bytes = _alloc_bytes(func)
+    if alloc_bytes is not None:
+        result['alloc_bytes'] = alloc_bytes
+    alloc_objects = _alloc_objects(func)
+    if alloc_objects is not None:
+        result['alloc_objects'] = alloc_objects
+    return result
+
+def bench_fcs(sizes = PAYLOAD_SIZES, number = 20000):
+    """
+        compare the checksum routines for each payload size, results are
+        (size, old frames/s, new frames/s)
+    """
+    results = []
+    for size in sizes:
+        data = b'\x44\x81' + os.urandom(size)
+        frame = ZnpFrame(data)
+        raw = frame.output()
+
+        if _fcs_per_byte(data, size) != fcs(data, init = size):
+            raise AssertionError('FCS mismatch for payload of %d bytes' % size)
+
+        old = _frames_per_second(lambda: _fcs_per_byte(data, size), number)
+        new = _frames_per_second(lambda: fcs(raw, 1, len(raw) - 1), number)
+        results.append((size, old, new))
+
+    return results
+
+def bench_frame(sizes = PAYLOAD_SIZES, number = 20000):
+    """ frame encoding and decoding for each payload size """
+    results = []
+    for size in sizes:
+        data = b'\x44\x81' + os.urandom(size)
+        raw = ZnpFrame(data).output()
+        case = '%dB' % size
+
+        results.append(measure('frame.output', case,
+                               lambda: ZnpFrame(data).output(), number))
+
+        def parse():
+            frame = ZnpFrame()
+            frame.raw_data = raw
+            frame.parse()
+        results.append(measure('frame.parse', case, parse, number))
+
+        decoder = ZnpFrameDecoder()
+        results.append(measure('frame.decoder', case,
+                               lambda: decoder.feed(raw), number))
+    return results
+
+def _zpi(**kwargs):
+    """ a Zpi instance on the ZNP simulator, with its simulator """
+    from zpi.zpi2 import Zpi
+    from zpi.simulator import ZnpSimulator
+    simulator = ZnpSimulator()
+    return Zpi(simulator, **kwargs), simulator
+
+#commands and their frame fields, as the API methods build them
+BUILD_CASES = (
+    ('SYS_VERSION', {}),
+    ('UTIL_ADDRMGR_NWK_ADDR_LOOKUP', {'nwk_addr': b'\x34\x12'}),
+    ('ZDO_MGMT_LQI_REQ', {'dst_addr': b'\x00\x00', 'start_index': b'\x00'}),
+    ('AF_DATA_REQUEST', {'dst_addr': b'\x34\x12', 'dst_ep': b'\x01',
+                         'src_ep': b'\x01', 'cluster_id': b'\x06\x00',
+                         'trans_id': b'\x01', 'options': b'\x00',
+                         'radius': b'\x1e', 'len': b'\x40',
+                         'data': b'\x00' * 64}),
+    )
+
+def bench_build_frame(number = 20000):
+    """ _build_frame() of some commands """
+    zpi, simulator = _zpi()
+    try:
+        return [measure('build_frame', command,
+                        lambda: zpi._build_frame(command, **kwargs), number)
+                for command, kwargs in BUILD_CASES]
+    finally:
+        zpi.halt(1.0)
+        simulator.close()
+
+def _nbr_records(count):
+    """ neighbor table records, see tables.NBR_TABLE """
+    return b''.join(struct.pack('<QQHBBBB', 1, 0x00124B0000000000 | index,
+                                index, 0x25, 0, 1, 200)
+                    for index in range(count))
+
+def _split_cases(simulator):
+    """ (response, frame data) of some responses """
+    return (
+        ('SYS_VERSION_SRSP', simulator.build(
+            'SYS_VERSION_SRSP', transport_rev = 2, product_id = 0,
+            major_rel = 2, minor_rel = 6, maint_rel = 1)),
+        ('AF_DATA_CONFIRM', simulator.build(
+            'AF_DATA_CONFIRM', status = 0, endpoint = 1, trans_id = 1)),
+        ('AF_INCOMING_MSG', simulator.build(
+            'AF_INCOMING_MSG', cluster_id = 6, src_addr = 0x1234, src_ep = 1,
+            dst_ep = 1, len = 64, data = b'\x00' * 64)),
+        ('ZDO_MGMT_LQI_RSP', simulator.build(
+            'ZDO_MGMT_LQI_RSP', nbr_table_entries = 3,
+            nbr_table_list_cnt = 3, nbr_table_list_records = _nbr_records(3))),
+        )
+
+def bench_split_response(number = 20000):
+    """ _split_response() of some responses """
+    zpi, simulator = _zpi()
+    try:
+        return [measure('split_response', rsp_id,
+                        lambda: zpi._split_response(data), number)
+                for rsp_id, data in _split_cases(simulator)]
+    finally:
+        zpi.halt(1.0)
+        simulator.close()
+
+def bench_dispatch(number = 20000):
+    """
+        reader work per AF_INCOMING_MSG: an async callback, 1 and 8
+        subscriptions to its cluster and a dropped unsubscribed frame
+    """
+    results = []
+    for case, callback, subscriptions, cluster_id in (
+            ('callback', lambda zpi, rx_data: None, 0, 6),
+            ('subscriptions-1', None, 1, 6),
+            ('subscriptions-8', None, 8, 6),
+            ('dropped', None, 1, 8)):
+        zpi, simulator = _zpi(callback = callback)
+        try:
+            for i in range(subscriptions):
+                zpi.subscribe('AF_INCOMING_MSG', lambda zpi, fields: None,
+                              endpoint = 1, cluster_id = cluster_id,
+                              fields = ('src_addr', 'data'))
+            data = simulator.build(
+                'AF_INCOMING_MSG', cluster_id = 6, src_addr = 0x1234,
+                src_ep = 1, dst_ep = 1, len = 16, data = b'\x00' * 16)
+
+            def dispatch():
+                if zpi._filter_frame(data):
+                    zpi._callback_dispatcher(zpi._split_response(data))
+            results.append(measure('dispatch', case, dispatch, number))
+        finally:
+            zpi.halt(1.0)
+            simulator.close()
+    return results
+
+def bench_unknown(number = 20000):
+    """ reader work per frame of no known response, raised or dropped """
+    zpi, simulator = _zpi(callback = lambda zpi, rx_data: None)
+    data = b'\x45\x7e\x00'
+
+    def dispatch():
+        try:
+            if zpi._filter_frame(data):
+                zpi._callback_dispatcher(zpi._split_response(data))
+        except KeyError:
+            pass
+    try:
+        results = [measure('unknown', 'raised', dispatch, number)]
+        zpi.DROP_UNKNOWN_FRAMES = True
+        results.append(measure('unknown', 'dropped', dispatch, number))
+        return results
+    finally:
+        zpi.halt(1.0)
+        simulator.close()
+
+def bench_roundtrip(number = 2000):
+    """ SREQ to handled SRSP latency against the ZNP simulator """
+    zpi, simulator = _zpi(callback = lambda zpi, rx_data: None)
+    try:
+        return [measure('roundtrip', 'sys_version', zpi.sys_version,
+                        number, number, 1),
+                measure('roundtrip', 'af_data_request',
+                        lambda: zpi.af_data_request(0x1234, 1, 1, 6, 1, 0,
+                                                    30, b'\x00' * 16),
+                        number, number, 1)]
+    finally:
+        zpi.halt(1.0)
+        simulator.close()
+
+def run(quick = False):
+    """ run all the stages, return the JSON report as a dictionary """
+    number = 2000 if quick else 20000
+    results = [{'stage': 'fcs', 'case': '%dB' % size, 'ops_per_s': new,
+                'reference_ops_per_s': old}
+               for size, old, new in bench_fcs(number = number)]
+    results.extend(bench_frame(number = number))
+    results.extend(bench_build_frame(number))
+    results.extend(bench_split_response(number))
+    results.extend(bench_dispatch(number))
+    results.extend(bench_unknown(number))
+    results.extend(bench_roundtrip(number // 10))
+
+    return {'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}
+
+def _us(value):
+    return '%10.2f' % value if value is not None else '%10s' % '-'
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--json', metavar = 'PATH',
+                        help = 'write the results as JSON, - for stdout')
+    parser.add_argument('--quick', action = 'store_true',
+                        help = 'fewer iterations')
+    args = parser.parse_args()
+
+    report = run(args.quick)
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent = 2, sort_keys = True)
+        return
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent = 2, sort_keys = True)
+
+    columns = [(key, title) for key, title in (('alloc_bytes', 'alloc B'),
+                                               ('alloc_objects', 'alloc obj'))
+               if any(key in result for result in report['results'])]
+    print('%-16s %-30s %12s %10s %10s' % ('stage', 'case', 'ops/s',
+                                          'p50 us', 'p99 us') +
+          ''.join(' %10s' % title for key, title in columns))
+    for result in report['results']:
+        print('%-16s %-30s %12.0f %s %s' % (
+            result['stage'], result['case'], result['ops_per_s'],
+            _us(result.get('p50_us')), _us(result.get('p99_us'))) +
+              ''.join(' ' + _us(result.get(key)) for key, title in columns))
+
+if __name__ == '__main__':
+    main()
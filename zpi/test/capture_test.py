@@ -0,0 +1,142 @@
+"""
+    wire capture tests, the recording and replay ones run against the ZNP 
+    simulator
+
+    run: python -m unittest zpi.test.capture_test
+"""
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.capture import (CaptureWriter, CaptureReplayer, read_capture, 
+                         CAPTURE_RX, CAPTURE_TX, FILE_MAGIC, RECORD)
+from zpi.simulator import ZnpSimulator
+
+class CaptureFileTest(unittest.TestCase):
+    def test_write_read(self):
+        output = io.BytesIO()
+        writer = CaptureWriter(output, buffer_size = 1 << 20)
+        writer.record(CAPTURE_TX, b'\x21\x02', 10.0)
+        writer.record(CAPTURE_RX, b'\x61\x02\x02\x00\x02\x06\x03', 10.5)
+        #buffered until flushed
+        self.assertEqual(output.getvalue(), b'')
+        writer.close()
+        writer.record(CAPTURE_RX, b'\x61\x02', 11.0)
+        
+        self.assertEqual(writer.frames, 2)
+        self.assertFalse(output.closed)
+        self.assertEqual(list(read_capture(io.BytesIO(output.getvalue()))), 
+                         [(10.0, CAPTURE_TX, b'\x21\x02'), 
+                          (10.5, CAPTURE_RX, 
+                           b'\x61\x02\x02\x00\x02\x06\x03')])
+        
+    def test_buffer_size(self):
+        output = io.BytesIO()
+        writer = CaptureWriter(output, buffer_size = 64)
+        for index in range(10):
+            writer.record(CAPTURE_RX, b'\x45\xc1' + b'\x00' * 11, 1.0)
+        #written by 64 bytes of records or more
+        size = len(FILE_MAGIC) + 10 * (RECORD.size + 13)
+        self.assertTrue(0 < len(output.getvalue()) < size)
+        writer.flush()
+        self.assertEqual(len(output.getvalue()), size)
+        
+    def test_path(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'field.zcap')
+            writer = CaptureWriter(path)
+            writer.record(CAPTURE_RX, b'\x45\xc1', 1.0)
+            writer.close()
+            self.assertEqual(list(read_capture(path)), 
+                             [(1.0, CAPTURE_RX, b'\x45\xc1')])
+        finally:
+            shutil.rmtree(directory)
+        
+    def test_cut_short(self):
+        output = io.BytesIO()
+        writer = CaptureWriter(output)
+        writer.record(CAPTURE_RX, b'\x45\xc1', 1.0)
+        writer.record(CAPTURE_RX, b'\x45\xc2\x00', 2.0)
+        writer.close()
+        data = output.getvalue()
+        for cut in (1, 2, RECORD.size + 2):
+            self.assertEqual(list(read_capture(io.BytesIO(data[:-cut]))), 
+                             [(1.0, CAPTURE_RX, b'\x45\xc1')])
+        
+    def test_not_a_capture(self):
+        self.assertRaises(ValueError, list, 
+                          read_capture(io.BytesIO(b'PCAP' * 4)))
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = ZnpSimulator(latency = 0.001, areq_latency = 0.002)
+        self.received = []
+        self.zpi = Zpi(self.sim, lambda zpi, rx_data: 
+                       self.received.append(rx_data))
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.sim.close()
+        
+    def record(self, count):
+        """ capture a sys_version() and count AF_INCOMING_MSG """
+        output = io.BytesIO()
+        self.zpi.capture = CaptureWriter(output)
+        self.zpi.sys_version()
+        self.sim.flood_af_incoming(count, rate = 200, src_addrs = [1, 2], 
+                                   wait = True)
+        deadline = time.time() + 5.0
+        while len(self.received) < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.zpi.capture.close()
+        self.zpi.capture = None
+        return output.getvalue()
+        
+    def test_record(self):
+        frames = list(read_capture(io.BytesIO(self.record(5))))
+        self.assertEqual([(direction, data[0:2]) 
+                          for timestamp, direction, data in frames], 
+                         [(CAPTURE_TX, b'\x21\x02'), 
+                          (CAPTURE_RX, b'\x61\x02')] + 
+                         [(CAPTURE_RX, b'\x44\x81')] * 5)
+        timestamps = [timestamp for timestamp, direction, data in frames]
+        self.assertEqual(timestamps, sorted(timestamps))
+        
+    def test_replay(self):
+        capture = self.record(20)
+        del self.received[:]
+        stats = CaptureReplayer(self.zpi, io.BytesIO(capture)).run()
+        self.assertEqual((stats['frames'], stats['errors']), (21, 0))
+        #the SRSP has no request waiting for it
+        self.assertEqual([rx_data['id'] for rx_data in self.received], 
+                         [ZpiCommand.AF_INCOMING_MSG] * 20)
+        self.assertEqual([ord(rx_data['src_addr'][0]) 
+                          for rx_data in self.received[0:2]], [1, 2])
+        
+    def test_replay_speed(self):
+        #20 frames captured at 200 per second, about 0.1 s
+        capture = self.record(20)
+        del self.received[:]
+        stats = CaptureReplayer(self.zpi, io.BytesIO(capture), 
+                                speed = 2.0).run()
+        self.assertEqual(stats['frames'], 21)
+        self.assertTrue(0.04 <= stats['elapsed'] < 0.5)
+        self.assertEqual(len(self.received), 20)
+        
+    def test_replay_errors(self):
+        output = io.BytesIO()
+        writer = CaptureWriter(output)
+        writer.record(CAPTURE_RX, b'\x44\x80\x00', 1.0)   #truncated
+        writer.record(CAPTURE_TX, b'\x21\x02', 1.0)       #skipped
+        writer.close()
+        stats = CaptureReplayer(self.zpi, io.BytesIO(output.getvalue())).run()
+        self.assertEqual((stats['frames'], stats['errors']), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
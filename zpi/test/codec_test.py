@@ -0,0 +1,193 @@
+"""
+    compiled encoder and decoder tests, against the field loops of Znp
+
+    run: python -m unittest zpi.test.codec_test
+"""
+import random
+import struct
+import unittest
+
+from zpi.znp import Znp, _len_calc
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommands
+from zpi.codec import compile_commands, compile_responses, ResponseDecoder
+
+class FieldLoops(object):
+    """ the per-field loops of Znp, used without compiled codecs """
+    znp_commands = ZpiCommands.znp_commands
+    znp_responses = ZpiCommands.znp_responses
+    znp_encoders = None
+    znp_decoders = None
+    
+    _build_frame = Znp.__dict__['_build_frame']
+    _split_response = Znp.__dict__['_split_response']
+
+class TypedHandlers(object):
+    """ the Zpi handlers using the typed values of the responses """
+    znp_decoders = compile_responses(ZpiCommands.znp_responses)
+    
+    _typed_fields = Zpi._typed_fields.__func__
+    af_incoming_msg_handler = Zpi.af_incoming_msg_handler.__func__
+
+def field_values(spec, rand, count = None):
+    """ 
+        random {field_name: bytes} of a field specification, count is the 
+        value of the count fields (random by default)
+    """
+    values = {}
+    for field in spec:
+        field_len = field['len']
+        if field.get('default'):
+            continue
+        if isinstance(field_len, tuple):
+            field_len = _len_calc(ord(values[field_len[0]]), field_len[1])
+        elif field_len is None:
+            field_len = rand.randint(0, 40)
+        values[field['name']] = bytes(bytearray(rand.randint(0, 255) 
+                                                for i in range(field_len)))
+        if field['len'] == 1 and field['name'].endswith(('num', 'cnt')):
+            #a count field of a variable length field that may follow
+            values[field['name']] = chr(count if count is not None 
+                                        else rand.randint(0, 5))
+    return values
+
+class CommandEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.loops = FieldLoops()
+        self.encoders = compile_commands(ZpiCommands.znp_commands)
+        
+    def test_commands(self):
+        rand = random.Random(1)
+        for command, spec in ZpiCommands.znp_commands.iteritems():
+            for count in (0, 1, 3, None):
+                values = field_values(spec, rand, count)
+                self.assertEqual(self.encoders[command].encode(values), 
+                                 self.loops._build_frame(command, **values), 
+                                 command)
+        
+    def test_header_override(self):
+        self.assertEqual(self.encoders['SYS_VERSION'].encode({'cmd1': b'\x05'}),
+                         self.loops._build_frame('SYS_VERSION', cmd1 = b'\x05'))
+        
+    def test_errors(self):
+        encoder = self.encoders['SYS_OSAL_NV_READ']
+        self.assertRaises(KeyError, encoder.encode, {'id': b'\x01\x00'})
+        self.assertRaises(KeyError, self.loops._build_frame, 
+                          'SYS_OSAL_NV_READ', id = b'\x01\x00')
+        self.assertRaises(ValueError, encoder.encode, 
+                          {'id': b'\x01', 'offset': b'\x00'})
+        self.assertRaises(ValueError, self.loops._build_frame, 
+                          'SYS_OSAL_NV_READ', id = b'\x01', offset = b'\x00')
+        
+    def test_relative_length_error(self):
+        encoder = self.encoders['AF_REGISTER']
+        values = field_values(ZpiCommands.znp_commands['AF_REGISTER'], 
+                              random.Random(1), 2)
+        values['in_cluster_list'] += b'\x00'
+        self.assertRaises(ValueError, encoder.encode, values)
+        self.assertRaises(ValueError, self.loops._build_frame, 'AF_REGISTER', 
+                          **values)
+
+#a response with a null terminated field, none in ZpiCommands
+NULL_TERMINATED = {
+    'name': 'TEST_RSP',
+    'structure':[
+        {'name': 'status',      'len': 1},
+        {'name': 'text',        'len': 'null_terminated'},
+        {'name': 'value',       'len': 2},
+        ]
+    }
+
+class ResponseDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.loops = FieldLoops()
+        self.decoders = compile_responses(ZpiCommands.znp_responses)
+        
+    def frames(self, rand):
+        """ (packet id, spec, frame data) of random responses """
+        for packet_id, packet in sorted(ZpiCommands.znp_responses.iteritems()):
+            for count in (0, 1, 3, None):
+                values = field_values(packet['structure'], rand, count)
+                yield packet_id, packet, packet_id + b''.join(
+                    values[field['name']] for field in packet['structure'])
+        
+    def test_split(self):
+        for packet_id, packet, data in self.frames(random.Random(1)):
+            self.assertEqual(self.decoders[packet_id].split(data), 
+                             self.loops._split_response(data), packet['name'])
+        
+    def test_unpack(self):
+        for packet_id, packet, data in self.frames(random.Random(2)):
+            expected = self.loops._split_response(data)
+            typed = self.decoders[packet_id].unpack(data)
+            self.assertEqual(typed['id'], packet['name'])
+            for field in packet['structure']:
+                name = field['name']
+                value = typed[name]
+                if field['len'] in (1, 2, 4, 8):
+                    code = {1: '<B', 2: '<H', 4: '<L', 8: '<Q'}[field['len']]
+                    self.assertEqual(value, 
+                                     struct.unpack(code, expected[name])[0])
+                elif isinstance(value, memoryview):
+                    #the field loop omits an empty tail field
+                    self.assertEqual(value.tobytes(), 
+                                     expected.get(name, b''))
+                else:
+                    self.assertEqual(value, expected[name])
+        
+    def test_typed_response(self):
+        packet_id = b'\x61\x02'
+        data = packet_id + b'\x02\x00\x02\x06\x01'
+        decoder = ResponseDecoder(packet_id, 
+                                  ZpiCommands.znp_responses[packet_id])
+        rx_data = decoder.split(data)
+        #decoded along with the split, not again
+        decoder._steps = None
+        self.assertEqual(rx_data.typed(), 
+                         self.decoders[packet_id].unpack(data))
+        self.assertEqual(rx_data.typed()['minor_rel'], 6)
+        
+    def test_handler_views(self):
+        loops = TypedHandlers()
+        data = (b'\x44\x81' + b'\x00' * 6 + b'\x01\x01' + b'\x00' * 8 + 
+                b'\x03' + b'abc')
+        rx_data = self.decoders[b'\x44\x81'].split(data)
+        payload = loops.af_incoming_msg_handler(rx_data)[-1]
+        self.assertTrue(isinstance(payload, memoryview))
+        self.assertEqual(payload.tobytes(), b'abc')
+        
+        rx_data = self.decoders[b'\x44\x81'].split(data[:-4] + b'\x00')
+        self.assertEqual(loops.af_incoming_msg_handler(rx_data)[-1].tobytes(), 
+                         b'')
+        
+    def test_length_errors(self):
+        packet_id = b'\x61\x02'
+        data = packet_id + b'\x02\x00\x02\x06\x01'
+        for bad in (data[:-1], data + b'\x00'):
+            self.assertRaises(ValueError, self.decoders[packet_id].split, bad)
+            self.assertRaises(ValueError, self.decoders[packet_id].unpack, bad)
+            self.assertRaises(ValueError, self.loops._split_response, bad)
+        
+    def test_relative_length_error(self):
+        packet_id = b'\x6f\x04'  #APS_FIND_ALL_GROUPS_FOR_EP_SRSP
+        data = packet_id + b'\x00\x01\x02\x01\x00'
+        self.assertRaises(ValueError, self.decoders[packet_id].split, data)
+        self.assertRaises(ValueError, self.loops._split_response, data)
+        
+    def test_null_terminated(self):
+        self.loops.znp_responses = {b'\x7f\x01': NULL_TERMINATED}
+        decoder = ResponseDecoder(b'\x7f\x01', NULL_TERMINATED)
+        for text in (b'', b'abc'):
+            data = b'\x7f\x01\x00' + text + b'\x00\x34\x12'
+            self.assertEqual(decoder.split(data), 
+                             self.loops._split_response(data))
+            self.assertEqual(decoder.unpack(data)['value'], 0x1234)
+        
+    def test_null_terminated_without_terminator(self):
+        #the field loop never ends on such a frame
+        decoder = ResponseDecoder(b'\x7f\x01', NULL_TERMINATED)
+        self.assertRaises(ValueError, decoder.split, b'\x7f\x01\x00abc')
+        self.assertRaises(ValueError, decoder.unpack, b'\x7f\x01\x00abc')
+
+if __name__ == '__main__':
+    unittest.main()
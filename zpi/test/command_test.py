@@ -0,0 +1,109 @@
+"""
+    command table index tests
+
+    run: python -m unittest zpi.test.command_test
+"""
+import unittest
+
+from zpi.command import ZpiCommand, ZpiCommands, SUBSYSTEMS, subsystem
+from zpi.znp import CommandFrameException
+from zpi.zpi2 import Zpi
+from zpi.metrics import Metrics
+from zpi.test.fakeport import FakePort, build
+
+class CommandIndexTest(unittest.TestCase):
+    def test_command_ids(self):
+        for name, spec in ZpiCommands.znp_commands.iteritems():
+            packet_id = spec[0]['default'] + spec[1]['default']
+            if name != ZpiCommand.UTIL_APSME_LINK_KEY_DATA_GET:
+                self.assertEqual(ZpiCommands.command_ids[packet_id], name)
+        self.assertEqual(len(ZpiCommands.command_ids), 
+                         len(ZpiCommands.znp_commands) - 1)
+        
+    def test_shared_command_id(self):
+        #0x2744 is in the table twice, the index keeps the same one
+        self.assertEqual(ZpiCommands.command_ids[b'\x27\x44'], 
+                         ZpiCommand.UTIL_APSME_REQUEST_KEY_CMD)
+        
+    def test_response_ids(self):
+        self.assertEqual(ZpiCommands.response_ids, dict(
+            (packet_id, packet['name']) for packet_id, packet 
+            in ZpiCommands.znp_responses.iteritems()))
+        self.assertEqual(ZpiCommands.response_ids[b'\x64\x03'], 
+                         ZpiCommand.AF_DATA_REQUEST_SRC_RTG_SRSP)
+        
+    def test_response_names_unique(self):
+        #the responses are also looked up by name, e.g. by the simulator
+        names = ZpiCommands.response_ids.values()
+        self.assertEqual(sorted(set(names)), sorted(names))
+        
+    def test_subsystem(self):
+        self.assertEqual(subsystem(b'\x21\x02'), 'SYS')
+        self.assertEqual(subsystem(b'\x61\x02'), 'SYS')
+        self.assertEqual(subsystem(b'\x44\x81'), 'AF')
+        self.assertEqual(subsystem(b'\x45\xc1'), 'ZDO')
+        self.assertEqual(subsystem(b'\x2f\x00'), 'APS')
+        self.assertEqual(subsystem(b'\x2c\x00'), '0x0c')
+        
+    def test_subsystem_ids(self):
+        packet_ids = set(ZpiCommands.command_ids) | \
+                     set(ZpiCommands.response_ids)
+        self.assertEqual(set(ZpiCommands.subsystem_ids), packet_ids)
+        self.assertTrue(set(ZpiCommands.subsystem_ids.values()) <= 
+                        set(SUBSYSTEMS.values()))
+
+class UnknownFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.port = FakePort()
+        self.zpi = Zpi(self.port, 
+                       lambda zpi, rx_data: self.received.append(rx_data))
+        self.zpi.metrics = Metrics()
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def unknown_total(self):
+        return self.zpi.metrics.snapshot()['counters'].get(
+            'unknown_frames_total', {}).get(None, 0)
+        
+    def test_command_frame(self):
+        self.assertRaises(CommandFrameException, self.zpi._split_response, 
+                          b'\x21\x02')
+        self.assertEqual(self.zpi.unknown_frames, 1)
+        
+    def test_unrecognized(self):
+        try:
+            self.zpi._split_response(b'\x6c\x01\x00')
+            self.fail('KeyError not raised')
+        except CommandFrameException:
+            self.fail('not a command frame')
+        except KeyError as e:
+            self.assertTrue('6c01 (0x0c)' in str(e))
+        self.assertEqual((self.zpi.unknown_frames, self.unknown_total()), 
+                         (1, 1))
+        
+    def test_filter(self):
+        self.assertTrue(self.zpi._filter_frame(b'\x6c\x01\x00'))
+        self.zpi.DROP_UNKNOWN_FRAMES = True
+        self.assertFalse(self.zpi._filter_frame(b'\x6c\x01\x00'))
+        self.assertFalse(self.zpi._filter_frame(b'\x21\x02'))
+        self.assertTrue(self.zpi._filter_frame(b'\x61\x02\x02\x00\x02\x06\x03'))
+        self.assertEqual((self.zpi.unknown_frames, self.unknown_total()), 
+                         (2, 2))
+        
+    def test_reader_drops(self):
+        #dropped by the reader between two known AREQs
+        self.zpi.DROP_UNKNOWN_FRAMES = True
+        self.port.feed(build(ZpiCommand.SYS_RESET_IND, reason = 1), 
+                       b'\x6c\x01\x00', b'\x45\x7e', 
+                       build(ZpiCommand.SYS_RESET_IND, reason = 2))
+        self.assertEqual(len(self.zpi.sys_version()), 5)
+        self.assertEqual([rx_data['reason'] for rx_data in self.received], 
+                         [b'\x01', b'\x02'])
+        self.assertEqual((self.zpi.unknown_frames, self.unknown_total()), 
+                         (2, 2))
+
+if __name__ == '__main__':
+    unittest.main()
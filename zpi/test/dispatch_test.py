@@ -0,0 +1,186 @@
+"""
+    AREQ subscription tests
+
+    run: python -m unittest zpi.test.dispatch_test
+"""
+import struct
+import unittest
+
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.dispatch import SubscriptionTable
+from zpi.test.fakeport import FakePort, build, srsp
+
+AF_DATA_RETRIEVE = b'\x24\x12'
+
+def incoming(dst_ep, cluster_id, data = b'ab', src_addr = 0x1234):
+    """ get the frame data of an AF_INCOMING_MSG """
+    return build(ZpiCommand.AF_INCOMING_MSG, src_addr = src_addr,
+                 dst_ep = dst_ep, cluster_id = cluster_id, len = len(data),
+                 data = data)
+
+class SubscriptionTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = SubscriptionTable(Zpi.znp_decoders)
+        
+    def test_match_order(self):
+        handler = lambda zpi, fields: None
+        add = self.table.add
+        any_msg = add(ZpiCommand.AF_INCOMING_MSG, handler)
+        cluster = add(ZpiCommand.AF_INCOMING_MSG, handler, cluster_id = 6)
+        endpoint = add(ZpiCommand.AF_INCOMING_MSG, handler, endpoint = 1)
+        both = add(ZpiCommand.AF_INCOMING_MSG, handler, 1, 6)
+        self.assertEqual(len(self.table), 4)
+        
+        self.assertEqual(self.table.match(incoming(1, 6)),
+                         (both, endpoint, cluster, any_msg))
+        self.assertEqual(self.table.match(incoming(2, 6)),
+                         (cluster, any_msg))
+        self.assertEqual(self.table.match(incoming(1, 8)),
+                         (endpoint, any_msg))
+        self.assertEqual(self.table.match(incoming(2, 8)), (any_msg, ))
+        
+    def test_no_match(self):
+        self.table.add(ZpiCommand.AF_INCOMING_MSG, None, 1, 6)
+        self.assertEqual(self.table.match(incoming(2, 6)), ())
+        self.assertEqual(self.table.match(build(ZpiCommand.AF_DATA_CONFIRM)),
+                         ())
+        #truncated before the cluster id
+        self.assertEqual(self.table.match(incoming(1, 6)[0:4]), ())
+        
+    def test_not_addressed(self):
+        subscription = self.table.add(ZpiCommand.ZDO_LEAVE_IND, None)
+        self.assertEqual(self.table.match(build(ZpiCommand.ZDO_LEAVE_IND,
+                                                src_addr = 0x1234)),
+                         (subscription, ))
+        self.assertRaises(ValueError, self.table.add,
+                          ZpiCommand.ZDO_LEAVE_IND, None, endpoint = 1)
+        self.assertRaises(ValueError, self.table.add, 'NO_SUCH_RSP', None)
+        
+    def test_remove(self):
+        first = self.table.add(ZpiCommand.AF_INCOMING_MSG, None, 1, 6)
+        second = self.table.add(ZpiCommand.AF_INCOMING_MSG, None, 1, 6)
+        self.assertTrue(self.table.remove(first))
+        self.assertFalse(self.table.remove(first))
+        self.assertEqual(self.table.match(incoming(1, 6)), (second, ))
+        self.assertTrue(self.table.remove(second))
+        self.assertEqual(self.table.match(incoming(1, 6)), ())
+        self.assertEqual(len(self.table), 0)
+        
+    def test_notify_fields(self):
+        received = []
+        self.table.add(ZpiCommand.AF_INCOMING_MSG,
+                       lambda zpi, fields: received.append(fields), 1, 6,
+                       fields = ['src_addr', 'data'])
+        data = incoming(1, 6, b'xyz')
+        self.table.notify(None, self.table.match(data), data)
+        self.table.notify(None, self.table.match(data), data, b'payload')
+        self.assertEqual(sorted(received[0]), ['data', 'id', 'src_addr'])
+        self.assertEqual(received[0]['src_addr'], 0x1234)
+        self.assertEqual(received[0]['data'].tobytes(), b'xyz')
+        self.assertEqual(received[1]['data'], b'payload')
+        
+    def test_notify_error(self):
+        received = []
+        def failing(zpi, fields):
+            raise RuntimeError('handler error')
+        self.table.add(ZpiCommand.AF_INCOMING_MSG, failing, 1)
+        self.table.add(ZpiCommand.AF_INCOMING_MSG,
+                       lambda zpi, fields: received.append(fields))
+        data = incoming(1, 6)
+        self.table.notify(None, self.table.match(data), data)
+        self.assertEqual(len(received), 1)
+
+class ZpiSubscriptionTest(unittest.TestCase):
+    """ the subscribers are called by the reader, before the next SRSP """
+    def setUp(self):
+        self.incoming = b''     #payload of the huge incoming message
+        self.port = FakePort(self.respond)
+        self.received = []      #rx_data passed to the async callback
+        self.fields = []        #fields passed to the subscribers
+        self.zpi = self.create_zpi(lambda zpi, rx_data:
+                                   self.received.append(rx_data))
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def create_zpi(self, callback):
+        zpi = Zpi(self.port, callback)
+        zpi.subscribe(ZpiCommand.AF_INCOMING_MSG, self.notified,
+                      endpoint = 1, cluster_id = 0x0006,
+                      fields = ['src_addr', 'data'])
+        return zpi
+        
+    def notified(self, zpi, fields):
+        self.fields.append(fields)
+        
+    def respond(self, data):
+        if data[0:2] == AF_DATA_RETRIEVE:
+            index, length = struct.unpack('<HB', data[6:9])
+            chunk = self.incoming[index:index + length]
+            return [build(ZpiCommand.AF_DATA_RETRIEVE_SRSP, len = len(chunk),
+                          data = chunk)]
+        return [srsp(data)]
+        
+    def feed(self, *datas):
+        self.port.feed(*datas)
+        self.zpi.sys_version()
+        
+    def test_subscription(self):
+        self.feed(incoming(1, 6, b'xy', 0x0001), incoming(1, 8, b'z'),
+                  incoming(1, 6, b'uv', 0x0002))
+        self.assertEqual([(fields['src_addr'], fields['data'].tobytes())
+                          for fields in self.fields],
+                         [(0x0001, b'xy'), (0x0002, b'uv')])
+        #the others still go to the callback
+        self.assertEqual([rx_data['cluster_id'] for rx_data in self.received],
+                         [b'\x08\x00'])
+        
+    def test_unsubscribe(self):
+        subscription = self.zpi.subscribe(ZpiCommand.ZDO_LEAVE_IND,
+                                          lambda zpi, fields: None)
+        self.assertTrue(self.zpi.unsubscribe(subscription))
+        self.assertFalse(self.zpi.unsubscribe(subscription))
+        self.feed(build(ZpiCommand.ZDO_LEAVE_IND, src_addr = 0x1234))
+        self.assertEqual([rx_data['id'] for rx_data in self.received],
+                         [ZpiCommand.ZDO_LEAVE_IND])
+        
+    def test_unsubscribed_dropped(self):
+        #no async callback, an AREQ nobody wants is not parsed
+        self.zpi.halt(1.0)
+        self.zpi = self.create_zpi(None)
+        self.feed(incoming(2, 6))
+        self.assertEqual(self.zpi._areq_rx_msg, None)
+        
+        #the cache sources are still parsed
+        self.feed(build(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND,
+                        nwk_addr = 0x4321, ieee_addr = 0x00124B0000004321))
+        self.assertEqual(self.zpi.address_cache.get_nwk_addr(
+            0x00124B0000004321), 0x4321)
+        
+    def test_waiter(self):
+        #a subscribed AREQ still completes its waiter
+        waiter = self.zpi.expect_areq(ZpiCommand.AF_INCOMING_MSG, 'src_addr',
+                                      b'\x34\x12')
+        self.feed(incoming(1, 6))
+        self.assertEqual(waiter.result(1.0)['data'], b'ab')
+        self.assertEqual(len(self.fields), 1)
+        self.assertEqual(self.received, [])
+        
+    def test_large_msg(self):
+        #notified once its payload is retrieved
+        self.incoming = b'0123456789' * 50
+        self.zpi.subscribe(ZpiCommand.AF_INCOMING_MSG_EXT, self.notified,
+                           endpoint = 1, cluster_id = 0x0006)
+        waiter = self.zpi.expect_areq(ZpiCommand.AF_INCOMING_MSG_EXT,
+                                      'cluster_id', b'\x06\x00')
+        self.port.feed(build(ZpiCommand.AF_INCOMING_MSG_EXT, dst_ep = 1,
+                             cluster_id = 0x0006, len = len(self.incoming)))
+        waiter.result(2.0)
+        self.assertEqual([fields['data'] for fields in self.fields],
+                         [self.incoming])
+        self.assertEqual(self.received, [])
+
+if __name__ == '__main__':
+    unittest.main()
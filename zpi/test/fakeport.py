@@ -0,0 +1,98 @@
+"""
+    a serial port stand-in for the unit tests
+
+    The frames fed to a FakePort reach the Znp reader through a pipe, so the 
+    port can be selected. The frames written to it are logged in requests and 
+    answered by respond(), SREQs get a zero filled SRSP by default.
+"""
+import fcntl
+import os
+import struct
+import termios
+import threading
+
+from zpi.frame import ZnpFrame
+from zpi.command import ZpiCommands
+
+#{response name: (packet id, packet)}
+RESPONSES = dict((packet['name'], (packet_id, packet)) 
+                 for packet_id, packet in ZpiCommands.znp_responses.iteritems())
+INT_CODES = {1: '<B', 2: '<H', 4: '<L', 8: '<Q'}
+
+def build(rsp_id, **fields):
+    """
+        build the frame data of the response rsp_id, fields are integers or 
+        bytes, the missing fixed fields are zero and the others empty
+    """
+    packet_id, packet = RESPONSES[rsp_id]
+    data = [packet_id]
+    for field in packet['structure']:
+        value = fields.get(field['name'])
+        if isinstance(field['len'], int):
+            if value is None:
+                value = b'\x00' * field['len']
+            elif isinstance(value, (int, long)):
+                value = struct.pack(INT_CODES[field['len']], value)
+        data.append(value or b'')
+    return b''.join(data)
+
+def srsp(data):
+    """ zero filled SRSP of the SREQ frame data, None if it has none """
+    packet_id = chr(ord(data[0]) | 0x40) + data[1]
+    packet = ZpiCommands.znp_responses.get(packet_id)
+    return build(packet['name']) if packet is not None else None
+
+class FakePort(object):
+    """
+        serial port serving the frames given to feed(), frames being given 
+        as their data: cmd0, cmd1 and payload
+    """
+    def __init__(self, respond = None):
+        self._rx, self._tx = os.pipe()
+        self._lock = threading.Lock()
+        self.requests = []      #data of the written frames
+        if respond is not None:
+            self.respond = respond
+            
+    def respond(self, data):
+        """ get the frame datas answering the written frame data """
+        if ord(data[0]) >> 5 != ZnpFrame.CMD_SREQ:
+            return []
+        response = srsp(data)
+        return [response] if response is not None else []
+        
+    def feed(self, *datas):
+        """ send frames to the reader """
+        os.write(self._tx, b''.join(ZnpFrame(data).output() 
+                                    for data in datas))
+        
+    #serial port interface
+    def fileno(self):
+        return self._rx
+        
+    def inWaiting(self):
+        return struct.unpack('i', fcntl.ioctl(self._rx, termios.FIONREAD, 
+                                              b'\x00' * 4))[0]
+        
+    def read(self, size = 1):
+        return os.read(self._rx, size)
+        
+    def write(self, data):
+        index = 0
+        while index < len(data):
+            end = index + ZnpFrame.LEN_NOTDATA + ord(data[index + 1])
+            frame_data = data[index + 2:end - 1]
+            with self._lock:
+                self.requests.append(frame_data)
+            self.feed(*self.respond(frame_data))
+            index = end
+        return len(data)
+        
+    def isOpen(self):
+        return self._rx is not None
+        
+    def close(self):
+        if self._rx is not None:
+            os.close(self._rx)
+            os.close(self._tx)
+            self._rx = None
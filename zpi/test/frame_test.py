@@ -0,0 +1,127 @@
+"""
+    frame encoding and decoding tests
+
+    run: python -m unittest zpi.test.frame_test
+"""
+import os
+import random
+import unittest
+
+from zpi.frame import ZnpFrame, ZnpFrameDecoder, fcs
+
+def frames(count, size = 16):
+    """ frame data of count AF_INCOMING_MSG, size bytes of payload """
+    return [b'\x44\x81' + bytes(bytearray((index + i) & 0xff 
+                                          for i in range(size)))
+            for index in range(count)]
+
+def fcs_per_byte(buf, start, end, init):
+    """ the byte by byte checksum, as reference """
+    value = init
+    for byte in bytearray(buf[start:end]):
+        value ^= byte
+    return value
+
+class FcsTest(unittest.TestCase):
+    def test_lengths(self):
+        for size in range(0, 251):
+            data = os.urandom(size)
+            self.assertEqual(fcs(data), fcs_per_byte(data, 0, size, 0), 
+                             'payload of %d bytes' % size)
+        
+    def test_ranges(self):
+        data = os.urandom(260)
+        for start in range(0, 10):
+            for end in (start, start + 1, start + 7, start + 8, start + 9, 
+                        start + 63, 255, 260):
+                for init in (0, 0x5a, 0xff):
+                    self.assertEqual(fcs(data, start, end, init), 
+                                     fcs_per_byte(data, start, end, init), 
+                                     '[%d:%d] ^ %d' % (start, end, init))
+        
+    def test_buffer_types(self):
+        data = os.urandom(100)
+        expected = fcs_per_byte(data, 3, 97, 7)
+        for buf in (bytearray(data), memoryview(data), buffer(data)):
+            self.assertEqual(fcs(buf, 3, 97, 7), expected)
+        
+    def test_frame_checksum(self):
+        raw = ZnpFrame(b'\x21\x02').output()
+        self.assertEqual(raw, b'\xfe\x00\x21\x02\x23')
+
+class FrameDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = ZnpFrameDecoder()
+        
+    def decode(self, chunks):
+        """ data of the frames decoded from chunks """
+        return [frame.data for chunk in chunks 
+                for frame in self.decoder.feed(chunk)]
+        
+    def test_frames_per_chunk(self):
+        data = frames(10)
+        stream = b''.join(ZnpFrame(d).output() for d in data)
+        self.assertEqual(self.decode([stream]), data)
+        self.assertEqual(self.decoder.pending(), 0)
+        
+    def test_split_reads(self):
+        data = frames(20, 40)
+        stream = b''.join(ZnpFrame(d).output() for d in data)
+        self.assertEqual(self.decode(stream), data)     #byte by byte
+        
+        rand = random.Random(1)
+        chunks = []
+        index = 0
+        while index < len(stream):
+            size = rand.randint(1, 64)
+            chunks.append(stream[index:index + size])
+            index += size
+        self.assertEqual(self.decode(chunks), data)
+        self.assertEqual(self.decoder.bad_frames, 0)
+        
+    def test_raw_data(self):
+        raw = ZnpFrame(b'\x61\x02\x02\x00\x02\x06\x01').output()
+        frame, = self.decoder.feed(raw)
+        self.assertEqual(frame.raw_data, raw)
+        
+    def test_bad_fcs_resync(self):
+        good, bad = [ZnpFrame(d).output() for d in frames(2)]
+        bad = bad[:-1] + bytearray([ord(bad[-1]) ^ 0x01])
+        self.assertEqual(self.decode([b'\x00\x13' + bad + good]), 
+                         frames(1))
+        self.assertEqual(self.decoder.bad_frames, 1)
+        
+    def test_sof_in_payload_resync(self):
+        #a frame cut short: the SOF of its payload and the next frame
+        data = b'\x44\x81' + b'\xfe' * 8
+        cut = ZnpFrame(data).output()[:6]
+        good = ZnpFrame(frames(1)[0]).output()
+        self.assertEqual(self.decode([cut + good]), frames(1))
+        self.assertTrue(self.decoder.bad_frames >= 1)
+        
+    def test_bad_length_resync(self):
+        good = ZnpFrame(frames(1)[0]).output()
+        self.assertEqual(self.decode([b'\xfe\xfb\x44\x81' + good]), 
+                         frames(1))
+        self.assertEqual(self.decoder.bad_frames, 1)
+        
+    def test_garbage_dropped(self):
+        self.assertEqual(self.decode([b'\x00\x01\x02\x03']), [])
+        self.assertEqual(self.decoder.pending(), 0)
+        
+    def test_partial_frame_pending(self):
+        raw = ZnpFrame(frames(1)[0]).output()
+        self.assertEqual(self.decode([raw[:5]]), [])
+        self.assertEqual(self.decoder.pending(), 5)
+        self.assertEqual(self.decode([raw[5:]]), frames(1))
+        
+    def test_buffer_growth(self):
+        self.decoder = ZnpFrameDecoder(16)
+        data = frames(30, 200)
+        stream = b''.join(ZnpFrame(d).output() for d in data)
+        chunks = [stream[index:index + 100] 
+                  for index in range(0, len(stream), 100)]
+        self.assertEqual(self.decode(chunks), data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+"""
+    SREQ/SRSP correlation tests
+
+    run: python -m unittest zpi.test.future_test
+"""
+import threading
+import time
+import unittest
+
+from zpi.zpi2 import Zpi, SrspTimeoutException
+from zpi.command import ZpiCommand
+from zpi.future import (ZpiFuture, PendingRequests, AreqWaiters, 
+                        CancelledException)
+from zpi.test.fakeport import FakePort, build
+
+class FailingPort(FakePort):
+    """ a port failing every write """
+    def write(self, data):
+        raise IOError('write failed')
+
+class ZpiFutureTest(unittest.TestCase):
+    def test_handler_runs_once(self):
+        calls = []
+        future = ZpiFuture('key', lambda response: calls.append(response) or 
+                           response * 2)
+        future.set_result(21)
+        self.assertEqual(future.result(), 42)
+        self.assertEqual(future.result(0), 42)
+        self.assertEqual(calls, [21])
+        
+    def test_handler_error(self):
+        future = ZpiFuture('key', lambda response: 1 / response)
+        future.set_result(0)
+        self.assertRaises(ZeroDivisionError, future.result)
+        self.assertTrue(isinstance(future.exception(), ZeroDivisionError))
+        
+    def test_done_once(self):
+        future = ZpiFuture('key')
+        self.assertTrue(future.set_exception(IOError('failed')))
+        self.assertFalse(future.set_result(1))
+        self.assertFalse(future.cancel())
+        self.assertRaises(IOError, future.result)
+        
+    def test_cancel(self):
+        future = ZpiFuture('key')
+        self.assertRaises(CancelledException, future.result, 0.01)
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.cancelled())
+        self.assertFalse(future.set_result(1))
+        self.assertRaises(CancelledException, future.result)
+        
+    def test_done_callbacks(self):
+        done = []
+        future = ZpiFuture('key')
+        future.add_done_callback(done.append)
+        self.assertEqual(done, [])
+        future.set_result(1)
+        future.add_done_callback(done.append)
+        self.assertEqual(done, [future, future])
+
+class PendingRequestsTest(unittest.TestCase):
+    def setUp(self):
+        self.pending = PendingRequests()
+        
+    def test_fifo_per_key(self):
+        futures = [ZpiFuture(key) for key in ('a', 'b', 'a', 'b')]
+        for future in futures:
+            self.pending.add(future)
+        self.assertEqual(self.pending.count(), 4)
+        self.assertEqual(self.pending.count('a'), 2)
+        self.assertTrue(self.pending.pop('a') is futures[0])
+        self.assertTrue(self.pending.pop('b') is futures[1])
+        self.assertTrue(self.pending.pop('a') is futures[2])
+        self.assertTrue(self.pending.pop('c') is None)
+        
+    def test_cancelled_skipped(self):
+        cancelled, live = ZpiFuture('a'), ZpiFuture('a')
+        self.pending.add(cancelled)
+        cancelled.cancel()
+        self.pending.add(live)
+        self.assertTrue(self.pending.pop('a') is live)
+        self.assertEqual(self.pending.count('a'), 0)
+        
+    def test_late_response_absorbed(self):
+        future = ZpiFuture('a')
+        self.pending.add(future)
+        future.cancel()
+        #the late response goes to the cancelled future and is dropped
+        self.assertTrue(self.pending.pop('a') is future)
+        
+    def test_grace_expired(self):
+        future = ZpiFuture('a')
+        self.pending.add(future)
+        future.cancel()
+        future.finished -= PendingRequests.CANCELLED_GRACE + 1
+        self.assertTrue(self.pending.pop('a') is None)
+        
+    def test_remove(self):
+        future = ZpiFuture('a')
+        self.pending.add(future)
+        self.pending.remove(future)
+        self.pending.remove(future)
+        self.assertEqual(self.pending.count(), 0)
+        
+    def test_fail_all(self):
+        futures = [ZpiFuture(key) for key in ('a', 'b', 'a')]
+        for future in futures:
+            self.pending.add(future)
+        self.pending.fail_all(IOError('closed'))
+        self.assertEqual(self.pending.count(), 0)
+        for future in futures:
+            self.assertRaises(IOError, future.result, 0)
+
+class AreqWaitersTest(unittest.TestCase):
+    RSP_ID = ZpiCommand.ZDO_IEEE_ADDR_RSP
+    
+    def setUp(self):
+        self.waiters = AreqWaiters()
+        
+    def test_match(self):
+        future = ZpiFuture((self.RSP_ID, 'nwk_addr', b'\x34\x12'))
+        self.waiters.add(future, time.time() + 1.0)
+        self.assertTrue(self.waiters.match(
+            {'id': self.RSP_ID, 'nwk_addr': b'\x35\x12'}) is None)
+        self.assertTrue(self.waiters.match(
+            {'id': ZpiCommand.ZDO_NWK_ADDR_RSP, 'nwk_addr': b'\x34\x12'}) 
+            is None)
+        self.assertTrue(self.waiters.match(
+            {'id': self.RSP_ID, 'nwk_addr': b'\x34\x12'}) is future)
+        self.assertTrue(self.waiters.match(
+            {'id': self.RSP_ID, 'nwk_addr': b'\x34\x12'}) is None)
+        
+    def test_fields(self):
+        #a response id may be waited for on several fields
+        by_nwk = ZpiFuture((self.RSP_ID, 'nwk_addr', b'\x34\x12'))
+        by_ieee = ZpiFuture((self.RSP_ID, 'ieee_addr', b'\x01' * 8))
+        self.waiters.add(by_nwk)
+        self.waiters.add(by_ieee)
+        self.assertTrue(self.waiters.match(
+            {'id': self.RSP_ID, 'nwk_addr': b'\x00\x00', 
+             'ieee_addr': b'\x01' * 8}) is by_ieee)
+        self.assertEqual(self.waiters.count(), 1)
+        
+    def test_deadline(self):
+        key = (self.RSP_ID, 'nwk_addr', b'\x34\x12')
+        expired, live = ZpiFuture(key), ZpiFuture(key)
+        self.waiters.add(expired, 
+                         time.time() - AreqWaiters.CANCELLED_GRACE - 1)
+        self.waiters.add(live, time.time() + 1.0)
+        self.assertTrue(expired.cancelled())
+        self.assertTrue(self.waiters.match(
+            {'id': self.RSP_ID, 'nwk_addr': b'\x34\x12'}) is live)
+
+class SrspCorrelationTest(unittest.TestCase):
+    #values of the SYS_RANDOM SRSPs not sent
+    dropped = ()
+    
+    def setUp(self):
+        self.values = []
+        self.port = FakePort(self.random)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def random(self, data):
+        """ answer SYS_RANDOM with 1, 2, 3..., the dropped values not """
+        self.values.append(len(self.values) + 1)
+        if self.values[-1] in self.dropped:
+            return []
+        return [build(ZpiCommand.SYS_RANDOM_SRSP, value = self.values[-1])]
+        
+    def test_srsp_order(self):
+        futures = [self.zpi._sreq_future(ZpiCommand.SYS_RANDOM, 
+                                         self.zpi._sys_random_srsp_handler)
+                   for i in range(10)]
+        self.assertEqual([future.result(1.0) for future in futures], 
+                         range(1, 11))
+        
+    def test_concurrent_callers(self):
+        results = []
+        def call():
+            for i in range(20):
+                results.append(self.zpi.sys_random())
+        threads = [threading.Thread(target = call) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5.0)
+        self.assertEqual(sorted(results), range(1, 81))
+        
+    def test_timeout(self):
+        self.dropped = (1, )
+        start = time.time()
+        self.assertRaises(SrspTimeoutException, self.zpi._sreq, 
+                          ZpiCommand.SYS_RANDOM, 
+                          self.zpi._sys_random_srsp_handler, 0.1)
+        self.assertTrue(0.1 <= time.time() - start < 0.5)
+        
+    def test_late_srsp(self):
+        self.dropped = (1, )
+        self.assertRaises(SrspTimeoutException, self.zpi._sreq, 
+                          ZpiCommand.SYS_RANDOM, 
+                          self.zpi._sys_random_srsp_handler, 0.05)
+        #absorbed by the timed out request
+        self.port.feed(build(ZpiCommand.SYS_RANDOM_SRSP, value = 1))
+        time.sleep(0.05)
+        self.assertEqual(self.zpi.sys_random(), 2)
+        
+    def test_lost_srsp(self):
+        self.dropped = (1, )
+        self.assertRaises(SrspTimeoutException, self.zpi._sreq, 
+                          ZpiCommand.SYS_RANDOM, 
+                          self.zpi._sys_random_srsp_handler, 0.1)
+        self.assertEqual([self.zpi.sys_random() for i in range(10)], 
+                         range(2, 12))
+        self.assertEqual(self.zpi._pending_srsp.count(), 0)
+        
+    def test_legacy_srsp(self):
+        #a SRSP nobody waits for goes to the event path
+        self.port.feed(build(ZpiCommand.SYS_RANDOM_SRSP, value = 7))
+        self.assertTrue(self.zpi._srsp_event_wait(ZpiCommand.SYS_RANDOM_SRSP, 
+                                                  1.0))
+        self.assertEqual(self.zpi._srsp_rx_msg['value'], b'\x07\x00')
+        
+    def test_write_error(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        self.port = FailingPort()
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        self.assertRaises(IOError, self.zpi.sys_random)
+        self.assertEqual(self.zpi._pending_srsp.count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+    metrics tests, the Zpi ones run against the ZNP simulator or a fake port
+
+    run: python -m unittest zpi.test.metrics_test
+"""
+import os
+import unittest
+import urllib2
+
+from zpi.zpi2 import Zpi, SrspTimeoutException
+from zpi.command import ZpiCommand
+from zpi.future import ZpiFuture
+from zpi.metrics import Metrics, Histogram, start_http_server
+from zpi.simulator import ZnpSimulator
+from zpi.test.fakeport import FakePort, build
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram((0.1, 0.01, 1.0))
+        for value in (0.005, 0.01, 0.05, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.bounds, (0.01, 0.1, 1.0))
+        #upper bounds are inclusive
+        self.assertEqual(histogram.buckets(), [(0.01, 2), (0.1, 3), (1.0, 4), 
+                                               (float('inf'), 5)])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 2.565)
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(buckets = (0.01, 0.1))
+        
+    def test_counters(self):
+        self.metrics.incr('rx_frames_total', 'AF_INCOMING_MSG')
+        self.metrics.incr('rx_frames_total', 'AF_INCOMING_MSG', 2)
+        self.metrics.incr('bad_frames_total')
+        self.assertEqual(self.metrics.snapshot()['counters'], {
+            'rx_frames_total': {'AF_INCOMING_MSG': 3}, 
+            'bad_frames_total': {None: 1}})
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot(), 
+                         {'counters': {}, 'histograms': {}})
+        
+    def test_track(self):
+        futures = [ZpiFuture() for index in range(3)]
+        for future in futures:
+            self.metrics.track('sreq', 'SYS_VERSION', future)
+        futures[0].set_result(1)
+        futures[1].cancel()
+        futures[2].set_exception(IOError('port closed'))
+        
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {
+            'sreq_total': {'SYS_VERSION': 3}, 
+            'sreq_timeouts_total': {'SYS_VERSION': 1}, 
+            'sreq_errors_total': {'SYS_VERSION': 1}})
+        latency = snapshot['histograms']['sreq_latency_seconds']['SYS_VERSION']
+        self.assertEqual(latency['count'], 1)
+        self.assertEqual(latency['sum'], 
+                         futures[0].finished - futures[0].created)
+        
+    def test_prometheus(self):
+        self.metrics.incr('sreq_total', 'SYS_VERSION', 2)
+        self.metrics.incr('bad_frames_total')
+        self.metrics.observe('sreq_latency_seconds', 'SYS_VERSION', 0.05)
+        bucket = ('zpi_sreq_latency_seconds_bucket'
+                  '{command="SYS_VERSION",le="%s"}')
+        self.assertEqual(self.metrics.prometheus().split('\n'), [
+            '# TYPE zpi_bad_frames_total counter', 
+            'zpi_bad_frames_total 1', 
+            '# TYPE zpi_sreq_total counter', 
+            'zpi_sreq_total{command="SYS_VERSION"} 2', 
+            '# TYPE zpi_sreq_latency_seconds histogram', 
+            bucket % '0.01' + ' 0', 
+            bucket % '0.1' + ' 1', 
+            bucket % '+Inf' + ' 1', 
+            'zpi_sreq_latency_seconds_sum{command="SYS_VERSION"} 0.05', 
+            'zpi_sreq_latency_seconds_count{command="SYS_VERSION"} 1', 
+            ''])
+        
+    def test_http_server(self):
+        self.metrics.incr('sreq_total', 'SYS_VERSION')
+        server = start_http_server(self.metrics, 0, '127.0.0.1')
+        try:
+            response = urllib2.urlopen('http://127.0.0.1:%d/metrics' % 
+                                       server.server_address[1], timeout = 5)
+            self.assertTrue(response.info()['Content-Type'].startswith(
+                'text/plain; version=0.0.4'))
+            self.assertEqual(response.read(), self.metrics.prometheus())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class ZpiMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = ZnpSimulator(latency = 0.001, areq_latency = 0.002)
+        self.zpi = Zpi(self.sim, lambda zpi, rx_data: None)
+        self.metrics = self.zpi.metrics = Metrics()
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.sim.close()
+        
+    def counter(self, name, label = None):
+        return self.metrics.snapshot()['counters'].get(name, {}).get(label, 0)
+        
+    def test_sreq(self):
+        for index in range(3):
+            self.zpi.sys_version()
+        self.assertEqual(self.counter('sreq_total', ZpiCommand.SYS_VERSION), 3)
+        self.assertEqual(self.counter('rx_frames_total', 
+                                      ZpiCommand.SYS_VERSION_SRSP), 3)
+        latency = self.metrics.snapshot()['histograms'][
+            'sreq_latency_seconds'][ZpiCommand.SYS_VERSION]
+        self.assertEqual(latency['count'], 3)
+        self.assertTrue(latency['sum'] >= 0.003)
+        
+    def test_sreq_timeout(self):
+        self.sim.on(ZpiCommand.SYS_VERSION, lambda sim, command, request: [])
+        self.assertRaises(SrspTimeoutException, self.zpi.sys_version)
+        self.assertEqual(self.counter('sreq_timeouts_total', 
+                                      ZpiCommand.SYS_VERSION), 1)
+        
+    def test_zdo(self):
+        self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x1234)
+        self.assertEqual(self.counter('zdo_total', 
+                                      ZpiCommand.ZDO_IEEE_ADDR_REQ), 1)
+        self.assertEqual(self.metrics.snapshot()['histograms'][
+            'zdo_latency_seconds'][ZpiCommand.ZDO_IEEE_ADDR_REQ]['count'], 1)
+        
+    def test_disabled(self):
+        self.zpi.metrics = None
+        self.zpi.sys_version()
+        self.assertEqual(self.metrics.snapshot()['counters'], {})
+
+class FrameMetricsTest(unittest.TestCase):
+    """ the frames counted by the reader, fed as they come from the port """
+    def setUp(self):
+        self.port = FakePort()
+        self.metrics = Metrics()
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def start(self, callback):
+        self.zpi = Zpi(self.port, callback)
+        self.zpi.metrics = self.metrics
+        
+    def counters(self):
+        self.zpi.sys_version()      #the frames fed before are handled
+        return self.metrics.snapshot()['counters']
+        
+    def test_rx_frames(self):
+        self.start(lambda zpi, rx_data: None)
+        self.port.feed(build(ZpiCommand.SYS_RESET_IND), 
+                       build(ZpiCommand.SYS_RESET_IND))
+        self.assertEqual(self.counters()['rx_frames_total'], {
+            ZpiCommand.SYS_RESET_IND: 2, ZpiCommand.SYS_VERSION_SRSP: 1})
+        
+    def test_rejected_frames(self):
+        self.start(lambda zpi, rx_data: None)
+        #a SYS_VERSION SREQ with a wrong FCS, then a frame of no known id
+        os.write(self.port._tx, b'\xfe\x00\x21\x02\x00')
+        self.port.feed(b'\x45\x7e\x00')
+        counters = self.counters()
+        self.assertEqual(counters['bad_frames_total'], {None: 1})
+        self.assertEqual(counters['unknown_frames_total'], {None: 1})
+        
+    def test_dropped(self):
+        #subscriptions and no async callback, the others are dropped
+        self.start(None)
+        self.zpi.subscribe(ZpiCommand.ZDO_LEAVE_IND, lambda zpi, fields: None)
+        self.port.feed(build(ZpiCommand.SYS_RESET_IND), 
+                       build(ZpiCommand.ZDO_LEAVE_IND))
+        self.assertEqual(self.counters()['rx_dropped_total'], {None: 1})
+
+if __name__ == '__main__':
+    unittest.main()
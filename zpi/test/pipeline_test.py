@@ -0,0 +1,127 @@
+"""
+    pipelined SREQ tests
+
+    run: python -m unittest zpi.test.pipeline_test
+"""
+import struct
+import threading
+import time
+import unittest
+
+from zpi.zpi2 import Zpi, SrspTimeoutException
+from zpi.command import ZpiCommand
+from zpi.future import ZpiFuture
+from zpi.test.fakeport import FakePort, build, srsp
+
+SYS_RANDOM = b'\x21\x0c'
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.values = []
+        self.held = None    #SYS_RANDOM SRSPs held back, None to answer them
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def respond(self, data):
+        """ answer SYS_RANDOM with 1, 2, 3..., the other SREQs with zeros """
+        if data[0:2] != SYS_RANDOM:
+            return [srsp(data)]
+        self.values.append(len(self.values) + 1)
+        response = build(ZpiCommand.SYS_RANDOM_SRSP, value = self.values[-1])
+        if self.held is not None:
+            self.held.append(response)
+            return []
+        return [response]
+        
+    def release(self, delay = 0, count = 1):
+        """ send the held SRSPs after delay seconds, once count are held """
+        deadline = time.time() + 1.0
+        while len(self.held) < count and time.time() < deadline:
+            time.sleep(0.001)
+        held, self.held = self.held, None
+        threading.Timer(delay, self.port.feed, held).start()
+        
+    def test_gather_order(self):
+        pipe = self.zpi.pipeline(window = 4)
+        futures = []
+        for i in range(6):
+            futures.append(pipe.sys_random())
+            futures.append(pipe.sys_version())
+        results = pipe.gather(futures)
+        self.assertEqual(results[0::2], range(1, 7))
+        self.assertEqual(results[1::2], [(0, 0, 0, 0, 0)] * 6)
+        self.assertEqual(pipe.in_flight(), 0)
+        
+    def test_commands_overlap(self):
+        #a SRSP of another command does not wait for the earlier requests
+        self.held = []
+        pipe = self.zpi.pipeline(window = 4)
+        random, version = pipe.sys_random(), pipe.sys_version()
+        self.assertEqual(pipe.result(version), (0, 0, 0, 0, 0))
+        self.assertFalse(random.done())
+        self.release()
+        self.assertEqual(pipe.result(random), 1)
+        
+    def test_map(self):
+        pipe = self.zpi.pipeline(window = 2)
+        self.assertEqual(pipe.map('sys_random', [()] * 5), range(1, 6))
+        
+    def test_window(self):
+        self.held = []
+        pipe = self.zpi.pipeline(window = 2, srsp_timeout = 0.1)
+        start = time.time()
+        first = [pipe.sys_random(), pipe.sys_random()]
+        self.assertEqual(pipe.in_flight(), 2)
+        self.assertTrue(time.time() - start < 0.1)
+        
+        #blocks until the first request expires and frees its slot
+        third = pipe.sys_random()
+        self.assertTrue(time.time() - start >= 0.1)
+        self.assertTrue(first[0].cancelled())
+        self.assertFalse(third.done())
+        self.assertTrue(pipe.in_flight() <= 2)
+        
+    def test_deadline_cancel(self):
+        self.held = []
+        pipe = self.zpi.pipeline(window = 4, srsp_timeout = 0.05)
+        futures = [pipe.sys_random(), pipe.sys_version()]
+        self.assertRaises(SrspTimeoutException, pipe.gather, futures)
+        self.assertTrue(futures[0].cancelled())
+        self.assertEqual(pipe.result(futures[1]), (0, 0, 0, 0, 0))
+        
+    def test_drain(self):
+        self.held = []
+        pipe = self.zpi.pipeline(window = 8)
+        futures = [pipe.sys_random() for i in range(8)]
+        #the writer thread may still be writing the last ones
+        self.release(0.02, 8)
+        pipe.drain()
+        self.assertEqual([future.result(0) for future in futures], 
+                         range(1, 9))
+        self.assertEqual(pipe.in_flight(), 0)
+        
+    def test_thread_local(self):
+        pipe = self.zpi.pipeline()
+        future = pipe.sys_random()
+        self.assertTrue(isinstance(future, ZpiFuture))
+        #the methods called directly still wait for their SRSP
+        self.assertEqual(self.zpi.sys_random(), 2)
+        self.assertEqual(future.result(1.0), 1)
+        
+        self.assertRaises(struct.error, pipe.util_addrmgr_nwk_addr_lookup, 
+                          'nwk_addr')
+        self.assertTrue(self.zpi._sreq_local.pipeline is None)
+        self.assertEqual(self.zpi.sys_random(), 3)
+        
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.zpi.pipeline, 0)
+        pipe = self.zpi.pipeline()
+        self.assertRaises(AttributeError, getattr, pipe, 'no_such_method')
+        self.assertRaises(AttributeError, getattr, pipe, 'serial')
+
+if __name__ == '__main__':
+    unittest.main()
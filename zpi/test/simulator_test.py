@@ -0,0 +1,192 @@
+"""
+    ZNP simulator tests, at the frame level and under Zpi
+
+    run: python -m unittest zpi.test.simulator_test
+"""
+import os
+import select
+import struct
+import time
+import unittest
+
+from zpi.frame import ZnpFrame, ZnpFrameDecoder
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.simulator import ZnpSimulator
+
+#SYS_VERSION and its SRSP command bytes
+SYS_VERSION = b'\x21\x02'
+SYS_VERSION_SRSP = b'\x61\x02'
+
+class FrameLevelTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = ZnpSimulator()
+        self.decoder = ZnpFrameDecoder()
+        
+    def tearDown(self):
+        self.sim.close()
+        
+    def read_frames(self, count, timeout = 1.0):
+        """ read up to count frame data from the simulator """
+        frames = []
+        deadline = time.time() + timeout
+        while len(frames) < count:
+            remaining = deadline - time.time()
+            if (remaining <= 0 or 
+                    not select.select([self.sim], [], [], remaining)[0]):
+                break
+            frames.extend(frame.data for frame in 
+                          self.decoder.feed(self.sim.read(256)))
+        return frames
+        
+    def request(self, data):
+        self.sim.write(ZnpFrame(data).output())
+        
+    def test_default_srsp(self):
+        self.request(SYS_VERSION)
+        frame, = self.read_frames(1)
+        self.assertEqual(frame[0:2], SYS_VERSION_SRSP)
+        self.assertEqual((self.sim.sreqs, self.sim.srsps), (1, 1))
+        
+    def test_request_fields(self):
+        #the SRSP fields named as request fields get their value
+        self.request(b'\x27\x41\x34\x12')
+        frame, = self.read_frames(1)
+        self.assertEqual(frame, b'\x67\x41' + struct.pack(
+            '<Q', ZnpSimulator.IEEE_ADDR_BASE | 0x1234))
+        
+    def test_unknown_command(self):
+        self.request(b'\x2f\xee\x01')
+        self.assertEqual(self.read_frames(1, 0.1), [])
+        self.assertEqual((self.sim.unknown, self.sim.sreqs), (1, 0))
+        
+    def test_handler(self):
+        requests = []
+        def handler(sim, command, request):
+            requests.append(command)
+            if len(requests) == 1:
+                return []       #no answer
+            if len(requests) == 2:
+                return None     #the default answer
+            return [(ZpiCommand.SYS_VERSION_SRSP, 
+                     {'transport_rev': 9}), 
+                    (ZpiCommand.AF_DATA_CONFIRM, {'trans_id': 3})]
+        self.sim.on(ZpiCommand.SYS_VERSION, handler)
+        
+        for index in range(3):
+            self.request(SYS_VERSION)
+        frames = self.read_frames(3)
+        self.assertEqual(requests, [ZpiCommand.SYS_VERSION] * 3)
+        self.assertEqual([frame[0:2] for frame in frames], 
+                         [SYS_VERSION_SRSP, SYS_VERSION_SRSP, b'\x44\x80'])
+        self.assertEqual(frames[1][2], b'\x09')
+        self.assertEqual((self.sim.srsps, self.sim.areqs), (2, 1))
+        
+        self.sim.on(ZpiCommand.SYS_VERSION, None)
+        self.request(SYS_VERSION)
+        self.assertEqual(len(self.read_frames(1)), 1)
+        self.assertEqual(len(requests), 3)
+        
+    def test_srsp_order(self):
+        #the first SRSP is the slowest, it still goes out first
+        latencies = iter([0.1, 0.0, 0.0, 0.0])
+        self.sim.latency = lambda: next(latencies)
+        for index in range(3):
+            self.request(SYS_VERSION)
+        self.request(b'\x27\x41\x34\x12')
+        frames = self.read_frames(4)
+        self.assertEqual([frame[0:2] for frame in frames], 
+                         [SYS_VERSION_SRSP] * 3 + [b'\x67\x41'])
+        
+    def test_split_writes(self):
+        data = ZnpFrame(SYS_VERSION).output() * 2
+        for index in range(len(data)):
+            self.sim.write(data[index])
+        self.assertEqual(len(self.read_frames(2)), 2)
+        
+    def test_build(self):
+        self.assertEqual(self.sim.build(ZpiCommand.AF_DATA_CONFIRM, 
+                                        status = 1, trans_id = 0x20), 
+                         b'\x44\x80\x01\x00\x20')
+        self.assertRaises(ValueError, self.sim.build, 
+                          ZpiCommand.ZDO_LEAVE_IND, ext_addr = b'\x01')
+        
+    def test_flood_rate(self):
+        start = time.time()
+        self.sim.flood_af_incoming(11, rate = 100, wait = True)
+        self.assertTrue(time.time() - start >= 0.095)
+        self.assertEqual(len(self.read_frames(11)), 11)
+        
+    def test_close(self):
+        #nobody reads, the writer blocks on the full pipe
+        self.sim.flood_af_incoming(5000, wait = True)
+        time.sleep(0.05)
+        fds = self.sim._fds
+        self.sim.close()
+        self.assertFalse(any(thread.is_alive() 
+                             for thread in self.sim._threads))
+        for fd in fds:
+            self.assertRaises(OSError, os.fstat, fd)
+        self.sim.close()
+        
+    def test_pty(self):
+        try:
+            path = self.sim.open_pty()
+        except (ImportError, OSError):
+            raise unittest.SkipTest('no pseudo terminal')
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        try:
+            os.write(fd, ZnpFrame(SYS_VERSION).output())
+            decoder = ZnpFrameDecoder()
+            frames = []
+            deadline = time.time() + 1.0
+            while not frames and time.time() < deadline:
+                if select.select([fd], [], [], 0.1)[0]:
+                    frames.extend(decoder.feed(os.read(fd, 256)))
+            self.assertEqual(frames[0].data[0:2], SYS_VERSION_SRSP)
+        finally:
+            os.close(fd)
+
+class AddressConsistencyTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = ZnpSimulator(devices = {0x1234: 0x00124B0001020304}, 
+                                latency = 0.001, areq_latency = 0.002)
+        self.zpi = Zpi(self.sim, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.sim.close()
+        
+    def test_zdo_addresses(self):
+        (status, ieee_addr, nwk_addr, start_index, assoc_dev_num, 
+         assoc_dev) = self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, 
+                                            0x1234)
+        self.assertEqual(ieee_addr, 0x00124B0001020304)
+        (status, ieee_addr, nwk_addr, start_index, 
+         assoc_dev) = self.zpi.zdo_exchange(ZpiCommand.ZDO_NWK_ADDR_REQ, 
+                                            0x00124B0001020304, 0, 0)
+        self.assertEqual(nwk_addr, 0x1234)
+        
+    def test_unknown_device(self):
+        self.assertEqual(self.sim.ieee_addr(0x4321), 
+                         ZnpSimulator.IEEE_ADDR_BASE | 0x4321)
+        self.assertEqual(self.sim.nwk_addr(ZnpSimulator.IEEE_ADDR_BASE | 
+                                           0x4321), 0x4321)
+        
+    def test_announce_new_devices(self):
+        received = []
+        self.zpi.subscribe(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND, 
+                           lambda zpi, fields: received.append(fields), 
+                           fields = ['nwk_addr', 'ieee_addr'])
+        self.sim.announce_devices(3, wait = True)
+        deadline = time.time() + 2.0
+        while len(received) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([(fields['nwk_addr'], fields['ieee_addr']) 
+                          for fields in received], 
+                         [(0x1234, 0x00124B0001020304), 
+                          (0x0001, ZnpSimulator.IEEE_ADDR_BASE | 0x0001), 
+                          (0x0002, ZnpSimulator.IEEE_ADDR_BASE | 0x0002)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+    source route cache tests
+
+    run: python -m unittest zpi.test.srcroute_test
+"""
+import struct
+import time
+import unittest
+
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.srcroute import SourceRouteCache
+from zpi.test.fakeport import FakePort, build, srsp
+
+class SourceRouteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.routes = SourceRouteCache(capacity = 3, ttl = 60.0)
+        
+    def test_update_get(self):
+        self.routes.update(0x0010, [0x0001, 0x0002])
+        self.assertEqual(self.routes.get(0x0010), (0x0001, 0x0002))
+        self.assertEqual(self.routes.get(0x0011), None)
+        self.routes.update(0x0010, [0x0003])
+        self.assertEqual(self.routes.get(0x0010), (0x0003, ))
+        self.assertEqual((self.routes.hits, self.routes.misses), (2, 1))
+        
+    def test_lru_eviction(self):
+        for dst_addr in range(1, 4):
+            self.routes.update(dst_addr, [])
+        self.routes.get(1)
+        self.routes.update(4, [])
+        self.assertEqual([dst_addr for dst_addr, relays 
+                          in self.routes.items()], [3, 1, 4])
+        
+    def test_ttl(self):
+        self.routes.update(0x0010, [0x0001])
+        self.routes.ttl = 0.0
+        time.sleep(0.01)
+        self.assertEqual(self.routes.get(0x0010), None)
+        
+    def test_invalidate(self):
+        self.routes.update(0x0010, [0x0001, 0x0002])
+        self.routes.update(0x0011, [0x0002])
+        self.routes.update(0x0002, [0x0001])
+        #routes to 0x0002 and through 0x0002
+        self.assertEqual(self.routes.invalidate(0x0002), 3)
+        self.routes.update(0x0010, [0x0001, 0x0002])
+        self.routes.update(0x0011, [0x0003])
+        self.assertEqual(self.routes.invalidate(0x0001), 1)
+        self.assertEqual(self.routes.items(), [(0x0011, (0x0003, ))])
+        
+    def test_invalid_capacity(self):
+        self.assertRaises(ValueError, SourceRouteCache, 0)
+
+AF_DATA_REQUEST = b'\x24\x01'
+AF_DATA_REQUEST_SRC_RTG = b'\x24\x03'
+
+def src_rtg_ind(dst_addr, relays):
+    return build(ZpiCommand.ZDO_SRC_RTG_IND, dst_addr = dst_addr, 
+                 relay_cnt = len(relays), 
+                 relay_list = struct.pack('<%dH' % len(relays), *relays))
+
+class ZpiSourceRouteTest(unittest.TestCase):
+    def setUp(self):
+        self.port = FakePort(lambda data: [srsp(data)])
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def feed(self, *datas):
+        """ feed AREQs, the SREQ after them returns once they are handled """
+        self.port.feed(*datas)
+        self.zpi.sys_version()
+        
+    def af_requests(self):
+        """ (command, dst_addr) of the AF data requests sent """
+        return [(data[0:2], struct.unpack('<H', data[2:4])[0]) 
+                for data in self.port.requests 
+                if data[0:2] in (AF_DATA_REQUEST, AF_DATA_REQUEST_SRC_RTG)]
+        
+    def test_route_record(self):
+        self.feed(src_rtg_ind(0x0010, [0x0001, 0x0002]))
+        self.assertEqual(self.zpi.source_routes.get(0x0010), (0x0001, 0x0002))
+        
+    def test_auto_route(self):
+        self.feed(src_rtg_ind(0x0010, [0x0001, 0x0002]))
+        for dst_addr in (0x0010, 0x0011):
+            self.assertEqual(self.zpi.af_data_request_auto_route(
+                dst_addr, 1, 1, 0x0006, 1, 0, 30, b'\x01'), 0)
+        self.assertEqual(self.af_requests(), 
+                         [(AF_DATA_REQUEST_SRC_RTG, 0x0010), 
+                          (AF_DATA_REQUEST, 0x0011)])
+        #relay count and relay list follow the radius
+        data = self.port.requests[-2]
+        self.assertEqual(data[11:16], b'\x02\x01\x00\x02\x00')
+        
+    def test_leave(self):
+        self.feed(src_rtg_ind(0x0010, [0x0001]), 
+                  build(ZpiCommand.ZDO_LEAVE_IND, src_addr = 0x0001))
+        self.assertEqual(len(self.zpi.source_routes), 0)
+        
+    def test_rejoin(self):
+        self.feed(src_rtg_ind(0x0010, [0x0001]), 
+                  src_rtg_ind(0x0020, [0x0002]), 
+                  build(ZpiCommand.ZDO_END_DEVICE_ANNCE_IND, 
+                        src_addr = 0x0010, nwk_addr = 0x0010))
+        self.assertEqual(self.zpi.source_routes.items(), 
+                         [(0x0020, (0x0002, ))])
+
+if __name__ == '__main__':
+    unittest.main()
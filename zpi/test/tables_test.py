@@ -0,0 +1,112 @@
+"""
+    ZDO management table decoding tests
+
+    run: python -m unittest zpi.test.tables_test
+"""
+import random
+import struct
+import unittest
+
+from zpi import tables
+from zpi.tables import (NBR_TABLE, RTG_TABLE, NWK_DISC_TABLE, 
+                        decode_nbr_table, decode_rtg_table, 
+                        decode_nwk_disc_table)
+
+def random_records(layout, count, rand):
+    """ get (packed records, [{field name: value}]) of random records """
+    fmt = struct.Struct('<' + layout.codes)
+    rows = []
+    for index in range(count):
+        rows.append(dict((field_name, 
+                          rand.randrange(1 << 8 * struct.calcsize(code))) 
+                         for field_name, code in layout.fields))
+    data = b''.join(fmt.pack(*[row[field_name] 
+                               for field_name, code in layout.fields]) 
+                    for row in rows)
+    return data, rows
+
+def expected_rows(layout, rows):
+    """ add the bitfield columns to the rows, the way a per record loop does """
+    for row in rows:
+        for name, field_name, shift, mask in layout.bitfields:
+            row[name] = (row[field_name] >> shift) & mask
+    return rows
+
+class RecordLayoutTest(unittest.TestCase):
+    LAYOUTS = (NBR_TABLE, RTG_TABLE, NWK_DISC_TABLE)
+    
+    def setUp(self):
+        self.use_numpy = tables.TABLES_USE_NUMPY
+        tables.TABLES_USE_NUMPY = False
+        
+    def tearDown(self):
+        tables.TABLES_USE_NUMPY = self.use_numpy
+        
+    def check_decode(self, use_numpy):
+        tables.TABLES_USE_NUMPY = use_numpy
+        rand = random.Random(11)
+        for layout in self.LAYOUTS:
+            for count in (0, 1, 3, 16):
+                data, rows = random_records(layout, count, rand)
+                table = layout.decode(data)
+                self.assertEqual(table.count, count)
+                self.assertEqual(list(table.rows()), 
+                                 expected_rows(layout, rows))
+                
+    def test_sizes(self):
+        self.assertEqual(NBR_TABLE.size, 22)
+        self.assertEqual(RTG_TABLE.size, 5)
+        self.assertEqual(NWK_DISC_TABLE.size, 6)
+        
+    def test_decode_struct(self):
+        self.check_decode(False)
+        
+    def test_decode_numpy(self):
+        if tables.numpy is None:
+            raise unittest.SkipTest('numpy is not installed')
+        self.check_decode(True)
+        
+    def test_columns(self):
+        data, rows = random_records(RTG_TABLE, 4, random.Random(1))
+        table = decode_rtg_table(data)
+        self.assertEqual(sorted(table), sorted(RTG_TABLE.column_names))
+        self.assertEqual(list(table['dst_addr']), 
+                         [row['dst_addr'] for row in rows])
+        self.assertEqual(list(table['route_status']), 
+                         [row['status'] & 0x07 for row in rows])
+        
+    def test_nbr_bitfields(self):
+        record = struct.pack('<QQHBBBB', 1, 0x00124B0000000001, 0x0001, 
+                             0x01 | 0x01 << 2 | 0x02 << 4, 0, 1, 200)
+        row, = decode_nbr_table(record).rows()
+        self.assertEqual(row['device_type'], 0x01)
+        self.assertEqual(row['rx_on_when_idle'], 0x01)
+        self.assertEqual(row['relationship'], 0x02)
+        self.assertEqual(row['ieee_addr'], 0x00124B0000000001)
+        self.assertEqual(row['lqi'], 200)
+        
+    def test_record_slices(self):
+        data, rows = random_records(NBR_TABLE, 5, random.Random(2))
+        slices = [data[index:index + NBR_TABLE.size] 
+                  for index in range(0, len(data), NBR_TABLE.size)]
+        self.assertEqual(list(decode_nbr_table(slices).rows()), 
+                         list(decode_nbr_table(data).rows()))
+        
+    def test_count(self):
+        data, rows = random_records(NWK_DISC_TABLE, 6, random.Random(3))
+        table = decode_nwk_disc_table(data, 2)
+        self.assertEqual(table.count, 2)
+        self.assertEqual(list(table.rows()), 
+                         expected_rows(NWK_DISC_TABLE, rows[0:2]))
+        
+    def test_trailing_bytes(self):
+        data, rows = random_records(RTG_TABLE, 3, random.Random(4))
+        self.assertEqual(decode_rtg_table(data + b'\x00\x01').count, 3)
+        
+    def test_short_data(self):
+        data, rows = random_records(RTG_TABLE, 3, random.Random(5))
+        self.assertRaises(ValueError, decode_rtg_table, data, 4)
+        self.assertRaises(ValueError, decode_rtg_table, data[:-1], 3)
+
+if __name__ == '__main__':
+    unittest.main()
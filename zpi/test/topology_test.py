@@ -0,0 +1,171 @@
+"""
+    topology crawler tests
+
+    run: python -m unittest zpi.test.topology_test
+"""
+import collections
+import struct
+import unittest
+
+from zpi.zpi2 import Zpi, AreqTimeoutException
+from zpi.command import ZpiCommand
+from zpi.topology import (DEVICE_TYPE_COORDINATOR, DEVICE_TYPE_ROUTER,
+                          DEVICE_TYPE_ENDDEVICE, RELATION_PARENT,
+                          RELATION_CHILD, RELATION_SIBLING)
+from zpi.test.fakeport import FakePort, build, srsp
+
+ZDO_IEEE_ADDR_REQ = b'\x25\x01'
+ZDO_MGMT_LQI_REQ = b'\x25\x31'
+ZDO_MGMT_RTG_REQ = b'\x25\x32'
+
+#neighbor table record: ext_pan_id, ieee_addr, nwk_addr, device_type |
+#rx_on_when_idle | relationship, permit_joining, depth, lqi
+NBR_RECORD = struct.Struct('<QQHBBBB')
+
+#routing table record: dst_addr, status, next_hop
+RTG_RECORD = struct.Struct('<HBH')
+
+#nwk_addr: [(neighbor nwk_addr, device_type, relationship)]
+NETWORK = {
+    0x0000: [(0x0001, DEVICE_TYPE_ROUTER, RELATION_CHILD),
+             (0x0002, DEVICE_TYPE_ROUTER, RELATION_CHILD),
+             (0x0003, DEVICE_TYPE_ENDDEVICE, RELATION_CHILD)],
+    0x0001: [(0x0000, DEVICE_TYPE_COORDINATOR, RELATION_PARENT),
+             (0x0002, DEVICE_TYPE_ROUTER, RELATION_SIBLING),
+             (0x0011, DEVICE_TYPE_ENDDEVICE, RELATION_CHILD),
+             (0x0012, DEVICE_TYPE_ENDDEVICE, RELATION_CHILD),
+             (0x0013, DEVICE_TYPE_ENDDEVICE, RELATION_CHILD)],
+    0x0002: [(0x0000, DEVICE_TYPE_COORDINATOR, RELATION_PARENT),
+             (0x0001, DEVICE_TYPE_ROUTER, RELATION_SIBLING),
+             (0x0021, DEVICE_TYPE_ENDDEVICE, RELATION_CHILD)]}
+
+#records per neighbor table page
+PAGE_SIZE = 2
+
+def ieee(nwk_addr):
+    return 0x00124b0000000000 | nwk_addr
+
+class TopologyCrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.network = dict(NETWORK)
+        self.ieee = {}          #nwk_addr: IEEE address if not ieee(nwk_addr)
+        self.silent = set()     #routers answering the LQI SRSP only
+        self.pages = collections.Counter()  #(nwk_addr, start_index)
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def ieee_addr(self, nwk_addr):
+        return self.ieee.get(nwk_addr, ieee(nwk_addr))
+        
+    def respond(self, data):
+        """ answer the ZDO requests as the devices of self.network would """
+        nwk_addr = struct.unpack('<H', data[2:4])[0]
+        if data[0:2] == ZDO_IEEE_ADDR_REQ:
+            return [srsp(data), build(ZpiCommand.ZDO_IEEE_ADDR_RSP,
+                                      ieee_addr = self.ieee_addr(nwk_addr),
+                                      nwk_addr = nwk_addr)]
+        if data[0:2] == ZDO_MGMT_LQI_REQ:
+            start_index = ord(data[4])
+            self.pages[(nwk_addr, start_index)] += 1
+            if nwk_addr in self.silent:
+                return [srsp(data)]
+            neighbors = self.network[nwk_addr]
+            records = [NBR_RECORD.pack(1, self.ieee_addr(nbr_addr), nbr_addr,
+                                       device_type | 0x04 | relationship << 4,
+                                       0, 1, 100 + nbr_addr)
+                       for nbr_addr, device_type, relationship in
+                       neighbors[start_index:start_index + PAGE_SIZE]]
+            return [srsp(data), build(ZpiCommand.ZDO_MGMT_LQI_RSP,
+                                      src_addr = nwk_addr,
+                                      nbr_table_entries = len(neighbors),
+                                      start_index = start_index,
+                                      nbr_table_list_cnt = len(records),
+                                      nbr_table_list_records =
+                                      b''.join(records))]
+        if data[0:2] == ZDO_MGMT_RTG_REQ:
+            #every router routes to 0x0021 through 0x0002
+            return [srsp(data), build(ZpiCommand.ZDO_MGMT_RTG_RSP,
+                                      src_addr = nwk_addr,
+                                      rtg_table_entries = 1,
+                                      rtg_table_list_cnt = 1,
+                                      rtg_table_list_records =
+                                      RTG_RECORD.pack(0x0021, 0, 0x0002))]
+        return [srsp(data)]
+        
+    def test_crawl(self):
+        found = []
+        crawler = self.zpi.topology_crawler(concurrency = 2,
+                                            on_node = found.append)
+        topology = crawler.crawl()
+        
+        nwk_addrs = [0x0000, 0x0001, 0x0002, 0x0003, 0x0011, 0x0012, 0x0013,
+                     0x0021]
+        self.assertEqual(len(topology), len(nwk_addrs))
+        self.assertEqual(sorted(node.nwk_addr for node in found), nwk_addrs)
+        for nwk_addr in nwk_addrs:
+            self.assertEqual(topology.node_by_nwk(nwk_addr).ieee_addr,
+                             ieee(nwk_addr))
+        self.assertEqual([topology.node_by_nwk(nwk_addr).device_type
+                          for nwk_addr in (0x0000, 0x0002, 0x0013)],
+                         [DEVICE_TYPE_COORDINATOR, DEVICE_TYPE_ROUTER,
+                          DEVICE_TYPE_ENDDEVICE])
+        self.assertTrue(topology.node_by_nwk(0x0013).rx_on_when_idle)
+        
+        self.assertEqual(topology.links[(ieee(0x0001), ieee(0x0013))],
+                         {'lqi': 100 + 0x0013, 'relationship': RELATION_CHILD})
+        self.assertEqual(sorted(dst for dst, link in
+                                topology.neighbors(ieee(0x0002))),
+                         [ieee(0x0000), ieee(0x0001), ieee(0x0021)])
+        self.assertEqual(len(topology.links),
+                         sum(len(nbrs) for nbrs in NETWORK.values()))
+        
+        #every page of every router read once, end devices never asked
+        self.assertEqual(self.pages, collections.Counter(
+            (nwk_addr, start_index) for nwk_addr, nbrs in NETWORK.items()
+            for start_index in range(0, len(nbrs), PAGE_SIZE)))
+        self.assertEqual(crawler.failures, [])
+        
+    def test_rejoined_node(self):
+        #0x0013 rejoined as 0x0022 under 0x0002, which still lists it
+        self.ieee[0x0022] = ieee(0x0013)
+        self.network[0x0002] = NETWORK[0x0002] + [
+            (0x0022, DEVICE_TYPE_ENDDEVICE, RELATION_CHILD)]
+        topology = self.zpi.topology_crawler().crawl()
+        self.assertEqual(len(topology), 8)
+        #known under the address read last
+        node = topology.nodes[ieee(0x0013)]
+        self.assertTrue(node.nwk_addr in (0x0013, 0x0022))
+        self.assertTrue(topology.node_by_nwk(node.nwk_addr) is node)
+        
+    def test_routes(self):
+        topology = self.zpi.topology_crawler(routes = True).crawl()
+        self.assertEqual(sorted(topology.routes),
+                         sorted((ieee(nwk_addr), 0x0021)
+                                for nwk_addr in NETWORK))
+        self.assertEqual(topology.routes[(ieee(0x0001), 0x0021)],
+                         {'status': 0x00, 'next_hop': 0x0002})
+        
+    def test_lost_page(self):
+        self.silent.add(0x0002)
+        crawler = self.zpi.topology_crawler(areq_timeout = 0.05,
+                                            retries = 1)
+        topology = crawler.crawl()
+        
+        #0x0021 is only a neighbor of the silent router
+        self.assertEqual(topology.node_by_nwk(0x0021), None)
+        self.assertEqual(len(topology), 7)
+        self.assertEqual(self.pages[(0x0002, 0)], 2)
+        self.assertEqual([failure[0:3] for failure in crawler.failures],
+                         [(ZpiCommand.ZDO_MGMT_LQI_REQ, 0x0002, 0)])
+        self.assertIsInstance(crawler.failures[0][3], AreqTimeoutException)
+        
+    def test_invalid_concurrency(self):
+        self.assertRaises(ValueError, self.zpi.topology_crawler,
+                          concurrency = 0)
+
+if __name__ == '__main__':
+    unittest.main()
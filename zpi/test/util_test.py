@@ -0,0 +1,29 @@
+"""
+    UTIL interface tests, run against the ZNP simulator
+
+    run: python -m unittest zpi.test.util_test
+"""
+import unittest
+
+from zpi.zpi2 import Zpi
+from zpi.simulator import ZnpSimulator
+
+class UtilTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = ZnpSimulator(devices = {0x1234: 0x00124B0001020304})
+        self.zpi = Zpi(self.sim, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.sim.close()
+        
+    def test_addrmgr_nwk_addr_lookup(self):
+        self.assertEqual(self.zpi.util_addrmgr_nwk_addr_lookup(0x1234), 
+                         0x00124B0001020304)
+        
+    def test_addrmgr_ext_addr_lookup(self):
+        self.assertEqual(
+            self.zpi.util_addrmgr_ext_addr_lookup(0x00124B0001020304), 0x1234)
+
+if __name__ == '__main__':
+    unittest.main()
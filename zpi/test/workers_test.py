@@ -0,0 +1,171 @@
+"""
+    callback worker pool tests
+
+    run: python -m unittest zpi.test.workers_test
+"""
+import struct
+import threading
+import time
+import unittest
+
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.workers import CallbackPool
+from zpi.test.fakeport import FakePort, build
+
+class CallbackPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pools = []
+        self.gate = threading.Event()   #set to let the blocking callbacks go
+        
+    def tearDown(self):
+        self.gate.set()
+        for pool in self.pools:
+            pool.close(1.0)
+        
+    def pool(self, *args, **kwargs):
+        pool = CallbackPool(*args, **kwargs)
+        self.pools.append(pool)
+        return pool
+        
+    def blocked(self, pool, key = 0):
+        """ submit a callback keeping the worker of key busy until the gate """
+        started = threading.Event()
+        def wait():
+            started.set()
+            self.gate.wait(5.0)
+        pool.submit(key, wait)
+        self.assertTrue(started.wait(1.0))
+        
+    def test_key_order(self):
+        pool = self.pool(4)
+        done = []
+        for index in range(200):
+            pool.submit(index % 5, done.append, index)
+        pool.close(5.0)
+        for key in range(5):
+            self.assertEqual([index for index in done if index % 5 == key], 
+                             range(key, 200, 5))
+        self.assertEqual((pool.submitted, pool.executed), (200, 200))
+        
+    def test_keys_concurrent(self):
+        pool = self.pool(2)
+        self.blocked(pool, 0)
+        done = threading.Event()
+        pool.submit(1, done.set)
+        self.assertTrue(done.wait(1.0))
+        
+    def test_default_drop_newest(self):
+        pool = self.pool(1, queue_size = 2)
+        self.assertEqual(pool.policy, CallbackPool.DROP_NEWEST)
+        done = []
+        self.blocked(pool)
+        start = time.time()
+        self.assertEqual([pool.submit(0, done.append, index) 
+                          for index in range(4)], [True, True, False, False])
+        #never blocks the submitting (reader) thread
+        self.assertTrue(time.time() - start < 0.05)
+        self.gate.set()
+        pool.close(1.0)
+        self.assertEqual(done, [0, 1])
+        self.assertEqual(pool.dropped, 2)
+        self.assertEqual(pool.high_water, 2)
+        
+    def test_drop_oldest(self):
+        pool = self.pool(1, queue_size = 2, policy = CallbackPool.DROP_OLDEST)
+        done = []
+        self.blocked(pool)
+        for index in range(4):
+            self.assertTrue(pool.submit(0, done.append, index))
+        self.gate.set()
+        pool.close(1.0)
+        self.assertEqual(done, [2, 3])
+        self.assertEqual(pool.dropped, 2)
+        
+    def test_block_timeout(self):
+        pool = self.pool(1, queue_size = 1, policy = CallbackPool.BLOCK, 
+                         block_timeout = 0.05)
+        self.blocked(pool)
+        self.assertTrue(pool.submit(0, lambda: None))
+        start = time.time()
+        self.assertFalse(pool.submit(0, lambda: None))
+        self.assertTrue(time.time() - start >= 0.05)
+        self.assertEqual(pool.dropped, 1)
+        
+    def test_block_waits_room(self):
+        pool = self.pool(1, queue_size = 1, policy = CallbackPool.BLOCK, 
+                         block_timeout = 2.0)
+        self.blocked(pool)
+        pool.submit(0, lambda: None)
+        threading.Timer(0.05, self.gate.set).start()
+        self.assertTrue(pool.submit(0, lambda: None))
+        self.assertEqual(pool.dropped, 0)
+        
+    def test_errors(self):
+        pool = self.pool(1)
+        pool.submit(0, lambda: 1 / 0)
+        pool.submit(0, lambda: None)
+        pool.close(1.0)
+        self.assertEqual(pool.stats(), {
+            'submitted': 2, 'executed': 2, 'dropped': 0, 'errors': 1, 
+            'high_water': pool.high_water, 'pending': 0})
+        
+    def test_closed(self):
+        pool = self.pool(1)
+        pool.close(1.0)
+        self.assertRaises(RuntimeError, pool.submit, 0, lambda: None)
+        
+    def test_invalid(self):
+        self.assertRaises(ValueError, CallbackPool, 0)
+        self.assertRaises(ValueError, CallbackPool, 1, 0)
+        self.assertRaises(ValueError, CallbackPool, 1, 1, 'wait')
+
+class ZpiCallbackPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.received = []      #(src_addr, thread name)
+        self.gate = threading.Event()
+        self.pool = CallbackPool(4)
+        self.port = FakePort()
+        self.zpi = Zpi(self.port, self.callback, callback_pool = self.pool)
+        
+    def tearDown(self):
+        self.gate.set()
+        self.zpi.halt(1.0)
+        self.pool.close(1.0)
+        self.port.close()
+        
+    def callback(self, zpi, rx_data):
+        if rx_data['id'] == ZpiCommand.ZDO_LEAVE_IND:
+            self.gate.wait(5.0)
+            return
+        self.received.append((struct.unpack('<H', rx_data['src_addr'])[0], 
+                              threading.current_thread().name))
+        
+    def test_callbacks_out_of_reader(self):
+        self.port.feed(*[build(ZpiCommand.AF_INCOMING_MSG, 
+                               src_addr = index % 10) for index in range(100)])
+        self.zpi.sys_version()
+        self.pool.close(5.0)
+        self.assertEqual(len(self.received), 100)
+        self.assertTrue(all(name.startswith('ZpiCallback-') 
+                            for src_addr, name in self.received))
+        #one source address, one worker
+        for src_addr in range(10):
+            self.assertEqual(len(set(name for addr, name in self.received 
+                                     if addr == src_addr)), 1)
+        
+    def test_blocked_callback(self):
+        #the reader goes on with the SRSPs and the other workers
+        for src_addr in range(8):
+            self.port.feed(build(ZpiCommand.ZDO_LEAVE_IND, 
+                                 src_addr = src_addr))
+        self.assertEqual(self.zpi.sys_version(), (0, 0, 0, 0, 0))
+        self.assertEqual(self.pool.submitted, 8)
+        
+        waiter = self.zpi.expect_areq(ZpiCommand.ZDO_LEAVE_IND, 'src_addr', 
+                                      b'\x00\x00')
+        self.port.feed(build(ZpiCommand.ZDO_LEAVE_IND, src_addr = 0))
+        self.assertEqual(waiter.result(1.0)['src_addr'], b'\x00\x00')
+
+if __name__ == '__main__':
+    unittest.main()
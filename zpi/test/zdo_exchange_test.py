@@ -0,0 +1,118 @@
+"""
+    ZDO request/response exchange tests
+
+    run: python -m unittest zpi.test.zdo_exchange_test
+"""
+import struct
+import unittest
+
+from zpi.zpi2 import (Zpi, ZpiStatus, SrspTimeoutException,
+                      AreqTimeoutException, ZpiStatusException)
+from zpi.command import ZpiCommand
+from zpi.future import ZpiFuture
+from zpi.test.fakeport import FakePort, build, srsp
+
+ZDO_IEEE_ADDR_REQ = b'\x25\x01'
+IEEE_ADDR_BASE = 0x00124b0000000000
+
+class ZdoExchangeTest(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        #{nwk_addr: SRSP status, None not to answer the request}
+        self.status = {}
+        self.answer_first = False   #AREQ response before the SRSP
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port,
+                       lambda zpi, rx_data: self.received.append(rx_data))
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def respond(self, data):
+        """ answer ZDO_IEEE_ADDR_REQ as the device nwk_addr would """
+        if data[0:2] != ZDO_IEEE_ADDR_REQ:
+            return [srsp(data)]
+        nwk_addr = struct.unpack('<H', data[2:4])[0]
+        status = self.status.get(nwk_addr, ZpiStatus.Z_SUCCESS)
+        if status is None:
+            return []
+        frames = [build(ZpiCommand.ZDO_IEEE_ADDR_REQ_SRSP, status = status)]
+        if status == ZpiStatus.Z_SUCCESS and nwk_addr < 0x8000:
+            frames.append(build(ZpiCommand.ZDO_IEEE_ADDR_RSP,
+                                ieee_addr = IEEE_ADDR_BASE | nwk_addr,
+                                nwk_addr = nwk_addr))
+        if self.answer_first:
+            frames.reverse()
+        return frames
+        
+    def test_exchange(self):
+        (status, ieee_addr, nwk_addr, start_index, assoc_dev_num,
+         assoc_dev) = self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                                            0x4444)
+        self.assertEqual((status, ieee_addr, nwk_addr),
+                         (0, IEEE_ADDR_BASE | 0x4444, 0x4444))
+        self.assertEqual(assoc_dev, [])
+        #the response still reaches the async callback
+        self.assertEqual([rx_data['id'] for rx_data in self.received],
+                         [ZpiCommand.ZDO_IEEE_ADDR_RSP])
+        
+    def test_response_before_srsp(self):
+        self.answer_first = True
+        self.assertEqual(self.zpi.zdo_exchange(
+            ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x4444)[2], 0x4444)
+        
+    def test_refused(self):
+        self.status[0x4444] = ZpiStatus.Z_FAILURE
+        try:
+            self.zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x4444)
+        except ZpiStatusException as e:
+            self.assertEqual(e.status, ZpiStatus.Z_FAILURE)
+        else:
+            self.fail('refused request')
+        self.assertFalse(self.zpi._areq_waiters.count())
+        
+    def test_timeout(self):
+        #0x8000 and above answer the SRSP only
+        self.assertRaises(AreqTimeoutException, self.zpi.zdo_exchange,
+                          ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x8001,
+                          areq_timeout = 0.05)
+        
+    def test_exchange_many(self):
+        self.status[0x102] = ZpiStatus.Z_FAILURE
+        nwk_addrs = [0x101, 0x102, 0x8003, 0x104]
+        results = self.zpi.zdo_exchange_many(
+            [(ZpiCommand.ZDO_IEEE_ADDR_REQ, (nwk_addr, ))
+             for nwk_addr in nwk_addrs], areq_timeout = 0.1)
+        self.assertEqual((results[0][2], results[3][2]), (0x101, 0x104))
+        self.assertIsInstance(results[1], ZpiStatusException)
+        self.assertIsInstance(results[2], AreqTimeoutException)
+        #all the requests went out before the first response was waited for
+        self.assertEqual(len(self.port.requests), 4)
+        
+    def test_pipelined(self):
+        pipe = self.zpi.pipeline(window = 4)
+        futures = [pipe.zdo_exchange_async(ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                                           nwk_addr)
+                   for nwk_addr in range(0x200, 0x210)]
+        self.assertTrue(all(isinstance(future, ZpiFuture)
+                            for future in futures))
+        self.assertEqual([future.result(1.0)[2] for future in futures],
+                         range(0x200, 0x210))
+        
+    def test_pipelined_refused(self):
+        self.status[0x4444] = ZpiStatus.Z_FAILURE
+        future = self.zpi.pipeline().zdo_exchange_async(
+            ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x4444)
+        self.assertRaises(ZpiStatusException, future.result, 1.0)
+        
+    def test_pipelined_srsp_timeout(self):
+        self.status[0x4444] = None
+        pipe = self.zpi.pipeline(srsp_timeout = 0.05)
+        future = pipe.zdo_exchange_async(ZpiCommand.ZDO_IEEE_ADDR_REQ, 0x4444)
+        pipe.drain()
+        self.assertRaises(SrspTimeoutException, future.result, 1.0)
+        self.assertFalse(self.zpi._areq_waiters.count())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+    paged ZDO table iterator tests
+
+    run: python -m unittest zpi.test.zdo_test
+"""
+import struct
+import unittest
+
+from zpi.zpi2 import (Zpi, ZpiStatus, AreqTimeoutException,
+                      ZpiStatusException)
+from zpi.command import ZpiCommand
+from zpi.test.fakeport import FakePort, build, srsp
+
+ZDO_IEEE_ADDR_REQ = b'\x25\x01'
+ZDO_MGMT_LQI_REQ = b'\x25\x31'
+ZDO_MGMT_RTG_REQ = b'\x25\x32'
+
+#neighbor table record: ext_pan_id, ieee_addr, nwk_addr, device_type |
+#rx_on_when_idle | relationship, permit_joining, depth, lqi
+NBR_RECORD = struct.Struct('<QQHBBBB')
+
+#routing table record: dst_addr, status, next_hop
+RTG_RECORD = struct.Struct('<HBH')
+
+class ZdoTablesTest(unittest.TestCase):
+    def setUp(self):
+        self.entries = 5        #records of the served tables
+        self.page_size = 2
+        self.answered = None    #start indexes answered, None for all
+        self.status = ZpiStatus.Z_SUCCESS
+        self.port = FakePort(self.respond)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def respond(self, data):
+        """
+            serve tables of self.entries records: neighbor nwk_addr and
+            associated devices 1, 2..., routes to 0x0101, 0x0102...
+        """
+        if data[0:2] == ZDO_IEEE_ADDR_REQ:
+            nwk_addr, req_type, start_index = struct.unpack('<HBB', data[2:6])
+        elif data[0:2] in (ZDO_MGMT_LQI_REQ, ZDO_MGMT_RTG_REQ):
+            nwk_addr, start_index = struct.unpack('<HB', data[2:5])
+        else:
+            return [srsp(data)]
+        if self.answered is not None and start_index not in self.answered:
+            return [srsp(data)]
+        
+        indexes = range(start_index + 1,
+                        min(start_index + self.page_size, self.entries) + 1)
+        if data[0:2] == ZDO_IEEE_ADDR_REQ:
+            rsp = build(ZpiCommand.ZDO_IEEE_ADDR_RSP, status = self.status,
+                        nwk_addr = nwk_addr, start_index = start_index,
+                        assoc_dev_num = self.entries,
+                        assoc_dev_list = struct.pack('<%dH' % len(indexes),
+                                                     *indexes))
+        elif data[0:2] == ZDO_MGMT_LQI_REQ:
+            rsp = build(ZpiCommand.ZDO_MGMT_LQI_RSP, src_addr = nwk_addr,
+                        status = self.status,
+                        nbr_table_entries = self.entries,
+                        start_index = start_index,
+                        nbr_table_list_cnt = len(indexes),
+                        nbr_table_list_records = b''.join(
+                            NBR_RECORD.pack(1, index, index, 0x25, 0, 1, 200)
+                            for index in indexes))
+        else:
+            rsp = build(ZpiCommand.ZDO_MGMT_RTG_RSP, src_addr = nwk_addr,
+                        status = self.status,
+                        rtg_table_entries = self.entries,
+                        start_index = start_index,
+                        rtg_table_list_cnt = len(indexes),
+                        rtg_table_list_records = b''.join(
+                            RTG_RECORD.pack(0x0100 + index, 0, 0x0001)
+                            for index in indexes))
+        return [srsp(data), rsp]
+        
+    def start_indexes(self):
+        """ start indexes of the pages requested so far """
+        return [ord(data[4]) for data in self.port.requests]
+        
+    def test_lqi_pages(self):
+        self.assertEqual([nbr['nwk_addr'] for nbr in
+                          self.zpi.zdo_mgmt_lqi_iter(0x0000)], [1, 2, 3, 4, 5])
+        self.assertEqual(self.start_indexes(), [0, 2, 4])
+        
+    def test_start_index(self):
+        self.assertEqual([nbr['nwk_addr'] for nbr in
+                          self.zpi.zdo_mgmt_lqi_iter(0x0000, start_index = 3)],
+                         [4, 5])
+        
+    def test_next_page_prefetched(self):
+        records = self.zpi.zdo_mgmt_lqi_iter(0x0000)
+        self.assertEqual(next(records)['nwk_addr'], 1)
+        #the second page is asked before the first one is consumed
+        self.assertEqual(self.start_indexes(), [0, 2])
+        self.assertEqual(next(records)['nwk_addr'], 2)
+        self.assertEqual(self.start_indexes(), [0, 2])
+        
+    def test_close_cancels_next_page(self):
+        self.answered = (0, )
+        records = self.zpi.zdo_mgmt_lqi_iter(0x0000)
+        next(records)
+        records.close()
+        waiters = [future for queue in
+                   self.zpi._areq_waiters._queues.values() for future in queue]
+        self.assertEqual(len(waiters), 1)
+        self.assertTrue(waiters[0].cancelled())
+        
+    def test_page_timeout(self):
+        self.answered = (0, )
+        records = self.zpi.zdo_mgmt_lqi_iter(0x0000, areq_timeout = 0.1)
+        self.assertEqual([next(records)['nwk_addr'],
+                          next(records)['nwk_addr']], [1, 2])
+        self.assertRaises(AreqTimeoutException, next, records)
+        
+    def test_page_status(self):
+        self.status = ZpiStatus.Z_FAILURE
+        self.assertRaises(ZpiStatusException, list,
+                          self.zpi.zdo_mgmt_lqi_iter(0x0000))
+        
+    def test_empty_table(self):
+        self.entries = 0
+        self.assertEqual(list(self.zpi.zdo_mgmt_lqi_iter(0x0000)), [])
+        self.assertEqual(self.start_indexes(), [0])
+        
+    def test_rtg_pages(self):
+        self.entries, self.page_size = 7, 3
+        self.assertEqual([rtg['dst_addr'] for rtg in
+                          self.zpi.zdo_mgmt_rtg_iter(0x0000)],
+                         range(0x0101, 0x0108))
+        
+    def test_assoc_devs(self):
+        self.assertEqual(list(self.zpi.zdo_assoc_dev_iter(0x0000)),
+                         [1, 2, 3, 4, 5])
+        #extended requests
+        self.assertEqual([ord(data[4]) for data in self.port.requests],
+                         [1, 1, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+"""
+    frame reader and writer tests
+
+    run: python -m unittest zpi.test.znp_test
+"""
+import logging
+import struct
+import threading
+import time
+import unittest
+
+import zpi
+from zpi.znp import wire_log
+from zpi.zpi2 import Zpi
+from zpi.command import ZpiCommand
+from zpi.test.fakeport import FakePort, build, srsp
+
+SYS_VERSION_SRSP = b'\x61\x02\x02\x00\x02\x06\x03'
+
+def version(data):
+    """ answer SYS_VERSION """
+    return [SYS_VERSION_SRSP] if data == b'\x21\x02' else []
+
+class UnselectablePort(FakePort):
+    """ a port without file descriptor, e.g. a win32 port """
+    def fileno(self):
+        raise NotImplementedError('no file descriptor')
+
+class GatedPort(FakePort):
+    """ a port whose writes wait for the gate, logging their sizes """
+    def __init__(self, respond = None):
+        FakePort.__init__(self, respond)
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+        self.writes = []
+        self.error = None
+        
+    def write(self, data):
+        self.writing.set()
+        self.gate.wait(5.0)
+        if self.error is not None:
+            raise self.error
+        self.writes.append(len(data))
+        return FakePort.write(self, data)
+
+def nwk_addr_lookup(data):
+    """ answer UTIL_ADDRMGR_NWK_ADDR_LOOKUP with the nwk_addr as ext_addr """
+    if data[0:2] == b'\x27\x41':
+        return [build(ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP_SRSP, 
+                      ext_addr = struct.unpack('<H', data[2:4])[0])]
+    return [srsp(data)]
+
+class ReaderTest(unittest.TestCase):
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def test_select_reader(self):
+        self.port = FakePort(version)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        self.assertEqual(self.zpi._rx_fd, self.port.fileno())
+        self.assertEqual(self.zpi.sys_version(), (2, 0, 2, 6, 3))
+        
+    def test_polling_reader(self):
+        self.port = UnselectablePort(version)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        self.assertTrue(self.zpi._rx_fd is None)
+        self.assertEqual(self.zpi.sys_version(), (2, 0, 2, 6, 3))
+        
+    def test_halt(self):
+        #the reader waits in select() without data
+        self.port = FakePort()
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        time.sleep(0.05)
+        start = time.time()
+        self.zpi.halt(1.0)
+        self.assertFalse(self.zpi.is_alive())
+        self.assertTrue(time.time() - start < 3 * Zpi.RX_WAIT_TIMEOUT)
+        
+    def test_areqs(self):
+        received = []
+        self.port = FakePort()
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: 
+                       received.append(rx_data['reason']))
+        #SYS_RESET_IND frames written at once
+        self.port.feed(*[b'\x41\x80' + chr(reason) + b'\x00' * 5 
+                         for reason in range(3)])
+        deadline = time.time() + 1.0
+        while len(received) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(received, [b'\x00', b'\x01', b'\x02'])
+        self.assertEqual(self.port.requests, [])
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.port = GatedPort(nwk_addr_lookup)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.port.gate.set()
+        self.zpi.halt(1.0)
+        self.port.close()
+        
+    def version_nowait(self):
+        return self.zpi.send_nowait(ZpiCommand.SYS_VERSION)
+        
+    def test_coalescing(self):
+        #the writer is held in the first write while the others queue up
+        first = self.version_nowait()
+        self.assertTrue(self.port.writing.wait(1.0))
+        handles = [self.version_nowait() for index in range(20)]
+        self.port.gate.set()
+        for handle in [first] + handles:
+            self.assertEqual(handle.result(1.0), 5)
+        self.assertEqual(self.port.writes, [5, 100])
+        self.assertEqual((self.zpi.tx_frames, self.zpi.tx_writes), (21, 2))
+        self.assertEqual(len(self.port.requests), 21)
+        
+    def test_coalesce_max(self):
+        self.zpi.TX_COALESCE_MAX = 12
+        self.version_nowait()
+        self.assertTrue(self.port.writing.wait(1.0))
+        handles = [self.version_nowait() for index in range(5)]
+        self.port.gate.set()
+        for handle in handles:
+            handle.result(1.0)
+        self.assertEqual(self.port.writes, [5, 10, 10, 5])
+        
+    def test_send_order(self):
+        self.port.gate.set()
+        nwk_addrs = range(0x100, 0x140)
+        pipe = self.zpi.pipeline(window = 64)
+        futures = [pipe.util_addrmgr_nwk_addr_lookup(nwk_addr) 
+                   for nwk_addr in nwk_addrs]
+        self.assertEqual([future.result(1.0) for future in futures], 
+                         nwk_addrs)
+        
+    def test_sreq_while_writing(self):
+        #a SREQ is queued while the writer waits for the port
+        self.version_nowait()
+        self.assertTrue(self.port.writing.wait(1.0))
+        start = time.time()
+        future = self.zpi._sreq_future(ZpiCommand.SYS_VERSION, 
+                                       self.zpi._sys_version_srsp_handler)
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertFalse(future.done())
+        self.port.gate.set()
+        self.assertEqual(len(future.result(1.0)), 5)
+        
+    def test_write_error(self):
+        self.port.error = IOError('port closed')
+        self.port.gate.set()
+        handle = self.version_nowait()
+        self.assertRaises(IOError, handle.result, 1.0)
+        self.assertRaises(IOError, self.zpi.send, ZpiCommand.SYS_VERSION)
+        #a failed SREQ write fails its future
+        self.assertRaises(IOError, self.zpi.sys_version)
+        #the writer goes on
+        self.port.error = None
+        self.assertEqual(self.version_nowait().result(1.0), 5)
+        
+    def test_halt_flushes(self):
+        self.version_nowait()
+        self.assertTrue(self.port.writing.wait(1.0))
+        handles = [self.version_nowait() for index in range(10)]
+        threading.Timer(0.05, self.port.gate.set).start()
+        self.zpi.halt(1.0)
+        self.assertTrue(all(handle.done() for handle in handles))
+        self.assertEqual(self.zpi.tx_frames, 11)
+        
+    def test_no_writer_thread(self):
+        self.port.gate.set()
+        self.zpi.halt(1.0)
+        #written inline once the writer is gone
+        handle = self.version_nowait()
+        self.assertTrue(handle.done())
+        self.assertEqual(self.zpi.tx_writes, 0)
+        self.assertEqual(self.port.writes, [5])
+
+class RecordingHandler(logging.Handler):
+    """ keep the messages of the records handled """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class WireTraceTest(unittest.TestCase):
+    def setUp(self):
+        self.handlers = list(wire_log.handlers)
+        self.level = wire_log.level
+        self.trace = RecordingHandler()
+        self.port = FakePort(version)
+        self.zpi = Zpi(self.port, lambda zpi, rx_data: None)
+        
+    def tearDown(self):
+        self.zpi.halt(1.0)
+        self.port.close()
+        for handler in list(wire_log.handlers):
+            wire_log.removeHandler(handler)
+        for handler in self.handlers:
+            wire_log.addHandler(handler)
+        wire_log.setLevel(self.level)
+        
+    def test_trace(self):
+        zpi.set_wire_trace(True, self.trace)
+        self.zpi.sys_version()
+        self.assertEqual(wire_log.handlers, [self.trace])
+        self.assertEqual(self.trace.messages[0:2], 
+                         ['TX: fe00210223', 'RX: fe056102020002060363'])
+        #and the split fields of the response
+        fields = [message.split()[2:] for message in self.trace.messages 
+                  if message.startswith('RX SYS_VERSION_SRSP:')]
+        self.assertEqual(len(fields), 1)
+        for field in ('major_rel=02', 'minor_rel=06', 'maint_rel=03'):
+            self.assertIn(field, fields[0])
+        
+    def test_trace_off(self):
+        zpi.set_wire_trace(True, self.trace)
+        zpi.set_wire_trace(False)
+        self.zpi.sys_version()
+        self.assertEqual(self.trace.messages, [])
+        self.assertFalse(wire_log.isEnabledFor(logging.DEBUG))
+
+if __name__ == '__main__':
+    unittest.main()
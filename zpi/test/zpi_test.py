@@ -587,50 +587,6 @@ def zpi_device_discovery_test(zpi, timeout = 10.0):
         device['addr_long'] = zpi.zdo_ieee_addr_req(addr_short)
         
         
-        #request descriptors: Node Descriptor, Power Descriptor, Active Endpoints
-        log.info('Send ZDO_NODE_DESC_REQ to nwk_addr=0x%.4X', addr_short)
-        zpi_areq_event_clear(ZpiCommand.ZDO_NODE_DESC_RSP)
-        status = zpi.zdo_node_desc_req(dst_addr = addr_short, 
-                                       nwk_addr_of_interest = addr_short) 
-        if status!=ZpiStatus.Z_SUCCESS:
-            log.warning('Failed.')
-        else:
-            log.info('wait ZDO_NODE_DESC_RSP...')
-            if zpi_areq_event_wait(ZpiCommand.ZDO_NODE_DESC_RSP):
-                rsp_result = zpi.zdo_node_desc_rsp_handler(zpi_areq_data_get(ZpiCommand.ZDO_NODE_DESC_RSP))
-                device['node_desc'] = rsp_result
-            else:
-                log.warning('Response timeout.')   
-            
-        log.info('Send ZDO_POWER_DESC_REQ to nwk_addr=0x%.4X', addr_short)  
-        zpi_areq_event_clear(ZpiCommand.ZDO_POWER_DESC_RSP)
-        status = zpi.zdo_power_desc_req(dst_addr = addr_short, 
-                                        nwk_addr_of_interest = addr_short)
-        if status!=ZpiStatus.Z_SUCCESS:
-            log.warning('Failed')
-        else:
-            log.info('wait ZDO_POWER_DESC_RSP...')
-            if zpi_areq_event_wait(ZpiCommand.ZDO_POWER_DESC_RSP):
-                rsp_result = zpi.zdo_power_desc_rsp_handler(zpi_areq_data_get(ZpiCommand.ZDO_POWER_DESC_RSP))
-                device['power_desc'] = rsp_result
-            else:
-                log.warning('Response timeout.')  
-                
-            
-        log.info('Send ZDO_ACTIVE_EP_REQ to nwk_addr=0x%.4X', addr_short)  
-        zpi_areq_event_clear(ZpiCommand.ZDO_ACTIVE_EP_RSP)
-        status = zpi.zdo_active_ep_req(dst_addr = addr_short, 
-                                       nwk_addr_of_interest = addr_short) 
-        if status!=ZpiStatus.Z_SUCCESS:
-            log.warning('Failed')
-        else:
-            log.info('wait ZDO_ACTIVE_EP_RSP...')
-            if zpi_areq_event_wait(ZpiCommand.ZDO_ACTIVE_EP_RSP):
-                (src_addr, status, nwk_addr, active_eps) = zpi.zdo_active_ep_rsp_handler(zpi_areq_data_get(ZpiCommand.ZDO_ACTIVE_EP_RSP))
-                device['active_ep'] = active_eps
-            else:
-                log.warning('Response timeout.') 
-                
         log.info('Device#%d: ShortAddr=0x%.4X, Relation=%s, State=%s' % (
             assoc_index,                                                          
             device['addr_short'], 
@@ -640,6 +596,27 @@ def zpi_device_discovery_test(zpi, timeout = 10.0):
         #append current device to local associated list
         local_assoc.append(device)
         
+    #request descriptors of all devices at once: Node Descriptor, Power 
+    #Descriptor, Active Endpoints
+    log.info('Request descriptors of %d devices...', len(local_assoc))
+    desc_requests = (('node_desc', ZpiCommand.ZDO_NODE_DESC_REQ),
+                     ('power_desc', ZpiCommand.ZDO_POWER_DESC_REQ),
+                     ('active_ep', ZpiCommand.ZDO_ACTIVE_EP_REQ))
+    requests = [(zdo_cmd, (device['addr_short'], device['addr_short']))
+                for device in local_assoc for name, zdo_cmd in desc_requests]
+    results = iter(zpi.zdo_exchange_many(requests))
+    for device in local_assoc:
+        for name, zdo_cmd in desc_requests:
+            rsp_result = next(results)
+            if isinstance(rsp_result, Exception):
+                log.warning('%s of nwk_addr=0x%.4X failed: %s', zdo_cmd, 
+                            device['addr_short'], rsp_result)
+            elif name == 'active_ep':
+                (src_addr, status, nwk_addr, active_eps) = rsp_result
+                device['active_ep'] = active_eps
+            else:
+                device[name] = rsp_result
+        
     #request remote associated
     log.info('Request associated list of remote device...')
     remote_assoc = []
@@ -0,0 +1,304 @@
+"""
+    network topology crawler module
+
+    TopologyCrawler walks the network breadth first, as described in TI
+    SWRA203 "Method for Discovering Network Topology": the neighbor table
+    (ZDO_MGMT_LQI_REQ) of every router is read page by page, and each router
+    found in it is queued in turn. Optionally the routing tables
+    (ZDO_MGMT_RTG_REQ) are read too. Up to `concurrency` requests are in
+    flight at once and nodes are identified by their IEEE address, so a node
+    seen by many neighbors, or under a new network address, is walked once.
+"""
+import collections
+import threading
+import time
+import Queue
+
+from zpi.command import ZpiCommand
+from zpi.zpi2 import ZpiStatus
+from zpi.tables import decode_nbr_table, decode_rtg_table
+
+__all__ = ['TopologyCrawler', 'Topology', 'TopologyNode']
+
+import logging
+log = logging.getLogger('zpi.topology')
+
+DEVICE_TYPE_COORDINATOR = 0x00
+DEVICE_TYPE_ROUTER = 0x01
+DEVICE_TYPE_ENDDEVICE = 0x02
+DEVICE_TYPE_UNKNOWN = 0x03
+
+RELATION_PARENT = 0x00
+RELATION_CHILD = 0x01
+RELATION_SIBLING = 0x02
+RELATION_NONE = 0x03
+RELATION_PREVIOUS_CHILD = 0x04
+
+
+class TopologyNode(object):
+    """ a node of the topology graph, identified by its IEEE address """
+    def __init__(self, ieee_addr, nwk_addr, device_type = DEVICE_TYPE_UNKNOWN):
+        self.ieee_addr = ieee_addr
+        self.nwk_addr = nwk_addr
+        self.device_type = device_type
+        self.depth = None
+        self.rx_on_when_idle = None
+        self.permit_joining = None
+        self.ext_pan_id = None
+        self.visited = False    #its neighbor table has been read
+        self.last_seen = time.time()
+
+    def is_router(self):
+        """ True for the nodes owning a neighbor table """
+        return self.device_type in (DEVICE_TYPE_COORDINATOR,
+                                    DEVICE_TYPE_ROUTER)
+
+    def __repr__(self):
+        return 'TopologyNode(0x%.16X, 0x%.4X, %d)' % (
+            self.ieee_addr, self.nwk_addr, self.device_type)
+
+
+class Topology(object):
+    """
+        in-memory topology graph, built incrementally by TopologyCrawler
+
+        nodes: {ieee_addr: TopologyNode}
+        links: {(ieee_addr, neighbor ieee_addr): {'lqi', 'relationship'}}
+        routes: {(ieee_addr, dst_addr): {'status', 'next_hop'}}
+
+        It may be read from other threads while a crawl is running, through
+        the methods which take the lock.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.nodes = {}
+        self.links = {}
+        self.routes = {}
+        self._nwk_index = {}    #nwk_addr: ieee_addr
+
+    def add_node(self, ieee_addr, nwk_addr, device_type = DEVICE_TYPE_UNKNOWN,
+                 **attributes):
+        """
+            add or update a node, return (node, True if the node is new)
+        """
+        with self._lock:
+            node = self.nodes.get(ieee_addr)
+            is_new = node is None
+            if is_new:
+                node = self.nodes[ieee_addr] = TopologyNode(ieee_addr, nwk_addr,
+                                                            device_type)
+            else:
+                if node.nwk_addr != nwk_addr:
+                    #the node rejoined under a new network address
+                    if self._nwk_index.get(node.nwk_addr) == ieee_addr:
+                        del self._nwk_index[node.nwk_addr]
+                    node.nwk_addr = nwk_addr
+                if device_type != DEVICE_TYPE_UNKNOWN:
+                    node.device_type = device_type
+                node.last_seen = time.time()
+
+            for name, value in attributes.iteritems():
+                setattr(node, name, value)
+            self._nwk_index[nwk_addr] = ieee_addr
+            return node, is_new
+
+    def add_link(self, ieee_addr, neighbor_ieee_addr, lqi, relationship):
+        """ add or update the link from a node to its neighbor """
+        with self._lock:
+            self.links[(ieee_addr, neighbor_ieee_addr)] = {
+                'lqi': lqi, 'relationship': relationship}
+
+    def add_route(self, ieee_addr, dst_addr, status, next_hop):
+        """ add or update a routing table entry of a node """
+        with self._lock:
+            self.routes[(ieee_addr, dst_addr)] = {
+                'status': status, 'next_hop': next_hop}
+
+    def node_by_nwk(self, nwk_addr):
+        """ get the node using nwk_addr, None if unknown """
+        with self._lock:
+            ieee_addr = self._nwk_index.get(nwk_addr)
+            return self.nodes.get(ieee_addr) if ieee_addr is not None else None
+
+    def neighbors(self, ieee_addr):
+        """ get [(neighbor ieee_addr, link)] of a node """
+        with self._lock:
+            return [(dst, link) for (src, dst), link in self.links.iteritems()
+                    if src == ieee_addr]
+
+    def snapshot(self):
+        """ get consistent copies of (nodes, links, routes) """
+        with self._lock:
+            return dict(self.nodes), dict(self.links), dict(self.routes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class TopologyCrawler(object):
+    """
+        concurrent breadth first walk of the neighbor (and routing) tables
+
+        usage:
+            crawler = zpi.topology_crawler(concurrency = 16)
+            topology = crawler.crawl()
+
+        on_node(node) is called for every node found and on_link(ieee_addr,
+        neighbor ieee_addr, link) for every link read, from the thread
+        running crawl(), while the walk goes on. A page without answer after
+        areq_timeout seconds is retried up to `retries` times, then the node
+        is left partially walked.
+    """
+    def __init__(self, zpi, concurrency = 8, areq_timeout = 3.000,
+                 retries = 1, routes = False, on_node = None, on_link = None):
+        if concurrency < 1:
+            raise ValueError('Invalid crawler concurrency: %s' %
+                             repr(concurrency))
+
+        self._zpi = zpi
+        self.concurrency = concurrency
+        self.areq_timeout = areq_timeout
+        self.retries = retries
+        self.routes = routes
+        self.on_node = on_node
+        self.on_link = on_link
+        self.topology = Topology()
+        self.failures = []  #(zdo_cmd, nwk_addr, start_index, exception)
+
+    def _get_root_ieee_addr(self, nwk_addr):
+        """ get the IEEE address of the walk root """
+        (status, ieee_addr, nwk_addr, start_index, assoc_dev_num,
+         assoc_dev) = self._zpi.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                                             nwk_addr,
+                                             areq_timeout = self.areq_timeout)
+        return ieee_addr
+
+    def crawl(self, root_nwk_addr = 0x0000, root_ieee_addr = None):
+        """
+            walk the network from root_nwk_addr (the coordinator by default)
+            and return the topology, self.topology is updated as responses
+            arrive
+        """
+        if root_ieee_addr is None:
+            root_ieee_addr = self._get_root_ieee_addr(root_nwk_addr)
+        root, is_new = self.topology.add_node(root_ieee_addr, root_nwk_addr)
+        if is_new and self.on_node is not None:
+            self.on_node(root)
+
+        #pages to request: (zdo_cmd, ieee_addr, nwk_addr, start_index, tries)
+        pages = collections.deque()
+        self._visit(pages, root)
+
+        done = Queue.Queue()
+        in_flight = {}  #future: page
+        while pages or in_flight:
+            while pages and len(in_flight) < self.concurrency:
+                page = pages.popleft()
+                zdo_cmd, ieee_addr, nwk_addr, start_index, tries = page
+                try:
+                    future = self._zpi.zdo_exchange_async(
+                        zdo_cmd, nwk_addr, start_index,
+                        areq_timeout = self.areq_timeout)
+                except Exception as e:
+                    self._failed(pages, page, e)
+                    continue
+                in_flight[future] = page
+                future.add_done_callback(done.put)
+
+            if not in_flight:
+                continue
+
+            timeout = max(0, min(future.deadline for future in in_flight) -
+                          time.time())
+            try:
+                future = done.get(True, timeout)
+            except Queue.Empty:
+                #cancel the expired requests, they come back through done
+                now = time.time()
+                for future in in_flight.keys():
+                    if future.deadline <= now:
+                        future.cancel()
+                continue
+
+            page = in_flight.pop(future, None)
+            if page is None:
+                continue
+            try:
+                rsp = future.result(0)
+            except Exception as e:
+                self._failed(pages, page, e)
+                continue
+
+            if page[0] == ZpiCommand.ZDO_MGMT_LQI_REQ:
+                self._lqi_page(pages, page, rsp)
+            else:
+                self._rtg_page(pages, page, rsp)
+
+        return self.topology
+
+    def _visit(self, pages, node):
+        """ queue the first pages of a router not walked yet """
+        if node.visited:
+            return
+        node.visited = True
+        pages.append((ZpiCommand.ZDO_MGMT_LQI_REQ, node.ieee_addr,
+                      node.nwk_addr, 0, 0))
+        if self.routes:
+            pages.append((ZpiCommand.ZDO_MGMT_RTG_REQ, node.ieee_addr,
+                          node.nwk_addr, 0, 0))
+
+    def _failed(self, pages, page, exception):
+        """ retry a page, or record its failure """
+        zdo_cmd, ieee_addr, nwk_addr, start_index, tries = page
+        if tries < self.retries:
+            pages.append((zdo_cmd, ieee_addr, nwk_addr, start_index, tries + 1))
+        else:
+            log.info('%s to 0x%.4X at %d failed: %s' % (
+                zdo_cmd, nwk_addr, start_index, exception))
+            self.failures.append((zdo_cmd, nwk_addr, start_index, exception))
+
+    def _next_page(self, pages, page, entries, start_index, count):
+        """ queue the next page of a table if it has more entries """
+        if count and start_index + count < entries:
+            pages.append((page[0], page[1], page[2], start_index + count, 0))
+
+    def _lqi_page(self, pages, page, rsp):
+        """ merge a neighbor table page in the topology """
+        src_addr, status, entries, start_index, records = rsp
+        if status != ZpiStatus.Z_SUCCESS:
+            self._failed(pages, page[0:4] + (self.retries, ), status)
+            return
+
+        ieee_addr = page[1]
+        topology = self.topology
+        for nbr in decode_nbr_table(records).rows():
+            node, is_new = topology.add_node(
+                nbr['ieee_addr'], nbr['nwk_addr'], nbr['device_type'],
+                depth = nbr['depth'],
+                rx_on_when_idle = nbr['rx_on_when_idle'],
+                permit_joining = nbr['permit_joining'],
+                ext_pan_id = nbr['ext_pan_id'])
+            topology.add_link(ieee_addr, node.ieee_addr, nbr['lqi'],
+                              nbr['relationship'])
+
+            if is_new and self.on_node is not None:
+                self.on_node(node)
+            if self.on_link is not None:
+                self.on_link(ieee_addr, node.ieee_addr,
+                             topology.links[(ieee_addr, node.ieee_addr)])
+            if node.is_router():
+                self._visit(pages, node)
+
+        self._next_page(pages, page, entries, start_index, len(records))
+
+    def _rtg_page(self, pages, page, rsp):
+        """ merge a routing table page in the topology """
+        src_addr, status, entries, start_index, records = rsp
+        if status != ZpiStatus.Z_SUCCESS:
+            self._failed(pages, page[0:4] + (self.retries, ), status)
+            return
+
+        for rtg in decode_rtg_table(records).rows():
+            self.topology.add_route(page[1], rtg['dst_addr'],
+                                    rtg['route_status'], rtg['next_hop'])
+        self._next_page(pages, page, entries, start_index, len(records))
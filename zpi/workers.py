@@ -0,0 +1,169 @@
+"""
+    callback worker pool module
+
+    CallbackPool runs the AREQ callbacks out of the frame reader thread, so
+    that a slow callback delays neither the reading of the serial port nor
+    the SRSPs other threads are waiting for. Each callback is run by the
+    worker its key hashes to, so the callbacks of one key (e.g. one source
+    address) keep their order while different keys run concurrently.
+"""
+import collections
+import threading
+import time
+
+__all__ = ['CallbackPool']
+
+import logging
+log = logging.getLogger('zpi.workers')
+
+
+class _Worker(threading.Thread):
+    """ a worker thread and its bounded queue """
+    def __init__(self, index):
+        super(_Worker, self).__init__(name = 'ZpiCallback-%d' % index)
+        self.daemon = True
+        self.queue = collections.deque()
+        self.cond = threading.Condition(threading.Lock())
+        self.running = True
+        #counters, updated with cond held or by the worker thread only
+        self.submitted = 0
+        self.executed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue and self.running:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                fn, args = self.queue.popleft()
+                self.cond.notify_all()  #room for a blocked submit()
+
+            try:
+                fn(*args)
+            except Exception as e:
+                log.warning('callback error: %s' % e)
+                self.errors += 1
+            self.executed += 1
+
+
+class CallbackPool(object):
+    """
+        bounded pool of worker threads running callbacks in per key order
+
+        usage:
+            zpi = Zpi(ser, callback, callback_pool = CallbackPool(4))
+
+        Each worker queues up to queue_size callbacks. When the queue of a
+        key is full, policy tells what submit() does:
+            DROP_NEWEST     drop the new callback (the default)
+            DROP_OLDEST     drop the oldest queued callback of the worker
+            BLOCK           wait for room, up to block_timeout seconds (None
+                            for ever), then drop the new callback
+
+        submit() is called by the frame reader thread, so BLOCK back-pressures
+        the UART reader: while it waits no frame is read, the SRSPs included,
+        and requests of other threads may time out. Use it with a
+        block_timeout well below the SRSP timeout.
+
+        Counters: submitted, executed, dropped, errors and high_water, the
+        longest queue seen.
+    """
+    BLOCK = 'block'
+    DROP_NEWEST = 'drop_newest'
+    DROP_OLDEST = 'drop_oldest'
+
+    def __init__(self, workers = 4, queue_size = 256, policy = DROP_NEWEST,
+                 block_timeout = 0.100):
+        if workers < 1:
+            raise ValueError('Invalid worker count: %s' % repr(workers))
+        if queue_size < 1:
+            raise ValueError('Invalid queue size: %s' % repr(queue_size))
+        if policy not in (self.BLOCK, self.DROP_NEWEST, self.DROP_OLDEST):
+            raise ValueError('Invalid queue policy: %s' % repr(policy))
+
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._workers = [_Worker(index) for index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, fn, *args):
+        """
+            queue fn(*args) after the callbacks of the same key, return False
+            if it was dropped
+        """
+        worker = self._workers[hash(key) % len(self._workers)]
+        with worker.cond:
+            if not worker.running:
+                raise RuntimeError('Callback pool closed.')
+
+            queue = worker.queue
+            if len(queue) >= self.queue_size:
+                if self.policy == self.DROP_NEWEST:
+                    worker.dropped += 1
+                    return False
+                elif self.policy == self.DROP_OLDEST:
+                    queue.popleft()
+                    worker.dropped += 1
+                elif not self._wait_room(worker):
+                    worker.dropped += 1
+                    return False
+
+            queue.append((fn, args))
+            worker.submitted += 1
+            if len(queue) > worker.high_water:
+                worker.high_water = len(queue)
+            worker.cond.notify_all()
+        return True
+
+    def _wait_room(self, worker):
+        """ wait for room in the queue of worker, its condition held """
+        deadline = (time.time() + self.block_timeout
+                    if self.block_timeout is not None else None)
+        while len(worker.queue) >= self.queue_size and worker.running:
+            if deadline is None:
+                worker.cond.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                worker.cond.wait(remaining)
+        return worker.running
+
+    submitted = property(lambda self: self._sum('submitted'))
+    executed = property(lambda self: self._sum('executed'))
+    dropped = property(lambda self: self._sum('dropped'))
+    errors = property(lambda self: self._sum('errors'))
+    high_water = property(lambda self: max(worker.high_water
+                                           for worker in self._workers))
+
+    def _sum(self, counter):
+        """ sum a counter of the workers """
+        return sum(getattr(worker, counter) for worker in self._workers)
+
+    def pending(self):
+        """ get the number of queued callbacks """
+        return sum(len(worker.queue) for worker in self._workers)
+
+    def stats(self):
+        """ get the counters as a dictionary """
+        return {'submitted': self.submitted, 'executed': self.executed,
+                'dropped': self.dropped, 'errors': self.errors,
+                'high_water': self.high_water, 'pending': self.pending()}
+
+    def close(self, timeout = None):
+        """
+            stop the workers once their queued callbacks are run, waiting up
+            to timeout seconds for them
+        """
+        for worker in self._workers:
+            with worker.cond:
+                worker.running = False
+                worker.cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
@@ -1,9 +1,11 @@
 """ 
     CC2530-ZNP class module 
 """
+import select
 import struct
 import threading
 import time
+import collections
 
 import logging
 
@@ -14,7 +16,15 @@ console.setFormatter(formatter)
 log.addHandler(console)
 log.setLevel(logging.INFO)
 
-from frame import ZnpFrame
+#hex dump of the frames read and written, see set_wire_trace()
+wire_log = logging.getLogger('zpi.wire')
+wire_log.addHandler(console)
+wire_log.setLevel(logging.INFO)
+
+from frame import ZnpFrame, ZnpFrameDecoder
+from zpi.future import ZpiFuture
+from zpi.capture import CAPTURE_RX, CAPTURE_TX
+from zpi.command import subsystem
 
 def set_debug(onoff):
     if onoff:
@@ -22,6 +32,20 @@ def set_debug(onoff):
     else:
         log.setLevel(logging.INFO)
 
+def set_wire_trace(onoff, handler = None):
+    """
+        wire trace switch, the frames are dumped to handler instead of the 
+        console if one is given
+    """
+    if handler is not None:
+        for old_handler in list(wire_log.handlers):
+            wire_log.removeHandler(old_handler)
+        wire_log.addHandler(handler)
+    if onoff:
+        wire_log.setLevel(logging.DEBUG)
+    else:
+        wire_log.setLevel(logging.INFO)
+
 def _len_calc(x_value, expr = 'x'):
     """ 
         calculate the len with a customized expression, such as : x*2. 
@@ -50,32 +74,148 @@ class Znp(threading.Thread):
         SRSP is a synchronous response. It's only sent in response to a SREQ 
             command.
     """
+    #block on the serial file descriptor instead of polling inWaiting()
+    RX_EVENT_DRIVEN = True
+    #max. time blocked in select(), bounds the halt() latency
+    RX_WAIT_TIMEOUT = 0.100
+    #write the frames from a writer thread, queued frames are coalesced 
+    #into one serial write of up to TX_COALESCE_MAX bytes
+    TX_THREAD = True
+    TX_COALESCE_MAX = 4096
+    #metrics.Metrics recording the frame path, None to disable it
+    metrics = None
+    #capture.CaptureWriter recording the frames read and written, or None
+    capture = None
+    #drop the frames of no known response before they are split, only 
+    #counting them, instead of raising from _split_response()
+    DROP_UNKNOWN_FRAMES = False
+    #polling interval used when the port has no usable file descriptor
+    RX_POLL_INTERVAL = 0.005
+    #run the frame reader thread, False if frames are read by other means 
+    #(e.g. an event loop, see aio.AsyncZpi)
+    RX_THREAD = True
+
     def __init__(self, ser, callback = None):
         super(Znp, self).__init__()
         self.serial = ser
         self._callback = None
         self._thread_continue = False
+        self._rx_fd = None
+        self._rx_decoder = ZnpFrameDecoder()
+        self._rx_frames = collections.deque()   #decoded, not yet read frames
+        self._tx_lock = threading.RLock()       #serialises SREQ queueing, inline writes
+        self._tx_queue = collections.deque()    #(frame, completion handle)
+        self._tx_cond = threading.Condition(threading.Lock())
+        self._tx_continue = False
+        self._tx_thread = None
+        self.tx_frames = 0      #frames written by the writer thread
+        self.tx_writes = 0      #serial writes they took
+        self.unknown_frames = 0 #frames of no known response
+        
+        if self.TX_THREAD:
+            self._tx_continue = True
+            self._tx_thread = threading.Thread(target = self._tx_loop, 
+                                               name = 'ZnpWriter')
+            self._tx_thread.daemon = True
+            self._tx_thread.start()
+        
+        if self.RX_EVENT_DRIVEN:
+            self._rx_fd = self._serial_fileno(ser)
         
         if callback:
             self._callback = callback
-            self._thread_continue = True
-            self.start()
+            if self.RX_THREAD:
+                self._thread_continue = True
+                self.start()
             
     def halt(self, timeout = None):
         """
             halt the thread
         """
-        if self._callback:
+        if self._callback and self.RX_THREAD:
             self._thread_continue = False
             self.join(timeout)
+        
+        if self._tx_thread is not None:
+            #the queued frames are written before the writer exits
+            with self._tx_cond:
+                self._tx_continue = False
+                self._tx_cond.notify()
+            self._tx_thread.join(timeout)
             
     def _write(self, data):
         """
-            write data to serial
+            write data to serial, wait until it is written
+        """
+        self._write_nowait(data).result()
+        
+    def _write_nowait(self, data):
+        """
+            queue data for the writer thread, return a ZpiFuture done once it 
+            is written, failed if the write failed
+            
+            Without writer thread, data is written before returning.
         """
         frame = ZnpFrame(data).output()
-        log.debug('TX: %s' % frame.encode('hex'))
-        self.serial.write(frame)
+        if wire_log.isEnabledFor(logging.DEBUG):
+            wire_log.debug('TX: %s', frame.encode('hex'))
+        if self.capture is not None:
+            self.capture.record(CAPTURE_TX, data)
+        handle = ZpiFuture('TX')
+        with self._tx_cond:
+            if self._tx_continue:
+                self._tx_queue.append((frame, handle))
+                self._tx_cond.notify()
+                return handle
+        
+        with self._tx_lock:
+            try:
+                self.serial.write(frame)
+            except Exception as e:
+                handle.set_exception(e)
+            else:
+                handle.set_result(len(frame))
+        return handle
+        
+    def _tx_loop(self):
+        """
+            writer thread, write the queued frames, several at once
+        """
+        queue = self._tx_queue
+        while True:
+            with self._tx_cond:
+                while not queue and self._tx_continue:
+                    self._tx_cond.wait()
+                if not queue:
+                    break
+                
+                frames = []
+                handles = []
+                size = 0
+                limit = self.TX_COALESCE_MAX
+                while queue and (not frames or 
+                                 size + len(queue[0][0]) <= limit):
+                    frame, handle = queue.popleft()
+                    frames.append(frame)
+                    handles.append(handle)
+                    size += len(frame)
+            
+            #only this thread writes to the port, producers keep queueing
+            #meanwhile
+            try:
+                self.serial.write(b''.join(frames))
+            except Exception as e:
+                log.warning('ZnpWriter:{0}'.format(e))
+                for handle in handles:
+                    handle.set_exception(e)
+                continue
+            
+            self.tx_frames += len(frames)
+            self.tx_writes += 1
+            for handle, frame in zip(handles, frames):
+                handle.set_result(len(frame))
+        
+        log.info('Znp writer exited.')
 
         
     def run(self):
@@ -89,8 +229,8 @@ class Znp(threading.Thread):
                 #self._callback(self.wait_read_frame())
                 rx_data = self.wait_read_frame()
 
-                log.debug('RX SRSP/AREQ: %s' % rx_data['id'])  
-                log.debug('rx_data: %s' % rx_data)              
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug('RX SRSP/AREQ: %s', rx_data['id'])
                 self._callback(rx_data)
             except ThreadQuitException:
                 log.info('Znp thread exited.')
@@ -99,59 +239,94 @@ class Znp(threading.Thread):
                 log.warning('Znp:{0}'.format(e))
                 continue
             
+    @staticmethod
+    def _serial_fileno(ser):
+        """
+            get a selectable file descriptor of the serial port, None if the 
+            port does not provide one (e.g. win32 ports)
+        """
+        try:
+            fd = ser.fileno()
+        except Exception:
+            return None
+        
+        if isinstance(fd, (int, long)) and fd >= 0:
+            return fd
+        return None
+        
+    def _rx_ready(self):
+        """
+            wait until rx data is available or the wait timeout expires, 
+            return True if data can be read
+        """
+        if self.serial.inWaiting() > 0:
+            return True
+        
+        if self._rx_fd is None:
+            time.sleep(self.RX_POLL_INTERVAL)
+            return False
+        
+        try:
+            readable = select.select([self._rx_fd], [], [], 
+                                     self.RX_WAIT_TIMEOUT)[0]
+        except select.error:
+            #interrupted by a signal, let the caller check the quit flag
+            return False
+        
+        return len(readable) > 0
+        
     def _wait_for_frame(self):
         """
             read from the serial port until a valid ZNP frame arrives. It will 
             then return the binary data contained within the frame
+            
+            All bytes waiting in the port are read at once, a single read may 
+            deliver several frames, the extra ones are queued for next calls.
         """
-        frame = ZnpFrame()
-        
         while True:
+            if self._rx_frames:
+                return self._rx_frames.popleft()
+            
             if self._callback and not self._thread_continue:
                 raise ThreadQuitException
             
-            if self.serial.inWaiting() == 0:
-                time.sleep(0.005)       #5ms polling
+            if not self._rx_ready():
                 continue
             
-            byte = self.serial.read()
-            
-            if byte != ZnpFrame.SOF:
+            chunk = self.serial.read(self.serial.inWaiting() or 1)
+            if not chunk:
                 continue
             
-            # save all following bytes
-            if len(byte) == 1:
-                #print 'received: SOF'
-                frame.fill(byte)
-                
-            #TODO: how to handle the rx timeout situation if not enough bytes     
-            while frame.remaining_bytes() > 0:
-                byte = self.serial.read()
-                
-                if len(byte) == 1:
-                    #print 'received: %s' % byte.encode('hex')
-                    frame.fill(byte)
-                    
-            try:
-                log.debug('RX: %s' % frame.raw_data.encode('hex'))
-                frame.parse()
+            bad_frames = self._rx_decoder.bad_frames
+            trace = wire_log.isEnabledFor(logging.DEBUG)
+            for frame in self._rx_decoder.feed(chunk):
+                if trace:
+                    wire_log.debug('RX: %s', frame.raw_data.encode('hex'))
                 
                 #ignore empty frames
                 if len(frame.data) == 0:
                     log.debug('Empty frame received!')
-                    frame = ZnpFrame()
                     continue
                 
-                return frame
-            except ValueError:
-                #bad frame, so restart
+                if self.capture is not None:
+                    self.capture.record(CAPTURE_RX, frame.data)
+                self._rx_frames.append(frame)
+                
+            if self._rx_decoder.bad_frames != bad_frames:
                 log.debug('bad frame received!')
-                frame = ZnpFrame()
+                if self.metrics is not None:
+                    self.metrics.incr('bad_frames_total', None, 
+                                      self._rx_decoder.bad_frames - bad_frames)
                 
     def _build_frame(self, cmd, **kwargs):
         """
             this function must be used with a pre-defined dictionary
         """
+        encoders = self.znp_encoders
+        if encoders is not None:
+            #compiled encoders, see codec.compile_commands()
+            return encoders[cmd].encode(kwargs)
+        
         try:
             cmd_spec = self.znp_commands[cmd]
         except AttributeError:
@@ -209,7 +384,6 @@ class Znp(threading.Thread):
             if data:
                 packet += data
                 
-        log.debug('TX packet: %s' % packet.encode('hex'))        
         return packet
         
     def _split_response(self, data):
@@ -218,6 +392,25 @@ class Znp(threading.Thread):
         """
         packet_id = data[0:2] #CMD0,CMD1
         
+        decoders = self.znp_decoders
+        decoder = decoders.get(packet_id) if decoders is not None else None
+        if decoder is not None:
+            #compiled decoder, see codec.compile_responses()
+            try:
+                info = decoder.split(data)
+            except ValueError:
+                log.error ('Data: %s' % data.encode('hex'))
+                if self.metrics is not None:
+                    self.metrics.incr('malformed_frames_total', decoder.name)
+                raise
+            
+            if decoder.parsing:
+                for parse_rule in decoder.parsing:
+                    if parse_rule[0] in info:
+                        info[parse_rule[0]] = parse_rule[1](self, info)
+            
+            return info
+        
         #print 'Received packet id: %s' % packet_id.encode('hex')
         #print repr(packet_id)
         
@@ -226,12 +419,14 @@ class Znp(threading.Thread):
         except AttributeError:
             raise NotImplementedError('Cannot find API response specifications!')
         except KeyError:
+            self._unknown_frame(packet_id)
             #check to see if response can be found in tx commands list
-            for cmd_name, cmd in list(self.znp_commands.items()):
-                if cmd[0]['default'] == data[0] and cmd[1]['default'] == data[1]:
-                    raise CommandFrameException('Incomming frame with id 0x%s looks like a command frame of '
-                                                'type %s but with wrong data' % (data[0:2].encode('hex'), cmd_name))
-            raise KeyError('Unrecognized response packet with cmd: %s' % data[0:2].encode('hex'))
+            cmd_name = self.znp_command_ids.get(packet_id)
+            if cmd_name is not None:
+                raise CommandFrameException('Incomming frame with id 0x%s looks like a command frame of '
+                                            'type %s but with wrong data' % (packet_id.encode('hex'), cmd_name))
+            raise KeyError('Unrecognized response packet with cmd: %s (%s)' % (
+                packet_id.encode('hex'), subsystem(packet_id)))
         
         index = 2  #start from 2 because we have 2 command bytes
         
@@ -300,14 +495,40 @@ class Znp(threading.Thread):
             send data to radio
         """
         self._write(self._build_frame(cmd, **kwargs))
-        log.debug('TX SREQ/AREQ: %s' % cmd)
+        log.debug('TX SREQ/AREQ: %s', cmd)
+        
+    def send_nowait(self, cmd, **kwargs):
+        """
+            queue data to radio without waiting, return the ZpiFuture done 
+            once it is written
+        """
+        handle = self._write_nowait(self._build_frame(cmd, **kwargs))
+        log.debug('TX SREQ/AREQ: %s', cmd)
+        return handle
         
     def wait_read_frame(self):
         """
             wait for reading a valid frame from radio
         """
-        frame = self._wait_for_frame()
-        return self._split_response(frame.data)
+        while True:
+            frame = self._wait_for_frame()
+            if self._filter_frame(frame.data):
+                return self._split_response(frame.data)
+            if self.metrics is not None:
+                self.metrics.incr('rx_dropped_total')
+            
+    def _unknown_frame(self, packet_id):
+        """ count a frame of no known response """
+        self.unknown_frames += 1
+        if self.metrics is not None:
+            self.metrics.incr('unknown_frames_total')
+        
+    def _filter_frame(self, data):
+        """
+            hook run on the frame data before it is split, False to drop the 
+            frame
+        """
+        return True
     
     def __getattr__(self, name):
         """
@@ -2,19 +2,32 @@
     zpi2.py: TI ZNP API v2 implementation module
 """
 import struct
+import collections
 import datetime
+import functools
+import time
 import Queue
 import threading
 
 from zpi.frame import ZnpFrame
 from zpi.command import *
-from zpi.znp import Znp
+from zpi.codec import compile_commands, compile_responses, ZnpResponse
+from zpi.future import ZpiFuture, PendingRequests, AreqWaiters
+from zpi.pipeline import ZpiPipeline
+from zpi.addrcache import AddressCache
+from zpi.srcroute import SourceRouteCache
+from zpi.dispatch import SubscriptionTable
+from zpi.tables import decode_nbr_table, decode_rtg_table, \
+    decode_nwk_disc_table
+from zpi.znp import Znp, wire_log
 
 __all__ = [
+    'ZpiBase',
     'Zpi',
     'SerialTimeoutException',
     'AreqTimeoutException',
     'SrspTimeoutException',
+    'ZpiStatusException',
     'ResetType',
     'ResetReason',
     'AdcResolution',
@@ -48,18 +61,138 @@ def set_debug(onoff):
         log.setLevel(logging.INFO)
 
 
-class Zpi(Znp):
+class ZpiBase(Znp):
     """
-        A class implements TI ZPI (ZNP API) functions
+        TI ZPI (ZNP API) functions and the dispatching of the received frames
+
+        The helpers waiting for responses in the calling thread are defined by
+        Zpi, aio.AsyncZpi derives from this class instead.
     """
     znp_commands = ZpiCommands.znp_commands
     znp_responses = ZpiCommands.znp_responses
+    znp_command_ids = ZpiCommands.command_ids
+    znp_encoders = compile_commands(znp_commands)
+    znp_decoders = compile_responses(znp_responses)
 
     SRSP_WAITING_TIMEOUT_DEFAULT = 0.500 #SRSP wait timeout default value: 200ms
+    AREQ_WAITING_TIMEOUT_DEFAULT = 3.000 #AREQ wait timeout default value: 3s
+
+    #ZDO request: (request method, destination argument, its format,
+    #             response id, response field matching the destination,
+    #             response handler)
+    ZDO_EXCHANGES = {
+        ZpiCommand.ZDO_NWK_ADDR_REQ:
+            ('zdo_nwk_addr_req', 'ieee_addr', '<Q',
+             ZpiCommand.ZDO_NWK_ADDR_RSP, 'ieee_addr',
+             'zdo_nwk_addr_rsp_handler'),
+        ZpiCommand.ZDO_IEEE_ADDR_REQ:
+            ('zdo_ieee_addr_req', 'nwk_addr', '<H',
+             ZpiCommand.ZDO_IEEE_ADDR_RSP, 'nwk_addr',
+             'zdo_ieee_addr_rsp_handler'),
+        ZpiCommand.ZDO_NODE_DESC_REQ:
+            ('zdo_node_desc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_NODE_DESC_RSP, 'src_addr',
+             'zdo_node_desc_rsp_handler'),
+        ZpiCommand.ZDO_POWER_DESC_REQ:
+            ('zdo_power_desc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_POWER_DESC_RSP, 'src_addr',
+             'zdo_power_desc_rsp_handler'),
+        ZpiCommand.ZDO_SIMPLE_DESC_REQ:
+            ('zdo_simple_desc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_SIMPLE_DESC_RSP, 'src_addr',
+             'zdo_simple_desc_rsp_handler'),
+        ZpiCommand.ZDO_ACTIVE_EP_REQ:
+            ('zdo_active_ep_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_ACTIVE_EP_RSP, 'src_addr',
+             'zdo_active_ep_rsp_handler'),
+        ZpiCommand.ZDO_MATCH_DESC_REQ:
+            ('zdo_match_desc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MATCH_DESC_RSP, 'src_addr',
+             'zdo_match_desc_rsp_handler'),
+        ZpiCommand.ZDO_COMPLEX_DESC_REQ:
+            ('zdo_complex_desc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_COMPLEX_DESC_RSP, 'src_addr',
+             'zdo_complex_desc_rsp_handler'),
+        ZpiCommand.ZDO_USER_DESC_REQ:
+            ('zdo_user_desc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_USER_DESC_RSP, 'src_addr',
+             'zdo_user_desc_rsp_handler'),
+        ZpiCommand.ZDO_BIND_REQ:
+            ('zdo_bind_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_BIND_RSP, 'src_addr',
+             'zdo_bind_rsp_handler'),
+        ZpiCommand.ZDO_UNBIND_REQ:
+            ('zdo_unbind_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_UNBIND_RSP, 'src_addr',
+             'zdo_unbind_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_NWK_DISC_REQ:
+            ('zdo_mgmt_nwk_disc_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_NWK_DISC_RSP, 'src_addr',
+             'zdo_mgmt_nwk_disc_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_LQI_REQ:
+            ('zdo_mgmt_lqi_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_LQI_RSP, 'src_addr',
+             'zdo_mgmt_lqi_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_RTG_REQ:
+            ('zdo_mgmt_rtg_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_RTG_RSP, 'src_addr',
+             'zdo_mgmt_rtg_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_BIND_REQ:
+            ('zdo_mgmt_bind_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_BIND_RSP, 'src_addr',
+             'zdo_mgmt_bind_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_LEAVE_REQ:
+            ('zdo_mgmt_leave_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_LEAVE_RSP, 'src_addr',
+             'zdo_mgmt_leave_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_DIRECT_JOIN_REQ:
+            ('zdo_mgmt_direct_join_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_DIRECT_JOIN_RSP, 'src_addr',
+             'zdo_mgmt_direct_join_rsp_handler'),
+        ZpiCommand.ZDO_MGMT_PERMIT_JOIN_REQ:
+            ('zdo_mgmt_permit_join_req', 'dst_addr', '<H',
+             ZpiCommand.ZDO_MGMT_PERMIT_JOIN_RSP, 'src_addr',
+             'zdo_mgmt_permit_join_rsp_handler'),
+    }
 
-    def __init__(self, ser, callback = None):
+    #AREQs carrying addresses for the address cache
+    ADDRESS_SOURCES = frozenset([ZpiCommand.ZDO_END_DEVICE_ANNCE_IND,
+                                 ZpiCommand.ZDO_NWK_ADDR_RSP,
+                                 ZpiCommand.ZDO_IEEE_ADDR_RSP,
+                                 ZpiCommand.ZDO_MGMT_LQI_RSP,
+                                 ZpiCommand.ZDO_LEAVE_IND])
+    #retrieve the payload of huge AF_INCOMING_MSG_EXT before delivering them,
+    #see Zpi
+    RETRIEVE_LARGE_MSG = False
+    #largest chunks of AF_DATA_STORE and AF_DATA_RETRIEVE SRSP frames
+    AF_DATA_STORE_CHUNK = ZnpFrame.MAX_LEN_DATA - 3
+    AF_DATA_RETRIEVE_CHUNK = ZnpFrame.MAX_LEN_DATA - 2
+    #largest data sent inline by AF_DATA_REQUEST_EXT
+    AF_DATA_REQUEST_EXT_MAX = ZnpFrame.MAX_LEN_DATA - 20
+
+    #AREQs updating or invalidating the source route cache
+    ROUTE_SOURCES = frozenset([ZpiCommand.ZDO_SRC_RTG_IND,
+                               ZpiCommand.ZDO_END_DEVICE_ANNCE_IND,
+                               ZpiCommand.ZDO_LEAVE_IND])
+
+    def __init__(self, ser, callback = None, address_cache = None,
+                 callback_pool = None):
+        """
+            address_cache is the AddressCache fed from the received frames
+            and consulted by the address lookups, an in-memory one by default
+
+            callback_pool is a workers.CallbackPool running the async
+            callback and the subscription handlers out of the reader thread,
+            in order per source address, None to run them in the reader
+            thread. SRSPs are always completed by the reader thread.
+        """
         #this is an async callback
         self._async_callback = callback
+        self.callback_pool = callback_pool
+        self.address_cache = (address_cache if address_cache is not None
+                              else AddressCache())
+        #source routes of ZDO_SRC_RTG_IND, see af_data_request_auto_route()
+        self.source_routes = SourceRouteCache()
 
         #init sync callback handlers list t empty
         self._srsp_handlers = []
@@ -77,8 +210,89 @@ class Zpi(Znp):
 
         self._srsp_events = {}   #ZpiCommand:event, each SRSP holds an event
 
+        #futures of written SREQs waiting for their SRSP
+        self._pending_srsp = PendingRequests()
+        #per thread state, the pipeline an API method is called through
+        self._sreq_local = threading.local()
+        #futures of ZDO requests waiting for their AREQ response
+        self._areq_waiters = AreqWaiters()
+        #huge AF_INCOMING_MSG_EXT waiting for their payload to be retrieved
+        self._large_msg_q = None
+        #AREQ handlers by (response id, endpoint, cluster id), see subscribe()
+        self._subscriptions = SubscriptionTable(self.znp_decoders)
+
         #set to default callback for dispatcher
-        super(Zpi, self).__init__(ser, self._callback_dispatcher)
+        super(ZpiBase, self).__init__(ser, self._callback_dispatcher)
+
+    def _filter_frame(self, data):
+        """
+            reader hook run on the frame data before it is split: hand the 
+            subscribed AREQs to their subscriptions and tell whether the frame 
+            is still wanted by the dispatcher
+            
+            With subscriptions and no async callback, an AREQ nobody 
+            subscribed to, waits for or caches is dropped unparsed. So are 
+            the frames of no known response with DROP_UNKNOWN_FRAMES.
+        """
+        if self.DROP_UNKNOWN_FRAMES and data[0:2] not in self.znp_decoders:
+            self._unknown_frame(data[0:2])
+            return False
+        if not self._subscriptions or \
+                (ord(data[0:1]) >> 5) != ZnpFrame.CMD_AREQ:
+            return True
+        
+        decoder = self.znp_decoders.get(data[0:2])
+        if decoder is None:
+            return True     #reported by _split_response()
+        
+        rsp_id = decoder.name
+        wanted = (rsp_id in self.ADDRESS_SOURCES or 
+                  rsp_id in self.ROUTE_SOURCES or 
+                  self._areq_waiters.waits_for(rsp_id))
+        subscriptions = self._subscriptions.match(data)
+        if not subscriptions:
+            return wanted or self._async_callback is not None
+        
+        if (rsp_id == ZpiCommand.AF_INCOMING_MSG_EXT and 
+                self.RETRIEVE_LARGE_MSG and 
+                len(data) == decoder.offsets['data'][0] and 
+                data[-2:] != b'\x00\x00'):
+            return True     #notified once its payload is retrieved
+        
+        self._notify(subscriptions, data)
+        return wanted
+
+    def _notify(self, subscriptions, data, payload = None):
+        """ call the handlers of subscriptions, through the callback pool """
+        if self.callback_pool is None:
+            self._subscriptions.notify(self, subscriptions, data, payload)
+            return
+
+        offset = self.znp_decoders[data[0:2]].offsets.get('src_addr')
+        key = (data[offset[0]:offset[0] + offset[1]] if offset is not None
+               else data[0:2])
+        self.callback_pool.submit(key, self._subscriptions.notify, self,
+                                  subscriptions, data, payload)
+
+    def subscribe(self, rsp_id, handler, endpoint = None, cluster_id = None, 
+                  fields = None):
+        """
+            call handler(zpi, fields) for every AREQ rsp_id, or only for those 
+            sent to endpoint and cluster_id for the responses addressed to 
+            them (AF_INCOMING_MSG, AF_INCOMING_MSG_EXT, ...), None matching any
+            
+            fields are the names of the fields the handler needs, decoded 
+            into {field_name: value} (see codec.ResponseDecoder.unpack()), 
+            all of them by default. The AREQs taken by subscriptions are not 
+            passed to the async callback. Return the Subscription to give to 
+            unsubscribe().
+        """
+        return self._subscriptions.add(rsp_id, handler, endpoint, cluster_id,
+                                       fields)
+
+    def unsubscribe(self, subscription):
+        """ remove a subscription, False if it was not subscribed """
+        return self._subscriptions.remove(subscription)
 
     def _callback_dispatcher(self, rx_data):
         """
@@ -89,36 +303,317 @@ class Zpi(Znp):
         """
         if rx_data is None:
             return
+        if self.metrics is not None:
+            self.metrics.incr('rx_frames_total', rx_data['id'])
 
-        for field_name, field_value in rx_data.iteritems():
-            if field_name != 'id':
-                log.debug('%s: %s' % (field_name, field_value.encode('hex')))
-
+        if wire_log.isEnabledFor(logging.DEBUG):
+            wire_log.debug('RX %s: %s', rx_data['id'], ' '.join(
+                '%s=%s' % (name, value.encode('hex') 
+                           if isinstance(value, str) else repr(value))
+                for name, value in rx_data.iteritems() if name != 'id'))
 
         #get rx_data id and find related registered handler if existed
         cmd0 = struct.unpack('<B', rx_data['cmd0'])[0]
         if (cmd0 >> 5) ==  ZnpFrame.CMD_SRSP:  #filter SRSP commands
-            #put data and then set event
-            self._srsp_rx_msg = rx_data
-            self._srsp_event_set(rx_data['id'])
+            future = self._pending_srsp.pop(
+                self._srsp_key(rx_data['cmd0'], rx_data['cmd1']))
+            if future is not None:
+                future.set_result(rx_data)
+            else:
+                #not requested through _sreq(), put data and then set event
+                self._srsp_rx_msg = rx_data
+                self._srsp_event_set(rx_data['id'])
 
         elif (cmd0 >> 5) == ZnpFrame.CMD_AREQ: #filter AREQ commands
-            if self._async_callback is not None:
-                try:
-                    self._async_callback(self, rx_data)
-                except:
-                    log.warning('async callback error: %s' %
-                                self._async_callback.__name__)
-                    raise
-            else:
-                self._areq_arrived.acquire()
-                self._areq_rx_msg = rx_data
-                self._areq_arrived.notify()
-                self._areq_arrived.release()
-                self._is_areq_arrived.set()
+            if (rx_data['id'] in self.ADDRESS_SOURCES and
+                    self.address_cache is not None):
+                self._cache_addresses(rx_data)
+            if (rx_data['id'] in self.ROUTE_SOURCES and
+                    self.source_routes is not None):
+                self._cache_source_route(rx_data)
+
+            if (rx_data['id'] == ZpiCommand.AF_INCOMING_MSG_EXT and
+                    self.RETRIEVE_LARGE_MSG and self._is_large_msg(rx_data)):
+                #delivered once its payload is retrieved
+                self._queue_large_msg(rx_data)
+                return
+
+            self._deliver_areq(rx_data)
         else:
             log.debug('Not handled Rx response.')
 
+    def _cache_address(self, ieee_addr, nwk_addr):
+        """ feed the address cache, unknown or broadcast addresses skipped """
+        if (ieee_addr not in (0, 0xFFFFFFFFFFFFFFFF) and
+                nwk_addr < AddressShort.GROUP_ROUTE_COORD):
+            self.address_cache.update(ieee_addr, nwk_addr)
+
+    def _cache_addresses(self, rx_data):
+        """ feed the address cache from an AREQ of ADDRESS_SOURCES """
+        rsp_id = rx_data['id']
+        if rsp_id == ZpiCommand.ZDO_LEAVE_IND:
+            self.address_cache.discard(
+                ieee_addr = struct.unpack('<Q', rx_data['ext_addr'])[0])
+        elif rsp_id == ZpiCommand.ZDO_MGMT_LQI_RSP:
+            if rx_data['status'] == b'\x00':
+                for nbr in decode_nbr_table(
+                        rx_data.get('nbr_table_list_records', b'')).rows():
+                    self._cache_address(nbr['ieee_addr'], nbr['nwk_addr'])
+        elif rx_data.get('status', b'\x00') == b'\x00':
+            self._cache_address(struct.unpack('<Q', rx_data['ieee_addr'])[0],
+                                struct.unpack('<H', rx_data['nwk_addr'])[0])
+
+    def _cache_source_route(self, rx_data):
+        """ update the source route cache from an AREQ of ROUTE_SOURCES """
+        rsp_id = rx_data['id']
+        if rsp_id == ZpiCommand.ZDO_SRC_RTG_IND:
+            self.source_routes.update(*self.zdo_src_rtg_ind_handler(rx_data))
+        elif rsp_id == ZpiCommand.ZDO_LEAVE_IND:
+            self.source_routes.invalidate(
+                struct.unpack('<H', rx_data['src_addr'])[0])
+        else:
+            self.source_routes.invalidate(
+                struct.unpack('<H', rx_data['nwk_addr'])[0])
+
+    def _deliver_areq(self, rx_data):
+        """ hand an AREQ to its waiter and to the async callback """
+        future = self._areq_waiters.match(rx_data)
+        if future is not None:
+            future.set_result(rx_data)
+
+        if self._subscriptions and getattr(rx_data, 'raw', None) and \
+                self._subscriptions.match(rx_data.raw):
+            return  #taken by its subscriptions
+        if self._async_callback is not None and self.callback_pool is not None:
+            #ordered per source address, same key as _notify()
+            self.callback_pool.submit(
+                rx_data.get('src_addr') or rx_data['cmd0'] + rx_data['cmd1'],
+                self._async_callback, self, rx_data)
+        elif self._async_callback is not None:
+            try:
+                self._async_callback(self, rx_data)
+            except:
+                log.warning('async callback error: %s' %
+                            self._async_callback.__name__)
+                raise
+        else:
+            self._areq_arrived.acquire()
+            self._areq_rx_msg = rx_data
+            self._areq_arrived.notify()
+            self._areq_arrived.release()
+            self._is_areq_arrived.set()
+
+    @staticmethod
+    def _is_large_msg(rx_data):
+        """ True for an AF_INCOMING_MSG_EXT whose payload stayed in ZNP """
+        return (not rx_data.get('data') and
+                struct.unpack('<H', rx_data['len'])[0] > 0)
+
+    @staticmethod
+    def _srsp_key(cmd0, cmd1):
+        """ correlation key of a SREQ and its SRSP: (subsystem, command id) """
+        return (struct.unpack('<B', cmd0)[0] & 0x1f,
+                struct.unpack('<B', cmd1)[0])
+
+    def _sreq_future(self, zpi_cmd, srsp_handler = None, **kwargs):
+        """
+            send a SREQ and return the ZpiFuture of its SRSP, the future
+            result is the SRSP processed by srsp_handler
+        """
+        packet = self._build_frame(zpi_cmd, **kwargs)
+        future = ZpiFuture(self._srsp_key(packet[0:1], packet[1:2]),
+                           srsp_handler, SrspTimeoutException)
+        if self.metrics is not None:
+            self.metrics.track('sreq', zpi_cmd, future)
+
+        #register and queue atomically, so that futures of the same command
+        #are queued in the order their SREQs go out
+        with self._tx_lock:
+            self._pending_srsp.add(future)
+            handle = self._write_nowait(packet)
+
+        def written(handle):
+            exception = handle.exception(0)
+            if exception is not None:
+                self._pending_srsp.remove(future)
+                future.set_exception(exception)
+        handle.add_done_callback(written)
+
+        log.debug('TX SREQ: %s', zpi_cmd)
+        return future
+
+    def _sreq(self, zpi_cmd, srsp_handler,
+              srsp_timeout = SRSP_WAITING_TIMEOUT_DEFAULT, **kwargs):
+        """
+            send a SREQ, wait for its own SRSP and return the handler result
+
+            called through a pipeline, the SREQ is submitted to the pipeline
+            and its future is returned without waiting
+        """
+        pipeline = getattr(self._sreq_local, 'pipeline', None)
+        if pipeline is not None:
+            #only the first SREQ of an API method is pipelined
+            self._sreq_local.pipeline = None
+            return pipeline.submit(zpi_cmd, srsp_handler, srsp_timeout,
+                                   **kwargs)
+
+        future = self._sreq_future(zpi_cmd, srsp_handler, **kwargs)
+        if not future.wait(srsp_timeout) and future.cancel():
+            #a late SRSP is absorbed by the cancelled future, unless a newer
+            #SREQ of the same command is waiting for its SRSP
+            raise SrspTimeoutException('Wait for %s SRSP timeout.' % zpi_cmd)
+
+        return future.result()
+
+    def _sreq_result(self, result):
+        """
+            return a result known without sending a SREQ the way _sreq()
+            returns its results: as a done future through a pipeline
+        """
+        pipeline = getattr(self._sreq_local, 'pipeline', None)
+        if pipeline is not None:
+            self._sreq_local.pipeline = None
+            future = ZpiFuture()
+            future.set_result(result)
+            return future
+        return result
+
+    def expect_areq(self, rsp_id, field_name, value, deadline = None):
+        """
+            get a ZpiFuture of the next AREQ rsp_id whose field_name is value
+            (its raw bytes), the future result is the rx_data
+
+            the future is registered until deadline (a time.time() value), an
+            AREQ arriving later is dropped. Cancel the future to stop waiting.
+        """
+        future = ZpiFuture((rsp_id, field_name, value),
+                           cancel_error = AreqTimeoutException)
+        self._areq_waiters.add(future, deadline)
+        return future
+
+    def zdo_exchange_async(self, zdo_cmd, *args, **kwargs):
+        """
+            send the ZDO request zdo_cmd (a key of ZDO_EXCHANGES) and return
+            the ZpiFuture of its AREQ response, the future result is the
+            response processed by its zdo_*_rsp_handler
+
+            args and kwargs are the arguments of the request method.
+            areq_timeout is the time the future stays registered, a response
+            arriving later is dropped. A request refused in its SRSP fails
+            the future with ZpiStatusException, a SRSP timeout with
+            SrspTimeoutException.
+
+            Through a pipeline (or on AsyncZpi) the request method returns
+            the future of its SRSP, the status is then checked once it
+            arrives.
+        """
+        areq_timeout = kwargs.pop('areq_timeout',
+                                  self.AREQ_WAITING_TIMEOUT_DEFAULT)
+        (method_name, arg_name, fmt, rsp_id, field_name,
+         handler_name) = self.ZDO_EXCHANGES[zdo_cmd]
+
+        dst = args[0] if args else kwargs[arg_name]
+        future = ZpiFuture((rsp_id, field_name, struct.pack(fmt, dst)),
+                           getattr(self, handler_name), AreqTimeoutException)
+        if self.metrics is not None:
+            self.metrics.track('zdo', zdo_cmd, future)
+        #registered before the request goes out, the response may arrive
+        #before its SRSP has been handled
+        self._areq_waiters.add(future, time.time() + areq_timeout)
+        try:
+            status = getattr(self, method_name)(*args, **kwargs)
+        except:
+            self._areq_waiters.remove(future)
+            raise
+
+        def check(status):
+            if status != ZpiStatus.Z_SUCCESS:
+                self._areq_waiters.remove(future)
+                future.set_exception(ZpiStatusException('%s failed: %s' % (
+                    zdo_cmd, ZpiStatus.status_names.get(status, status)),
+                    status))
+
+        def srsp_done(srsp):
+            if srsp.cancelled():
+                self._areq_waiters.remove(future)
+                future.set_exception(SrspTimeoutException(
+                    'Wait for %s SRSP timeout.' % zdo_cmd))
+                return
+            try:
+                check(srsp.result())
+            except Exception as e:
+                self._areq_waiters.remove(future)
+                future.set_exception(e)
+
+        if hasattr(status, 'add_done_callback'):
+            #the future of the SRSP (ZpiFuture or asyncio future)
+            status.add_done_callback(srsp_done)
+        else:
+            check(status)
+        return future
+
+    def zdo_exchange(self, zdo_cmd, *args, **kwargs):
+        """
+            send the ZDO request zdo_cmd, wait for its AREQ response and return
+            it processed by its zdo_*_rsp_handler
+        """
+        areq_timeout = kwargs.get('areq_timeout',
+                                  self.AREQ_WAITING_TIMEOUT_DEFAULT)
+        future = self.zdo_exchange_async(zdo_cmd, *args, **kwargs)
+        if not future.wait(areq_timeout) and future.cancel():
+            raise AreqTimeoutException('Wait for %s response timeout.' %
+                                       zdo_cmd)
+        return future.result()
+
+    def resolve_nwk_addr(self, ieee_addr,
+                         areq_timeout = AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            get the network address of ieee_addr from the address cache, or
+            else through a ZDO_NWK_ADDR_REQ exchange
+        """
+        nwk_addr = self.address_cache.get_nwk_addr(ieee_addr)
+        if nwk_addr is None:
+            (status, ieee_addr, nwk_addr, start_index,
+             assoc_dev) = self.zdo_exchange(ZpiCommand.ZDO_NWK_ADDR_REQ,
+                                            ieee_addr, 0, 0,
+                                            areq_timeout = areq_timeout)
+            if status != ZpiStatus.Z_SUCCESS:
+                raise ZpiStatusException('%s failed: %s' % (
+                    ZpiCommand.ZDO_NWK_ADDR_REQ,
+                    ZpiStatus.status_names.get(status, status)), status)
+        return nwk_addr
+
+    def resolve_ieee_addr(self, nwk_addr,
+                          areq_timeout = AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            get the IEEE address using nwk_addr from the address cache, or
+            else through a ZDO_IEEE_ADDR_REQ exchange
+        """
+        ieee_addr = self.address_cache.get_ieee_addr(nwk_addr)
+        if ieee_addr is None:
+            (status, ieee_addr, nwk_addr, start_index, assoc_dev_num,
+             assoc_dev) = self.zdo_exchange(ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                                            nwk_addr,
+                                            areq_timeout = areq_timeout)
+            if status != ZpiStatus.Z_SUCCESS:
+                raise ZpiStatusException('%s failed: %s' % (
+                    ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                    ZpiStatus.status_names.get(status, status)), status)
+        return ieee_addr
+
+    def _typed_fields(self, rx_data):
+        """
+            get the typed {field_name: value} of a response, responses not
+            split by a compiled decoder are decoded again from their fields
+        """
+        if isinstance(rx_data, ZnpResponse):
+            return rx_data.typed()
+
+        decoder = self.znp_decoders[rx_data['cmd0'] + rx_data['cmd1']]
+        raw = rx_data['cmd0'] + rx_data['cmd1'] + b''.join(
+            rx_data.get(name, b'') for name in decoder.field_names)
+        return decoder.unpack(raw)
+
     def _srsp_event_clear(self, zpi_cmd):
         """ clear the zpi_cmd event, ignore it if not existed """
         if zpi_cmd in self._srsp_events:
@@ -167,11 +662,8 @@ class Zpi(Znp):
 
     def sys_version(self):
         """ request for the ZNP software version information """
-        self._srsp_event_clear(ZpiCommand.SYS_VERSION_SRSP)
-        self.send(ZpiCommand.SYS_VERSION)
-        self._srsp_event_wait(ZpiCommand.SYS_VERSION_SRSP)
-
-        return self._sys_version_srsp_handler(self._srsp_rx_msg)
+        return self._sreq(ZpiCommand.SYS_VERSION,
+                          self._sys_version_srsp_handler)
 
     def _sys_version_srsp_handler(self, rx_data):
         """ handle system version srsp """
@@ -190,12 +682,10 @@ class Zpi(Znp):
     def sys_adc_read(self, channel, resolution):
         """ read on-chip ADC channel value """
         # pre-check channel range?
-        self._srsp_event_clear(ZpiCommand.SYS_ADC_READ_SRSP)
-        self.send(ZpiCommand.SYS_ADC_READ, channel = struct.pack('<B', channel),
-                  resolution = struct.pack('<B', resolution))
-        self._srsp_event_wait(ZpiCommand.SYS_ADC_READ_SRSP)
-
-        return self._sys_adc_read_srsp_handler(self._srsp_rx_msg)
+        return self._sreq(ZpiCommand.SYS_ADC_READ,
+                          self._sys_adc_read_srsp_handler,
+                          channel = struct.pack('<B', channel),
+                          resolution = struct.pack('<B', resolution))
 
     def _sys_adc_read_srsp_handler(self, rx_data):
         """ handle system adc read srsp """
@@ -207,11 +697,10 @@ class Zpi(Znp):
 
     def sys_gpio(self, operation, value):
         """ configure the accessible GPIO pins on CC2530-ZNP device"""
-        self._srsp_event_clear(ZpiCommand.SYS_GPIO_SRSP)
-        self.send(ZpiCommand.SYS_GPIO, operation = struct.pack('<B', operation),
-                  value = struct.pack('<B', value))
-        self._srsp_event_wait(ZpiCommand.SYS_GPIO_SRSP)
-        return self.sys_gpio_srsp_handler(self._srsp_rx_msg)
+        return self._sreq(ZpiCommand.SYS_GPIO,
+                          self.sys_gpio_srsp_handler,
+                          operation = struct.pack('<B', operation),
+                          value = struct.pack('<B', value))
 
     def sys_gpio_srsp_handler(self, rx_data):
         """ handler for system GPIO srsp """
@@ -223,10 +712,8 @@ class Zpi(Znp):
 
     def sys_random(self):
         """ get a 16-bit random number """
-        self._srsp_event_clear(ZpiCommand.SYS_RANDOM_SRSP)
-        self.send(ZpiCommand.SYS_RANDOM)
-        self._srsp_event_wait(ZpiCommand.SYS_RANDOM_SRSP)
-        return self._sys_random_srsp_handler(self._srsp_rx_msg)
+        return self._sreq(ZpiCommand.SYS_RANDOM,
+                          self._sys_random_srsp_handler)
 
     def _sys_random_srsp_handler(self, rx_data):
         """ handler for system random srsp"""
@@ -300,13 +787,9 @@ class Zpi(Znp):
            (config_id in ConfigParameter.array_4bytes_type) or
            (config_id in ConfigParameter.array_16bytes_type) or
            (config_id in ConfigParameter.user_defined_type)):
-            self._srsp_event_clear(ZpiCommand.ZB_READ_CONFIGURATION_SRSP)
-            self.send(ZpiCommand.ZB_READ_CONFIGURATION,
-                      config_id = struct.pack('<B', config_id))
-            if self._srsp_event_wait(ZpiCommand.ZB_READ_CONFIGURATION_SRSP):
-                return self._zb_read_config_srsp_handler(self._srsp_rx_msg)
-            else:
-                raise SrspTimeoutException()
+            return self._sreq(ZpiCommand.ZB_READ_CONFIGURATION,
+                              self._zb_read_config_srsp_handler,
+                              config_id = struct.pack('<B', config_id))
         else:
             raise ValueError('Invalid Config ID: %s', config_id)
 
@@ -395,15 +878,11 @@ class Zpi(Znp):
         else:
             raise ValueError('Invalid Config ID: %s', config_id)
 
-        self._srsp_event_clear(ZpiCommand.ZB_WRITE_CONFIGURATION_SRSP)
-        self.send(ZpiCommand.ZB_WRITE_CONFIGURATION,
-                  config_id = struct.pack('<B', config_id),
-                  len = struct.pack('<B', data_len),
-                  value = data)
-        if self._srsp_event_wait(ZpiCommand.ZB_WRITE_CONFIGURATION_SRSP):
-            return self._zb_write_config_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZB_WRITE_CONFIGURATION,
+                          self._zb_write_config_srsp_handler,
+                          config_id = struct.pack('<B', config_id),
+                          len = struct.pack('<B', data_len),
+                          value = data)
 
     def _zb_write_config_srsp_handler(self, rx_data):
         """ handler of zb write config srsp """
@@ -433,18 +912,16 @@ class Zpi(Znp):
         for cmd in out_commands:
             out_cmd_list += struct.pack('<H', cmd)
 
-        self._srsp_event_clear(ZpiCommand.ZB_APP_REGISTER_REQUEST_SRSP)
-        self.send(ZpiCommand.ZB_APP_REGISTER_REQUEST,
-                  endpoint = struct.pack('<B', endpoint),
-                  profile_id = struct.pack('<H', profile_id),
-                  device_id = struct.pack('<H', device_id),
-                  device_ver = struct.pack('<B', device_ver),
-                  in_cmd_num = struct.pack('<B', len(in_commands)),
-                  in_cmd_list = in_cmd_list,
-                  out_cmd_num = struct.pack('<B', len(out_commands)),
-                  out_cmd_list = out_cmd_list)
-        self._srsp_event_wait(ZpiCommand.ZB_APP_REGISTER_REQUEST_SRSP)
-        return self._zb_app_register_request_srsp_handler(self._srsp_rx_msg)
+        return self._sreq(ZpiCommand.ZB_APP_REGISTER_REQUEST,
+                          self._zb_app_register_request_srsp_handler,
+                          endpoint = struct.pack('<B', endpoint),
+                          profile_id = struct.pack('<H', profile_id),
+                          device_id = struct.pack('<H', device_id),
+                          device_ver = struct.pack('<B', device_ver),
+                          in_cmd_num = struct.pack('<B', len(in_commands)),
+                          in_cmd_list = in_cmd_list,
+                          out_cmd_num = struct.pack('<B', len(out_commands)),
+                          out_cmd_list = out_cmd_list)
 
     def _zb_app_register_request_srsp_handler(self, rx_data):
         """ handler for zb app register srsp """
@@ -456,22 +933,8 @@ class Zpi(Znp):
 
     def zb_start_request(self):
         """ SAPI - Start ZNP device"""
-        self.send(ZpiCommand.ZB_START_REQUEST)
-
-        #need to lock self._srsp_rx_msg variable shared in 2 threads???
-        while True:
-            self._is_srsp_arrived.wait(Zpi.SRSP_WAITING_TIMEOUT_DEFAULT)
-
-            if (self._srsp_rx_msg is not None and
-               self._srsp_rx_msg['id'] == ZpiCommand.ZB_START_REQUEST_SRSP):
-                rx_data = self._srsp_rx_msg
-                self._is_srsp_arrived.clear()
-
-                if rx_data is not None:
-                    return self._zb_start_request_srsp_handler(rx_data)
-                else:
-                    raise AreqTimeoutException('Wait for %s timeout.' %
-                                               ZpiCommand.ZB_START_REQUEST_SRSP)
+        return self._sreq(ZpiCommand.ZB_START_REQUEST,
+                          self._zb_start_request_srsp_handler)
 
     def _zb_start_request_srsp_handler(self, rx_data):
         """ handle the start reuqest srsp """
@@ -490,14 +953,10 @@ class Zpi(Znp):
 
     def zb_permit_joining_request(self, dst_addr, timeout):
         """ send SAPI zb permit joining request"""
-        self._srsp_event_clear(ZpiCommand.ZB_PERMIT_JOINING_REQUEST_SRSP)
-        self.send(ZpiCommand.ZB_PERMIT_JOINING_REQUEST,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  timeout = struct.pack('<B', timeout))
-        if self._srsp_event_wait(ZpiCommand.ZB_PERMIT_JOINING_REQUEST_SRSP):
-            return self._zb_permit_joinning_request_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZB_PERMIT_JOINING_REQUEST,
+                          self._zb_permit_joinning_request_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          timeout = struct.pack('<B', timeout))
 
     def _zb_permit_joinning_request_srsp_handler(self, rx_data):
         """ handler of zb_permit_joining_request srsp """
@@ -515,17 +974,11 @@ class Zpi(Znp):
         if action not in (BindAction.DELETE_BIND, BindAction.CREATE_BIND):
             raise ValueError('Invalid action value: %s' % repr(action))
 
-        self._srsp_event_clear(ZpiCommand.ZB_BIND_DEVICE_SRSP)
-
-        self.send(ZpiCommand.ZB_BIND_DEVICE,
-                  create = struct.pack('<B', action),
-                  cmd_id = struct.pack('<H', cmd_id),
-                  dst_addr_long = struct.pack('<Q', dst_addr_long))
-
-        if self._srsp_event_wait(ZpiCommand.ZB_BIND_DEVICE_SRSP):
-            return self._zb_bind_device_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZB_BIND_DEVICE,
+                          self._zb_bind_device_srsp_handler,
+                          create = struct.pack('<B', action),
+                          cmd_id = struct.pack('<H', cmd_id),
+                          dst_addr_long = struct.pack('<Q', dst_addr_long))
 
     def _zb_bind_device_srsp_handler(self, rx_data):
         """ SRSP handler for ZB_BIND_DEVICE """
@@ -555,14 +1008,9 @@ class Zpi(Znp):
                       0: disable allow binding mode.
                       >64: indefinitely allow binding
         """
-        self._srsp_event_clear(ZpiCommand.ZB_ALLOW_BIND_SRSP)
-        self.send(ZpiCommand.ZB_ALLOW_BIND,
-                  timeout = struct.pack('<B', timeout))
-        if self._srsp_event_wait(ZpiCommand.ZB_ALLOW_BIND_SRSP):
-            return self._zb_allow_bind_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException('Wait for %s timeout.' %
-                                       ZpiCommand.ZB_ALLOW_BIND_SRSP)
+        return self._sreq(ZpiCommand.ZB_ALLOW_BIND,
+                          self._zb_allow_bind_srsp_handler,
+                          timeout = struct.pack('<B', timeout))
 
     def _zb_allow_bind_srsp_handler(self, rx_data):
         """ SRSP handler for ZB_ALLOW_BIND """
@@ -584,16 +1032,12 @@ class Zpi(Znp):
     def zb_send_data_request(self, dst_addr_short, cmd_id, handle, tx_options,
                              radius, payload = ''):
         """ send data to the default registered endpoint on dst device """
-        self._srsp_event_clear(ZpiCommand.ZB_SEND_DATA_REQUEST_SRSP)
-        self.send(ZpiCommand.ZB_SEND_DATA_REQUEST,
-                  dst_addr_short = struct.pack('<H', dst_addr_short),
-                  cmd_id = struct.pack('<H', cmd_id),
-                  len = struct.pack('<B', len(payload)),
-                  data = payload)
-        if self._srsp_event_wait(ZpiCommand.ZB_SEND_DATA_REQUEST_SRSP):
-            return self._zb_send_data_request_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZB_SEND_DATA_REQUEST,
+                          self._zb_send_data_request_srsp_handler,
+                          dst_addr_short = struct.pack('<H', dst_addr_short),
+                          cmd_id = struct.pack('<H', cmd_id),
+                          len = struct.pack('<B', len(payload)),
+                          data = payload)
 
     def _zb_send_data_request_srsp_handler(self, rx_data):
         """ handler for ZB_SEND_DATA_REQUEST SRSP"""
@@ -624,15 +1068,11 @@ class Zpi(Znp):
     def zb_get_device_info(self, param):
         """ get the device information """
         if param in DeviceInfoParameter.params_len:
-            #first clear event before sending
-            self._srsp_event_clear(ZpiCommand.ZB_GET_DEVICE_INFO_SRSP)
-            self.send(ZpiCommand.ZB_GET_DEVICE_INFO,
-                      param = struct.pack('<B', param))
             #use a little long timeout to avoid timeout exception
-            if self._srsp_event_wait(ZpiCommand.ZB_GET_DEVICE_INFO_SRSP, timeout = 0.300):
-                return self._zb_get_dvice_info_srsp_handler(self._srsp_rx_msg)
-            else:
-                raise SrspTimeoutException()
+            return self._sreq(ZpiCommand.ZB_GET_DEVICE_INFO,
+                              self._zb_get_dvice_info_srsp_handler,
+                              srsp_timeout = 0.300,
+                              param = struct.pack('<B', param))
 
     def _zb_get_dvice_info_srsp_handler(self, rx_data):
         """ handle the get device info srsp """
@@ -680,21 +1120,17 @@ class Zpi(Znp):
         for out_cluster in out_clusters:
             out_cluster_list += struct.pack('<H', out_cluster)
 
-        self._srsp_event_clear(ZpiCommand.AF_REGISTER_SRSP)
-        self.send(ZpiCommand.AF_REGISTER,
-                  endpoint = struct.pack('<B', endpoint),
-                  profile_id = struct.pack('<H', profile_id),
-                  device_id = struct.pack('<H', device_id),
-                  device_ver = struct.pack('<B', device_ver<<4),
-                  latency_req = struct.pack('<B', latency_req),
-                  in_cluster_num = struct.pack('<B', len(in_clusters)),
-                  in_cluster_list = in_cluster_list,
-                  out_cluster_num = struct.pack('<B', len(out_clusters)),
-                  out_cluster_list = out_cluster_list)
-        if self._srsp_event_wait(ZpiCommand.AF_REGISTER_SRSP):
-            return self._af_register_srsp_handler(self._srsp_rx_msg)
-        else:
-            return SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_REGISTER,
+                          self._af_register_srsp_handler,
+                          endpoint = struct.pack('<B', endpoint),
+                          profile_id = struct.pack('<H', profile_id),
+                          device_id = struct.pack('<H', device_id),
+                          device_ver = struct.pack('<B', device_ver<<4),
+                          latency_req = struct.pack('<B', latency_req),
+                          in_cluster_num = struct.pack('<B', len(in_clusters)),
+                          in_cluster_list = in_cluster_list,
+                          out_cluster_num = struct.pack('<B', len(out_clusters)),
+                          out_cluster_list = out_cluster_list)
 
     def _af_register_srsp_handler(self, rx_data):
         """ handler of AF_REGISTER SRSP """
@@ -710,21 +1146,17 @@ class Zpi(Znp):
         if data is None:
             data = b''
 
-        self._srsp_event_clear(ZpiCommand.AF_DATA_REQUEST_SRSP)
-        self.send(ZpiCommand.AF_DATA_REQUEST,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  dst_ep = struct.pack('<B', dst_ep),
-                  src_ep = struct.pack('<B', src_ep),
-                  cluster_id = struct.pack('<H', cluster_id),
-                  trans_id = struct.pack('<B', trans_id),
-                  options = struct.pack('<B', options),
-                  radius = struct.pack('<B', radius),
-                  len = struct.pack('<B', len(data)),
-                  data = data)
-        if self._srsp_event_wait(ZpiCommand.AF_DATA_REQUEST_SRSP):
-            return self._af_data_request_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_DATA_REQUEST,
+                          self._af_data_request_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          dst_ep = struct.pack('<B', dst_ep),
+                          src_ep = struct.pack('<B', src_ep),
+                          cluster_id = struct.pack('<H', cluster_id),
+                          trans_id = struct.pack('<B', trans_id),
+                          options = struct.pack('<B', options),
+                          radius = struct.pack('<B', radius),
+                          len = struct.pack('<B', len(data)),
+                          data = data)
 
     def _af_data_request_srsp_handler(self, rx_data):
         """ handler of AF_DATA_REQUEST SRSP """
@@ -746,23 +1178,19 @@ class Zpi(Znp):
         if data is None:
             data = b''
 
-        self._srsp_event_clear(ZpiCommand.AF_DATA_REQUEST_EXT_SRSP)
-        self.send(ZpiCommand.AF_DATA_REQUEST_EXT,
-                  dst_addr_mode = struct.pack('<B', dst_addr_mode),
-                  dst_addr = struct.pack('<Q', dst_addr),
-                  dst_ep = struct.pack('<B', dst_ep),
-                  dst_pan_id = struct.pack('<H', dst_pan_id),
-                  src_ep = struct.pack('<B', src_ep),
-                  cluster_id = struct.pack('<H', cluster_id),
-                  trans_id = struct.pack('<B', trans_id),
-                  options = struct.pack('<B', options),
-                  radius = struct.pack('<B', radius),
-                  len = struct.pack('<H', len(data)),
-                  data = data)
-        if self._srsp_event_wait(ZpiCommand.AF_DATA_REQUEST_EXT_SRSP):
-            return self._af_data_request_ext_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_DATA_REQUEST_EXT,
+                          self._af_data_request_ext_srsp_handler,
+                          dst_addr_mode = struct.pack('<B', dst_addr_mode),
+                          dst_addr = struct.pack('<Q', dst_addr),
+                          dst_ep = struct.pack('<B', dst_ep),
+                          dst_pan_id = struct.pack('<H', dst_pan_id),
+                          src_ep = struct.pack('<B', src_ep),
+                          cluster_id = struct.pack('<H', cluster_id),
+                          trans_id = struct.pack('<B', trans_id),
+                          options = struct.pack('<B', options),
+                          radius = struct.pack('<B', radius),
+                          len = struct.pack('<H', len(data)),
+                          data = data)
 
     def _af_data_request_ext_srsp_handler(self, rx_data):
         """ handler of AF_DATA_REQUEST_EXT SRSP """
@@ -777,7 +1205,7 @@ class Zpi(Znp):
                                 data = None):
         """ build and send a message through AF layer using source routing """
         if data is None:
-            data = []
+            data = b''
 
         if relays is None:
             relays = []
@@ -785,23 +1213,19 @@ class Zpi(Znp):
         for relay in relays:
             relay_list += struct.pack('<H', relay)
 
-        self._srsp_event_clear(ZpiCommand.AF_DATA_REQUEST_SRC_RTG_SRSP)
-        self.send(ZpiCommand.AF_DATA_REQUEST_SRC_RTG,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  dst_ep = struct.pack('<B', dst_ep),
-                  src_ep = struct.pack('<B', src_ep),
-                  cluster_id = struct.pack('<H', cluster_id),
-                  trans_id = struct.pack('B', trans_id),
-                  options = struct.pack('B', options),
-                  radius = struct.pack('B', radius),
-                  relay_cnt = struct.pack('B', len(relays)),
-                  relay_list = relay_list,
-                  len = struct.pack('B', len(data)),
-                  data = data)
-        if self._srsp_event_wait(ZpiCommand.AF_DATA_REQUEST_SRC_RTG_SRSP):
-            return self._af_data_request_src_rtg_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_DATA_REQUEST_SRC_RTG,
+                          self._af_data_request_src_rtg_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          dst_ep = struct.pack('<B', dst_ep),
+                          src_ep = struct.pack('<B', src_ep),
+                          cluster_id = struct.pack('<H', cluster_id),
+                          trans_id = struct.pack('B', trans_id),
+                          options = struct.pack('B', options),
+                          radius = struct.pack('B', radius),
+                          relay_cnt = struct.pack('B', len(relays)),
+                          relay_list = relay_list,
+                          len = struct.pack('B', len(data)),
+                          data = data)
 
     def _af_data_request_src_rtg_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.AF_DATA_REQUEST_SRC_RTG_SRSP:
@@ -810,16 +1234,27 @@ class Zpi(Znp):
             raise ValueError('Invalid Rx frame! Expected: %s, Received: %s' % (
                     ZpiCommand.AF_DATA_REQUEST_SRC_RTG_SRSP, rx_data['id']))
 
+    def af_data_request_auto_route(self, dst_addr, dst_ep, src_ep, cluster_id,
+                                   trans_id, options, radius, data = None):
+        """
+            send a message through AF layer, with AF_DATA_REQUEST_SRC_RTG if
+            a source route to dst_addr is cached, else with AF_DATA_REQUEST
+        """
+        relays = self.source_routes.get(dst_addr)
+        if relays is not None:
+            return self.af_data_request_src_rtg(dst_addr, dst_ep, src_ep,
+                                                cluster_id, trans_id, options,
+                                                radius, relays, data)
+
+        return self.af_data_request(dst_addr, dst_ep, src_ep, cluster_id,
+                                    trans_id, options, radius, data)
+
     def af_inter_pan_ctl(self, command, data):
         """ INTER_PAN control """
-        self._srsp_event_clear(ZpiCommand.AF_INTER_PAN_CTRL_SRSP)
-        self.send(ZpiCommand.AF_INTER_PAN_CTRL,
-                  command = struct.pack('<B', command),
-                  data = InterPanCtlCommand.data_pack(command, data))
-        if self._srsp_event_wait(ZpiCommand.AF_INTER_PAN_CTRL_SRSP):
-            return self._af_inter_pan_ctl_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_INTER_PAN_CTRL,
+                          self._af_inter_pan_ctl_srsp_handler,
+                          command = struct.pack('<B', command),
+                          data = InterPanCtlCommand.data_pack(command, data))
 
     def _af_inter_pan_ctl_srsp_handler(self, rx_data):
         """ handler of AF_INTER_PAN_CTL SRSP """
@@ -836,15 +1271,11 @@ class Zpi(Znp):
         """
         if data is None:
             data = b''
-        self._srsp_event_clear(ZpiCommand.AF_DATA_STORE_SRSP)
-        self.send(ZpiCommand.AF_DATA_STORE,
-                  index = struct.pack('<H', index),
-                  len = struct.pack('<B', len(data)),
-                  data = data)
-        if self._srsp_event_wait(ZpiCommand.AF_DATA_STORE_SRSP):
-            return self._af_data_store_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_DATA_STORE,
+                          self._af_data_store_srsp_handler,
+                          index = struct.pack('<H', index),
+                          len = struct.pack('<B', len(data)),
+                          data = data)
 
     def _af_data_store_srsp_handler(self, rx_data):
         """ handler of AF_DATA_STORE SRSP """
@@ -869,24 +1300,16 @@ class Zpi(Znp):
     def af_incoming_msg_handler(self, rx_data):
         """ handler of AF_INCOMING_MSG """
         if rx_data['id'] == ZpiCommand.AF_INCOMING_MSG:
-            group_id = struct.unpack('<H', rx_data['group_id'])[0]
-            cluster_id = struct.unpack('<H', rx_data['cluster_id'])[0]
-            src_addr = struct.unpack('<H', rx_data['src_addr'])[0]
-            src_ep = struct.unpack('<B', rx_data['src_ep'])[0]
-            dst_ep = struct.unpack('<B', rx_data['dst_ep'])[0]
-            was_broadcast = struct.unpack('<B', rx_data['was_broadcast'])[0]
-            lqi = struct.unpack('<B', rx_data['lqi'])[0]
-            security_use = struct.unpack('<B', rx_data['security_use'])[0]
-            time_stamp = struct.unpack('<L', rx_data['time_stamp'])[0]
-            trans_seq = struct.unpack('<B', rx_data['trans_seq'])[0]
-            data_len = struct.unpack('<B', rx_data['len'])[0]
-            data = rx_data['data']
+            fields = self._typed_fields(rx_data)
+            data = fields['data']
 
-            if data_len != len(data):
+            if fields['len'] != len(data):
                 raise ValueError('"len" field is not equal to length of data!')
 
-            return (group_id, cluster_id, src_addr, src_ep, dst_ep, was_broadcast,
-                    lqi, security_use, time_stamp, trans_seq, data)
+            return (fields['group_id'], fields['cluster_id'], fields['src_addr'],
+                    fields['src_ep'], fields['dst_ep'], fields['was_broadcast'],
+                    fields['lqi'], fields['security_use'], fields['time_stamp'],
+                    fields['trans_seq'], data)
         else:
             raise ValueError('Invalid Rx frame! Expected: %s, Received: %s' % (
                     ZpiCommand.AF_INCOMING_MSG, rx_data['id']))
@@ -894,27 +1317,18 @@ class Zpi(Znp):
     def af_incoming_msg_ext_handler(self, rx_data):
         """ handler of AF_INCOMING_MSG_EXT """
         if rx_data['id'] == ZpiCommand.AF_INCOMING_MSG_EXT:
-            group_id = struct.unpack('<H', rx_data['group_id'])[0]
-            cluster_id = struct.unpack('<H', rx_data['cluster_id'])[0]
-            src_addr_mode = struct.unpack('<B', rx_data['src_addr_mode'])[0]
-            src_addr = struct.unpack('<Q', rx_data['src_addr'])[0]
-            src_ep = struct.unpack('<B', rx_data['src_ep'])[0]
-            src_pan_id = struct.unpack('<H', rx_data['src_pan_id'])[0]
-            dst_ep = struct.unpack('<B', rx_data['dst_ep'])[0]
-            was_broadcast = struct.unpack('<B', rx_data['was_broadcast'])[0]
-            lqi = struct.unpack('<B', rx_data['lqi'])[0]
-            security_use = struct.unpack('<B', rx_data['security_use'])[0]
-            time_stamp = struct.unpack('<L', rx_data['time_stamp'])[0]
-            trans_seq = struct.unpack('<B', rx_data['trans_seq'])[0]
-            data_len = struct.unpack('<B', rx_data['len'])[0]
-            data = rx_data['data']
+            fields = self._typed_fields(rx_data)
+            data = fields['data']
 
-            if data_len != len(data):
+            if fields['len'] != len(data):
                 raise ValueError('"len" field is not equal to length of data!')
 
-            return (group_id, cluster_id, src_addr_mode, src_addr, src_ep,
-                    src_pan_id, dst_ep, was_broadcast, lqi, security_use,
-                    time_stamp, trans_seq, data)
+            return (fields['group_id'], fields['cluster_id'],
+                    fields['src_addr_mode'], fields['src_addr'], fields['src_ep'],
+                    fields['src_pan_id'], fields['dst_ep'],
+                    fields['was_broadcast'], fields['lqi'],
+                    fields['security_use'], fields['time_stamp'],
+                    fields['trans_seq'], data)
         else:
             raise ValueError('Invalid Rx frame! Expected: %s, Received: %s' % (
                     ZpiCommand.AF_INCOMING_MSG_EXT, rx_data['id']))
@@ -924,38 +1338,38 @@ class Zpi(Znp):
             this function is used for receiving large packets that use APS
             fragmentation for over-the-air reception
         """
-        self._srsp_event_clear(ZpiCommand.AF_DATA_RETRIEVE_SRSP)
-        self.send(ZpiCommand.AF_DATA_RETRIEVE,
-                  time_stamp = struct.pack('<L', time_stamp),
-                  index = struct.pack('<H', index),
-                  length = struct.pack('<B', length))
-        if self._srsp_event_wait(ZpiCommand.AF_DATA_RETRIEVE_SRSP):
-            return self._af_data_retrieve_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_DATA_RETRIEVE,
+                          self._af_data_retrieve_srsp_handler,
+                          time_stamp = struct.pack('<L', time_stamp),
+                          index = struct.pack('<H', index),
+                          len = struct.pack('<B', length))
 
     def _af_data_retrieve_srsp_handler(self, rx_data):
-        """ handler of AF_DATA_RETRIEVE SRSP """
+        """ handler of AF_DATA_RETRIEVE SRSP, return (status, data) """
         if rx_data['id'] == ZpiCommand.AF_DATA_RETRIEVE_SRSP:
-            return struct.unpack('<B', rx_data['status'])[0]
+            fields = self._typed_fields(rx_data)
+            return fields['status'], fields['data']
         else:
             raise ValueError('Invalid Rx frame! Expected: %s, Received: %s' % (
                     ZpiCommand.AF_DATA_RETRIEVE_SRSP, rx_data['id']))
 
+    @staticmethod
+    def _check_status(zpi_cmd, status):
+        """ raise ZpiStatusException for a status other than Z_SUCCESS """
+        if status != ZpiStatus.Z_SUCCESS:
+            raise ZpiStatusException('%s failed: %s' % (
+                zpi_cmd, ZpiStatus.status_names.get(status, status)), status)
+
     def af_apsf_config_set(self, endpoint, frame_delay, window_size):
         """
             change the default APS fragmentation configuration setting for a
             specific endpoint
         """
-        self._srsp_event_clear(ZpiCommand.AF_APSF_CONFIG_SET_SRSP)
-        self.send(ZpiCommand.AF_APSF_CONFIG_SET,
-                  endpoint = struct.pack('<B', endpoint),
-                  frame_delay = struct.pack('<B', frame_delay),
-                  window_size = struct.pack('<B', window_size))
-        if self._srsp_event_wait(ZpiCommand.AF_APSF_CONFIG_SET_SRSP):
-            return self._af_apsf_config_set_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.AF_APSF_CONFIG_SET,
+                          self._af_apsf_config_set_srsp_handler,
+                          endpoint = struct.pack('<B', endpoint),
+                          frame_delay = struct.pack('<B', frame_delay),
+                          window_size = struct.pack('<B', window_size))
 
     def _af_apsf_config_set_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.AF_APSF_CONFIG_SET_SRSP:
@@ -967,15 +1381,11 @@ class Zpi(Znp):
     #ZDO interface
     def zdo_nwk_addr_req(self, ieee_addr, req_type, start_index):
         """ request the device to send a Network Address Request. """
-        self._srsp_event_clear(ZpiCommand.ZDO_NWK_ADDR_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_NWK_ADDR_REQ,
-                  ieee_addr = struct.pack('<Q', ieee_addr),
-                  req_type = struct.pack('<B', req_type),
-                  start_index = struct.pack('<B', start_index))
-        if self._srsp_event_wait(ZpiCommand.ZDO_NWK_ADDR_REQ_SRSP):
-            return self._zdo_nwk_addr_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_NWK_ADDR_REQ,
+                          self._zdo_nwk_addr_req_srsp_handler,
+                          ieee_addr = struct.pack('<Q', ieee_addr),
+                          req_type = struct.pack('<B', req_type),
+                          start_index = struct.pack('<B', start_index))
 
     def _zdo_nwk_addr_req_srsp_handler(self, rx_data):
         """ handler of ZDO_NWK_ADDR_REQ SRSP """
@@ -993,10 +1403,11 @@ class Zpi(Znp):
             nwk_addr = struct.unpack('<H', rx_data['nwk_addr'])[0]
             start_index = struct.unpack('<B', rx_data['start_index'])[0]
             assoc_dev_num = struct.unpack('<B', rx_data['assoc_dev_num'])[0]
-            assoc_dev_list = rx_data['assoc_dev_list']
+            #the empty list of a response without associated devices is omitted
+            assoc_dev_list = rx_data.get('assoc_dev_list', b'')
 
             assoc_dev = []
-            for assoc_dev_index in range(0, assoc_dev_num*2, 2):
+            for assoc_dev_index in range(0, len(assoc_dev_list), 2):
                 assoc_dev.append(struct.unpack('<H',
                     assoc_dev_list[assoc_dev_index:(assoc_dev_index + 2)])[0])
 
@@ -1007,15 +1418,13 @@ class Zpi(Znp):
 
     def zdo_ieee_addr_req(self, nwk_addr, req_type = 0, start_index = 0):
         """ request the device to send a IEEE Address Request. """
-        self._srsp_event_clear(ZpiCommand.ZDO_IEEE_ADDR_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_IEEE_ADDR_REQ,
-                  nwk_addr = struct.pack('<H', nwk_addr),
-                  req_type = struct.pack('<B', req_type),
-                  start_index = struct.pack('<B', start_index))
-        if self._srsp_event_wait(ZpiCommand.ZDO_IEEE_ADDR_REQ_SRSP, 0.500): #sometimes default value not enough
-            return self._zdo_ieee_addr_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        #sometimes default value not enough
+        return self._sreq(ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                          self._zdo_ieee_addr_req_srsp_handler,
+                          srsp_timeout = 0.500,
+                          nwk_addr = struct.pack('<H', nwk_addr),
+                          req_type = struct.pack('<B', req_type),
+                          start_index = struct.pack('<B', start_index))
 
     def _zdo_ieee_addr_req_srsp_handler(self, rx_data):
         """ handler of ZDO_IEEE_ADDR_REQ SRSP """
@@ -1053,14 +1462,10 @@ class Zpi(Znp):
             inquire about the Node Descriptor information of the destination
             device.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_NODE_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_NODE_DESC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
-        if self._srsp_event_wait(ZpiCommand.ZDO_NODE_DESC_REQ_SRSP):
-            return self._zdo_node_desc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_NODE_DESC_REQ,
+                          self._zdo_node_desc_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
 
     def _zdo_node_desc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_NODE_DESC_REQ SRSP """
@@ -1099,14 +1504,10 @@ class Zpi(Znp):
             inquire about the Power Descriptor information of the destination
             device.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_POWER_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_POWER_DESC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
-        if self._srsp_event_wait(ZpiCommand.ZDO_POWER_DESC_REQ_SRSP):
-            return self._zdo_power_desc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_POWER_DESC_REQ,
+                          self._zdo_power_desc_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
 
     def _zdo_power_desc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_NODE_DESC_REQ SRSP """
@@ -1135,15 +1536,12 @@ class Zpi(Znp):
             inquire about the Simple Descriptor information of the destination
             device's endpoint
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_SIMPLE_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_SIMPLE_DESC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest),
-                  endpoint = struct.pack('<B', endpoint))
-        if self._srsp_event_wait(ZpiCommand.ZDO_SIMPLE_DESC_REQ_SRSP, 1.0):
-            return self._zdo_simple_desc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_SIMPLE_DESC_REQ,
+                          self._zdo_simple_desc_req_srsp_handler,
+                          srsp_timeout = 1.0,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest),
+                          endpoint = struct.pack('<B', endpoint))
 
     def _zdo_simple_desc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_SIMPLE_DESC_REQ SRSP """
@@ -1191,14 +1589,10 @@ class Zpi(Znp):
         """
             request a list of active endpoints from the destination device.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_ACTIVE_EP_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_ACTIVE_EP_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
-        if self._srsp_event_wait(ZpiCommand.ZDO_ACTIVE_EP_REQ_SRSP):
-            return self._zdo_active_ep_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_ACTIVE_EP_REQ,
+                          self._zdo_active_ep_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
 
     def _zdo_active_ep_req_srsp_handler(self, rx_data):
         """ handler of ZDO_ACTIVE_EP_REQ SRSP """
@@ -1245,19 +1639,15 @@ class Zpi(Znp):
         for out_cluster in out_clusters:
             out_cluster_list += struct.pack('<H', out_cluster)
 
-        self._srsp_event_clear(ZpiCommand.ZDO_MATCH_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MATCH_DESC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest),
-                  profile_id = struct.pack('<H', profile_id),
-                  in_cluster_num = struct.pack('<B', len(in_clusters)),
-                  in_cluster_list = in_cluster_list,
-                  out_cluster_num = struct.pack('<B', len(out_clusters)),
-                  out_cluster_list = out_cluster_list)
-        if self._srsp_event_wait(ZpiCommand.ZDO_MATCH_DESC_REQ_SRSP):
-            return self._zdo_match_desc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MATCH_DESC_REQ,
+                          self._zdo_match_desc_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest),
+                          profile_id = struct.pack('<H', profile_id),
+                          in_cluster_num = struct.pack('<B', len(in_clusters)),
+                          in_cluster_list = in_cluster_list,
+                          out_cluster_num = struct.pack('<B', len(out_clusters)),
+                          out_cluster_list = out_cluster_list)
 
     def _zdo_match_desc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_ACTIVE_EP_REQ SRSP """
@@ -1319,14 +1709,10 @@ class Zpi(Znp):
 
     def zdo_complex_desc_req(self, dst_addr, nwk_addr_of_interest):
         """ request the destination device's complex descriptor """
-        self._srsp_event_clear(ZpiCommand.ZDO_COMPLEX_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_COMPLEX_DESC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
-        if self._srsp_event_wait(ZpiCommand.ZDO_COMPLEX_DESC_REQ_SRSP):
-            return self._zdo_complex_desc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_COMPLEX_DESC_REQ,
+                          self._zdo_complex_desc_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
 
     def _zdo_complex_desc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_COMPLEX_DESC_REQ  SRSP """
@@ -1353,14 +1739,10 @@ class Zpi(Znp):
                     ZpiCommand.ZDO_COMPLEX_DESC_RSP, rx_data['id']))
 
     def zdo_user_desc_req(self, dst_addr, nwk_addr_of_interest):
-        self._srsp_event_clear(ZpiCommand.ZDO_USER_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_USER_DESC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
-        if self._srsp_event_wait(ZpiCommand.ZDO_USER_DESC_REQ_SRSP):
-            return self._zdo_user_desc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_USER_DESC_REQ,
+                          self._zdo_user_desc_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest))
 
     def _zdo_user_desc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_ACTIVE_EP_REQ SRSP """
@@ -1401,15 +1783,11 @@ class Zpi(Znp):
             request the ZNP device to issue a Devive Announce broadcast packet
             to the network
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_DEVICE_ANNCE_SRSP)
-        self.send(ZpiCommand.ZDO_DEVICE_ANNCE,
-                  nwk_addr = struct.pack('<H', nwk_addr),
-                  ieee_addr = struct.pack('<H', ieee_addr),
-                  capabilities = struct.pack('<B', capabilities))
-        if self._srsp_event_wait(ZpiCommand.ZDO_DEVICE_ANNCE_SRSP):
-            return self._zdo_device_annce_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_DEVICE_ANNCE,
+                          self._zdo_device_annce_srsp_handler,
+                          nwk_addr = struct.pack('<H', nwk_addr),
+                          ieee_addr = struct.pack('<H', ieee_addr),
+                          capabilities = struct.pack('<B', capabilities))
 
     def _zdo_device_annce_srsp_handler(self, rx_data):
         """ handler of ZDO_ACTIVE_EP_REQ SRSP """
@@ -1421,16 +1799,12 @@ class Zpi(Znp):
 
     def zdo_user_desc_set(self, dst_addr, nwk_addr_of_interest, user_descriptor):
         """ write a User Descriptor value to the target device """
-        self._srsp_event_clear(ZpiCommand.ZDO_USER_DESC_SET_SRSP)
-        self.send(ZpiCommand.ZDO_USER_DESC_SET,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest),
-                  len = struct.pack('<B', len(user_descriptor)),
-                  user_descriptor = user_descriptor)
-        if self._srsp_event_wait(ZpiCommand.ZDO_USER_DESC_SET_SRSP):
-            return self._zdo_user_desc_set_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_USER_DESC_SET,
+                          self._zdo_user_desc_set_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          nwk_addr_of_interest = struct.pack('<H', nwk_addr_of_interest),
+                          len = struct.pack('<B', len(user_descriptor)),
+                          user_descriptor = user_descriptor)
 
     def _zdo_user_desc_set_srsp_handler(self, rx_data):
         """ handler of ZDO_USER_DESC_SET SRSP """
@@ -1446,13 +1820,9 @@ class Zpi(Znp):
             indicated by server_mask parameter. The destination addressing on
             this request is broadcasted to all RxOnWhenIdle devices.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_SERVER_DESC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_SERVER_DESC_REQ,
-                  server_mask=struct.pack('<H', server_mask))
-        if self._srsp_event_wait(ZpiCommand.ZDO_SERVER_DESC_REQ_SRSP):
-            return self._zdo_server_disc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_SERVER_DESC_REQ,
+                          self._zdo_server_disc_req_srsp_handler,
+                          server_mask=struct.pack('<H', server_mask))
 
     def _zdo_server_disc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_SERVER_DISC_REQ SRSP """
@@ -1488,21 +1858,17 @@ class Zpi(Znp):
         for out_cluster in out_clusters:
             out_cluster_list += struct.pack('<H', out_cluster)
 
-        self._srsp_event_clear(ZpiCommand.ZDO_END_DEVICE_BIND_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_END_DEVICE_BIND_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  local_coordinator = struct.pack('<H', local_coordinator),
-                  ieee = struct.pack('<Q', local_coordinator_ieee_addr),
-                  endpoint = struct.pack('<B', endpoint),
-                  profile_id = struct.pack('<H', profile_id),
-                  in_cluster_num = struct.pack('<B', len(in_clusters)),
-                  in_cluster_list = in_cluster_list,
-                  out_cluster_num = struct.pack('<B', len(out_clusters)),
-                  out_cluster_list = out_cluster_list)
-        if self._srsp_event_wait(ZpiCommand.ZDO_END_DEVICE_BIND_REQ_SRSP):
-            return self._zdo_end_device_bind_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_END_DEVICE_BIND_REQ,
+                          self._zdo_end_device_bind_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          local_coordinator = struct.pack('<H', local_coordinator),
+                          ieee = struct.pack('<Q', local_coordinator_ieee_addr),
+                          endpoint = struct.pack('<B', endpoint),
+                          profile_id = struct.pack('<H', profile_id),
+                          in_cluster_num = struct.pack('<B', len(in_clusters)),
+                          in_cluster_list = in_cluster_list,
+                          out_cluster_num = struct.pack('<B', len(out_clusters)),
+                          out_cluster_list = out_cluster_list)
 
     def _zdo_end_device_bind_req_srsp_handler(self, rx_data):
         """ handler of ZDO_END_DEVICE_BIND_REQ SRSP """
@@ -1524,19 +1890,15 @@ class Zpi(Znp):
     def zdo_bind_req(self, dst_addr, src_addr, src_ep, cluster_id,
                      bind_addr_mode, bind_addr, bind_ep):
         """ request a bind """
-        self._srsp_event_elear(ZpiCommand.ZDO_BIND_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_BIND_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  src_addr = struct.pack('<Q', src_addr),
-                  src_ep = struct.pack('<B', src_ep),
-                  cluster_id = struct.pack('<H', cluster_id),
-                  bind_addr_mode = struct.pack('<H', bind_addr_mode),
-                  bind_addr = struct.pack('<Q', bind_addr),
-                  bind_ep = struct.pack('<B', bind_ep))
-        if self._srsp_event_wait(ZpiCommand.ZDO_BIND_REQ_SRSP):
-            return self._zdo_bind_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_BIND_REQ,
+                          self._zdo_bind_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          src_addr = struct.pack('<Q', src_addr),
+                          src_ep = struct.pack('<B', src_ep),
+                          cluster_id = struct.pack('<H', cluster_id),
+                          bind_addr_mode = struct.pack('<H', bind_addr_mode),
+                          bind_addr = struct.pack('<Q', bind_addr),
+                          bind_ep = struct.pack('<B', bind_ep))
 
     def _zdo_bind_req_srsp_handler(self, rx_data):
         """ handler of ZDO_END_DEVICE_BIND_REQ SRSP """
@@ -1558,19 +1920,15 @@ class Zpi(Znp):
     def zdo_unbind_req(self, dst_addr, src_addr, src_ep, cluster_id,
                        bind_addr_mode, bind_addr,bind_ep ):
         """ request a Unbind """
-        self._srsp_event_clear(ZpiCommand.ZDO_UNBIND_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_UNBIND_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  src_addr = struct.pack('<Q', src_addr),
-                  src_ep = struct.pack('<B', src_ep),
-                  cluster_id = struct.pack('<H', cluster_id),
-                  bind_addr_mode = struct.pack('<H', bind_addr_mode),
-                  bind_addr = struct.pack('<Q', bind_addr),
-                  bind_ep = struct.pack('<B', bind_ep))
-        if self._srsp_event_wait(ZpiCommand.ZDO_UNBIND_REQ_SRSP):
-            return self._zdo_unbind_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_UNBIND_REQ,
+                          self._zdo_unbind_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          src_addr = struct.pack('<Q', src_addr),
+                          src_ep = struct.pack('<B', src_ep),
+                          cluster_id = struct.pack('<H', cluster_id),
+                          bind_addr_mode = struct.pack('<H', bind_addr_mode),
+                          bind_addr = struct.pack('<Q', bind_addr),
+                          bind_ep = struct.pack('<B', bind_ep))
 
     def _zdo_unbind_req_srsp_handler(self, rx_data):
         """ handler of ZDO_UNBIND_REQ SRSP """
@@ -1592,16 +1950,12 @@ class Zpi(Znp):
     def zdo_mgmt_nwk_disc_req(self, dst_addr, scan_channels, scan_duration,
                               start_index):
         """ request the destination device to perform a network discovery """
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_NWK_DISC_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_NWK_DISC_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  scan_channels = struct.pack('<L', scan_channels),
-                  scan_duration = struct.pack('<B', scan_duration),
-                  start_index = struct.pack('<B', start_index))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_NWK_DISC_REQ_SRSP):
-            return self._zdo_mgmt_nwk_disc_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_NWK_DISC_REQ,
+                          self._zdo_mgmt_nwk_disc_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          scan_channels = struct.pack('<L', scan_channels),
+                          scan_duration = struct.pack('<B', scan_duration),
+                          start_index = struct.pack('<B', start_index))
 
     def _zdo_mgmt_nwk_disc_req_srsp_handler(self, rx_data):
         """ handler of ZDO_MGMT_NWK_DISC_REQ SRSP """
@@ -1618,7 +1972,7 @@ class Zpi(Znp):
             nwk_cnt = struct.unpack('<B', rx_data['nwk_cnt'])[0]
             start_index = struct.unpack('<B', rx_data['start_index'])[0]
             nwk_list_cnt = struct.unpack('<B', rx_data['nwk_list_cnt'])[0]
-            nwk_list_records = rx_data['nwk_list_records']
+            nwk_list_records = rx_data.get('nwk_list_records', b'')
 
             nwk_records = []
             for record_index in range(0, nwk_list_cnt*6, 6):
@@ -1632,14 +1986,10 @@ class Zpi(Znp):
 
     def zdo_mgmt_lqi_req(self, dst_addr, start_index):
         """ request the destination device to return its neighbor table. """
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_LQI_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_LQI_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  start_index = struct.pack('<B', start_index))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_LQI_REQ_SRSP):
-            return self._zdo_mgmt_lqi_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_LQI_REQ,
+                          self._zdo_mgmt_lqi_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          start_index = struct.pack('<B', start_index))
 
     def _zdo_mgmt_lqi_req_srsp_handler(self, rx_data):
         """ handler of ZDO_MGMT_LQI_REQ SRSP """
@@ -1656,7 +2006,7 @@ class Zpi(Znp):
             nbr_table_entries = struct.unpack('<B', rx_data['nbr_table_entries'])[0]
             start_index = struct.unpack('<B', rx_data['start_index'])[0]
             nbr_table_list_cnt = struct.unpack('<B', rx_data['nbr_table_list_cnt'])[0]
-            nbr_table_list_records = rx_data['nbr_table_list_records']
+            nbr_table_list_records = rx_data.get('nbr_table_list_records', b'')
 
             nbr_table_records = []
             for record_index in range(0, nbr_table_list_cnt*22, 22):
@@ -1671,14 +2021,10 @@ class Zpi(Znp):
 
     def zdo_mgmt_rtg_req(self, dst_addr, start_index):
         """ request the routing table of the destination device"""
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_RTG_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_RTG_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  start_index = struct.pack('<B', start_index))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_RTG_REQ_SRSP):
-            return self._zdo_mgmt_rtg_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_RTG_REQ,
+                          self._zdo_mgmt_rtg_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          start_index = struct.pack('<B', start_index))
 
     def _zdo_mgmt_rtg_req_srsp_handler(self, rx_data):
         """ handler of the ZDO_MGMT_RTG_REQ SRSP """
@@ -1697,7 +2043,7 @@ class Zpi(Znp):
             start_index = struct.unpack('<B', rx_data['start_index'])[0]
             rtg_table_list_cnt = struct.unpack('<B',
                                                    rx_data['rtg_table_list_cnt'])[0]
-            rtg_table_list_records = rx_data['rtg_table_list_records']
+            rtg_table_list_records = rx_data.get('rtg_table_list_records', b'')
 
             rtg_table_records = []
             for record_index in range(0, rtg_table_list_cnt*5, 5):
@@ -1711,14 +2057,10 @@ class Zpi(Znp):
 
     def zdo_mgmt_bind_req(self, dst_addr, start_index):
         """ request the Binding Table of the destination device """
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_BIND_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_BIND_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  start_index = struct.pack('<B', start_index))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_BIND_REQ_SRSP):
-            return self._zdo_mgmt_bind_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_BIND_REQ,
+                          self._zdo_mgmt_bind_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          start_index = struct.pack('<B', start_index))
 
     def _zdo_mgmt_bind_req_srsp_handler(self, rx_data):
         """ handler of the ZDO_MGMT_BIND_REQ SRSP """
@@ -1737,7 +2079,7 @@ class Zpi(Znp):
             start_index = struct.unpack('<B', rx_data['start_index'])[0]
             binding_table_list_cnt = struct.unpack('<B',
                                                    rx_data['binding_table_list_cnt'])[0]
-            binding_table_list_records = rx_data['binding_table_list_records']
+            binding_table_list_records = rx_data.get('binding_table_list_records', b'')
 
             binding_table_records = []
             for record_index in range(0, binding_table_list_cnt*20, 20):
@@ -1754,15 +2096,11 @@ class Zpi(Znp):
             request a Management Leave Request for the target device and remove
             devices from the network
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_LEAVE_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_LEAVE_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  device_addr = struct.pack('<Q', device_addr),
-                  remove_children_rejoin = struct.pack('<B', remove_children_rejoin))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_LEAVE_REQ_SRSP):
-            return self._zdo_mgmt_leave_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_LEAVE_REQ,
+                          self._zdo_mgmt_leave_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          device_addr = struct.pack('<Q', device_addr),
+                          remove_children_rejoin = struct.pack('<B', remove_children_rejoin))
 
     def _zdo_mgmt_leave_req_srsp_handler(self, rx_data):
         """ handler of the ZDO_MGMT_BIND_REQ SRSP """
@@ -1783,15 +2121,11 @@ class Zpi(Znp):
 
     def zdo_mgmt_direct_join_req(self, dst_addr, device_addr, cap_info):
         """ request the Management Direct Join Request of a designated device"""
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_DIRECT_JOIN_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_DIRECT_JOIN_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  device_addr = struct.pack('<Q', device_addr),
-                  cap_info = struct.pack('<B', cap_info))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_DIRECT_JOIN_REQ_SRSP):
-            return self._zdo_mgmt_direct_join_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_DIRECT_JOIN_REQ,
+                          self._zdo_mgmt_direct_join_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          device_addr = struct.pack('<Q', device_addr),
+                          cap_info = struct.pack('<B', cap_info))
 
     def _zdo_mgmt_direct_join_req_srsp_handler(self, rx_data):
         """ handler of the ZDO_MGMT_DIRECT_JOIN_REQ  SRSP """
@@ -1813,16 +2147,12 @@ class Zpi(Znp):
 
     def zdo_mgmt_permit_join_req(self, dst_addr, duration, tc_significance):
         """ set the Permit Join for the destination device"""
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_PERMIT_JOIN_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_PERMIT_JOIN_REQ,
-                  addr_mode = struct.pack('<B', AddressMode.ADDRESS_16_BIT),   # 16-bit mode as default, moded for Z-Stack 2.6.1
-                  dst_addr = struct.pack('<H', dst_addr),
-                  duration = struct.pack('<B', duration),
-                  tc_significance = struct.pack('<B', tc_significance))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MGMT_PERMIT_JOIN_REQ_SRSP):
-            return self._zdo_mgmt_permit_join_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_PERMIT_JOIN_REQ,
+                          self._zdo_mgmt_permit_join_req_srsp_handler,
+                          addr_mode = struct.pack('<B', AddressMode.ADDRESS_16_BIT),   # 16-bit mode as default, moded for Z-Stack 2.6.1
+                          dst_addr = struct.pack('<H', dst_addr),
+                          duration = struct.pack('<B', duration),
+                          tc_significance = struct.pack('<B', tc_significance))
 
     def _zdo_mgmt_permit_join_req_srsp_handler(self, rx_data):
         """ handler of the ZDO_MGMT_PERMIT_JOIN_REQ SRSP """
@@ -1850,17 +2180,13 @@ class Zpi(Znp):
             information from devices on network conditions in the local operating
             environment.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_MGMT_NWK_UPDATE_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_MGMT_NWK_UPDATE_REQ,
-                  dst_addr = struct.pack('<H', dst_addr),
-                  dst_addr_mode = struct.pack('<B', dst_addr_mode),
-                  channel_mask = struct.pack('<L', channel_mask),
-                  scan_duration = struct.pack('<B', scan_duration),
-                  nwk_manager_addr = struct.pack('<H', nwk_manager_addr))
-        if self._srsp_event_set(ZpiCommand.ZDO_MGMT_NWK_UPDATE_REQ_SRSP):
-            return self._zdo_mgmt_nwk_update_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MGMT_NWK_UPDATE_REQ,
+                          self._zdo_mgmt_nwk_update_req_srsp_handler,
+                          dst_addr = struct.pack('<H', dst_addr),
+                          dst_addr_mode = struct.pack('<B', dst_addr_mode),
+                          channel_mask = struct.pack('<L', channel_mask),
+                          scan_duration = struct.pack('<B', scan_duration),
+                          nwk_manager_addr = struct.pack('<H', nwk_manager_addr))
 
     def _zdo_mgmt_nwk_update_req_srsp_handler(self, rx_data):
         """ handler of the ZDO_MGMT_NWK_UPDATE_REQ SRSP """
@@ -1872,14 +2198,11 @@ class Zpi(Znp):
 
     def zdo_start_from_app(self, start_delay = 0):
         """ start the device in the network"""
-        self._srsp_event_clear(ZpiCommand.ZDO_STARTUP_FROM_APP_SRSP)
-        self.send(ZpiCommand.ZDO_STARTUP_FROM_APP,
-                  start_delay = struct.pack('<H', start_delay))
         #it may take a bit long time for SRSP, typical 200ms ~ 400ms
-        if self._srsp_event_wait(ZpiCommand.ZDO_STARTUP_FROM_APP_SRSP, 1.000):
-            return self._zdo_start_from_app_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_STARTUP_FROM_APP,
+                          self._zdo_start_from_app_srsp_handler,
+                          srsp_timeout = 1.000,
+                          start_delay = struct.pack('<H', start_delay))
 
     def _zdo_start_from_app_srsp_handler(self, rx_data):
         """ handler of ZDO_START_FROM_APP SRSP.
@@ -1907,15 +2230,11 @@ class Zpi(Znp):
 
     def zdo_set_link_key(self, short_addr, ieee_addr, link_key_data):
         """ set the application or trust center link key for a given device """
-        self._srsp_event_clear(ZpiCommand.ZDO_SET_LINK_KEY_SRSP)
-        self.send(ZpiCommand.ZDO_SET_LINK_KEY,
-                  short_addr = struct.pack('<H', short_addr),
-                  ieee_addr = struct.pack('<Q', ieee_addr),
-                  link_key_data = link_key_data)
-        if self._srsp_event_wait(ZpiCommand.ZDO_SET_LINK_KEY_SRSP):
-            return self._zdo_set_link_key_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_SET_LINK_KEY,
+                          self._zdo_set_link_key_srsp_handler,
+                          short_addr = struct.pack('<H', short_addr),
+                          ieee_addr = struct.pack('<Q', ieee_addr),
+                          link_key_data = link_key_data)
 
     def _zdo_set_link_key_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.ZDO_SET_LINK_KEY_SRSP:
@@ -1926,13 +2245,9 @@ class Zpi(Znp):
 
     def zdo_remove_link_key(self, ieee_addr):
         """ remove the application or trust center link key of a given deive """
-        self._srsp_event_clear(ZpiCommand.ZDO_REMOVE_LINK_KEY_SRSP)
-        self.send(ZpiCommand.ZDO_REMOVE_LINK_KEY,
-                  ieee_addr = struct.pack('<Q', ieee_addr))
-        if self._srsp_event_wait(ZpiCommand.ZDO_REMOVE_LINK_KEY_SRSP):
-            return self._zdo_remove_link_key_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_REMOVE_LINK_KEY,
+                          self._zdo_remove_link_key_srsp_handler,
+                          ieee_addr = struct.pack('<Q', ieee_addr))
 
     def _zdo_remove_link_key_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.ZDO_REMOVE_LINK_KEY_SRSP:
@@ -1943,13 +2258,9 @@ class Zpi(Znp):
 
     def zdo_get_link_key(self, ieee_addr):
         """ get the application or trust center link key of a given deive """
-        self._srsp_event_clear(ZpiCommand.ZDO_GET_LINK_KEY_SRSP)
-        self.send(ZpiCommand.ZDO_GET_LINK_KEY,
-                  ieee_addr = struct.pack('<Q', ieee_addr))
-        if self._srsp_event_wait(ZpiCommand.ZDO_GET_LINK_KEY_SRSP):
-            return self._zdo_get_link_key_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_GET_LINK_KEY,
+                          self._zdo_get_link_key_srsp_handler,
+                          ieee_addr = struct.pack('<Q', ieee_addr))
 
     def _zdo_get_link_key_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.ZDO_GET_LINK_KEY_SRSP:
@@ -1960,14 +2271,10 @@ class Zpi(Znp):
 
     def zdo_nwk_discovery_req(self, scan_channels, scan_duration):
         """ initiate a Network Discovery (active scan) """
-        self._srsp_event_clear(ZpiCommand.ZDO_NWK_DISCOVERY_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_NWK_DISCOVERY_REQ,
-                  scan_channels = struct.pack('<L', scan_channels),
-                  scan_duration = struct.pack('<B', scan_duration))
-        if self._srsp_event_wait(ZpiCommand.ZDO_NWK_DISCOVERY_REQ_SRSP):
-            return self._zdo_nwk_addr_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_NWK_DISCOVERY_REQ,
+                          self._zdo_nwk_addr_req_srsp_handler,
+                          scan_channels = struct.pack('<L', scan_channels),
+                          scan_duration = struct.pack('<B', scan_duration))
 
     def _zdo_nwk_discovery_req_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.ZDO_NWK_DISCOVERY_REQ_SRSP:
@@ -1979,18 +2286,14 @@ class Zpi(Znp):
     def zdo_join_req(self, logical_channel, pan_id, pan_id_ext, chosen_parent,
                      parent_depth, stack_profile):
         """ request the device to join itself to a parent device on a network"""
-        self._srsp_event_clear(ZpiCommand.ZDO_JOIN_REQ_SRSP)
-        self.send(ZpiCommand.ZDO_JOIN_REQ,
-                  logical_channel = struct.pack('<B', logical_channel),
-                  pan_id = struct.pack('<H', pan_id),
-                  pan_id_ext = struct.pack('<Q', pan_id_ext),
-                  chosen_parent = struct.pack('<H', chosen_parent),
-                  parent_depth = struct.pack('<B', parent_depth),
-                  stack_profile = struct.pack('<B', stack_profile))
-        if self._srsp_event_wait(ZpiCommand.ZDO_JOIN_REQ_SRSP):
-            return self._zdo_join_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_JOIN_REQ,
+                          self._zdo_join_req_srsp_handler,
+                          logical_channel = struct.pack('<B', logical_channel),
+                          pan_id = struct.pack('<H', pan_id),
+                          pan_id_ext = struct.pack('<Q', pan_id_ext),
+                          chosen_parent = struct.pack('<H', chosen_parent),
+                          parent_depth = struct.pack('<B', parent_depth),
+                          stack_profile = struct.pack('<B', stack_profile))
 
     def _zdo_join_req_srsp_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.ZDO_JOIN_REQ_SRSP:
@@ -2031,7 +2334,7 @@ class Zpi(Znp):
     def zdo_src_rtg_ind_handler(self, rx_data):
         if rx_data['id'] == ZpiCommand.ZDO_SRC_RTG_IND:
             dst_addr = struct.unpack('<H', rx_data['dst_addr'])[0]
-            relay_cnt = struct.unpack('<B', rx_data['replay_cnt'])[0]
+            relay_cnt = struct.unpack('<B', rx_data['relay_cnt'])[0]
             relay_list = rx_data['relay_list']
 
             relays = []
@@ -2063,13 +2366,9 @@ class Zpi(Znp):
             register a ZDO callback and used in conjunction with the configuration
             item ZCD_NV_ZDO_DIRECT_CB.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_MSG_CB_REGISTER_SRSP)
-        self.send(ZpiCommand.ZDO_MSG_CB_REGISTER,
-                  cluster_id = struct.pack('<H', cluster_id))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MSG_CB_REGISTER_SRSP):
-            return self._zdo_msg_cb_register_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MSG_CB_REGISTER,
+                          self._zdo_msg_cb_register_srsp_handler,
+                          cluster_id = struct.pack('<H', cluster_id))
 
     def _zdo_msg_cb_register_srsp_handler(self, rx_data):
         """ handler of ZDO_MSG_CB_REGISTER SRSP"""
@@ -2084,13 +2383,9 @@ class Zpi(Znp):
             remove a ZDO callback and used in conjunction with the configuration
             item ZCD_NV_ZDO_DIRECT_CB.
         """
-        self._srsp_event_clear(ZpiCommand.ZDO_MSG_CB_REMOVE_SRSP)
-        self.send(ZpiCommand.ZDO_MSG_CB_REMOVE_REQ,
-                  cluster_id = struct.pack('<H', cluster_id))
-        if self._srsp_event_wait(ZpiCommand.ZDO_MSG_CB_REMOVE_SRSP):
-            return self._zdo_msg_cb_remove_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.ZDO_MSG_CB_REMOVE_REQ,
+                          self._zdo_msg_cb_remove_srsp_handler,
+                          cluster_id = struct.pack('<H', cluster_id))
 
     def _zdo_msg_cb_remove_srsp_handler(self, rx_data):
         """ handler of ZDO_MSG_CB_REGISTER SRSP"""
@@ -2119,13 +2414,9 @@ class Zpi(Znp):
     #Util interface
     def util_data_req(self, security_use):
         """ send a one shot MAC MLME Poll Request (or data request) """
-        self._srsp_event_clear(ZpiCommand.UTIL_DATA_REQ_SRSP)
-        self.send(ZpiCommand.UTIL_DATA_REQ,
-                  security_use=struct.pack('<B', security_use))
-        if self._srsp_event_wait(ZpiCommand.UTIL_DATA_REQ_SRSP):
-            return self._util_data_req_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.UTIL_DATA_REQ,
+                          self._util_data_req_srsp_handler,
+                          security_use=struct.pack('<B', security_use))
 
     def _util_data_req_srsp_handler(self, rx_data):
         """ handler of UTIL_DATA_REQ_SRSP"""
@@ -2138,19 +2429,27 @@ class Zpi(Znp):
                     ZpiCommand.UTIL_DATA_REQ_SRSP, rx_data['id']))
 
     def util_addrmgr_ext_addr_lookup(self, ext_addr):
-        """ a proxy call to the AddrMgrEntryLookupExt() function """
-        self._srsp_event_clear(ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP_SRSP)
-        self.send(ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP,
-                  struct.pack('<Q', ext_addr))
-        if self._srsp_event_wait(ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP_SRSP):
-            return self._util_addrmgr_ext_addr_lookup_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
-
-    def _util_addrmgr_ext_addr_lookup_srsp_handler(self, rx_data):
+        """
+            a proxy call to the AddrMgrEntryLookupExt() function, the address
+            cache is consulted first
+        """
+        nwk_addr = self.address_cache.get_nwk_addr(ext_addr)
+        if nwk_addr is not None:
+            return self._sreq_result(nwk_addr)
+
+        return self._sreq(ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP,
+                          functools.partial(
+                              self._util_addrmgr_ext_addr_lookup_srsp_handler,
+                              ext_addr = ext_addr),
+                          ext_addr = struct.pack('<Q', ext_addr))
+
+    def _util_addrmgr_ext_addr_lookup_srsp_handler(self, rx_data,
+                                                   ext_addr = None):
         """ handler of UTIL_ADDRMGR_EXT_ADDR_LOOKUP_SRSP """
         if rx_data['id'] == ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP_SRSP:
-            nwk_addr = struct.unpack('<B', rx_data['nwk_addr'])[0]
+            nwk_addr = struct.unpack('<H', rx_data['nwk_addr'])[0]
+            if ext_addr is not None:
+                self._cache_address(ext_addr, nwk_addr)
 
             return nwk_addr
         else:
@@ -2158,19 +2457,27 @@ class Zpi(Znp):
                     ZpiCommand.UTIL_ADDRMGR_EXT_ADDR_LOOKUP_SRSP, rx_data['id']))
 
     def util_addrmgr_nwk_addr_lookup(self, nwk_addr):
-        """ a proxy call to the AddrMgrEntryLookupNwk() function """
-        self._srsp_event_clear(ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP_SRSP)
-        self.send(ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP,
-                  nwk_addr=struct.pack('<H', nwk_addr))
-        if self._srsp_event_wait(ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP_SRSP):
-            return self._util_addrmgr_nwk_addr_lookup_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
-
-    def _util_addrmgr_nwk_addr_lookup_srsp_handler(self, rx_data):
+        """
+            a proxy call to the AddrMgrEntryLookupNwk() function, the address
+            cache is consulted first
+        """
+        ext_addr = self.address_cache.get_ieee_addr(nwk_addr)
+        if ext_addr is not None:
+            return self._sreq_result(ext_addr)
+
+        return self._sreq(ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP,
+                          functools.partial(
+                              self._util_addrmgr_nwk_addr_lookup_srsp_handler,
+                              nwk_addr = nwk_addr),
+                          nwk_addr=struct.pack('<H', nwk_addr))
+
+    def _util_addrmgr_nwk_addr_lookup_srsp_handler(self, rx_data,
+                                                   nwk_addr = None):
         """ handler of UTIL_ADDRMGR_NWK_ADDR_LOOKUP_SRSP """
         if rx_data['id'] == ZpiCommand.UTIL_ADDRMGR_NWK_ADDR_LOOKUP_SRSP:
             ext_addr = struct.unpack('<Q', rx_data['ext_addr'])[0]
+            if nwk_addr is not None:
+                self._cache_address(ext_addr, nwk_addr)
 
             return ext_addr
         else:
@@ -2179,13 +2486,9 @@ class Zpi(Znp):
 
     def util_apsme_link_key_data_get(self, ext_addr):
         """ retrieves APS link security key, TX and RX frame counters"""
-        self._srsp_event_clear(ZpiCommand.UTIL_APSME_LINK_KEY_DATA_GET_SRSP)
-        self.send(ZpiCommand.UTIL_APSME_LINK_KEY_DATA_GET,
-            ext_addr=struct.pack('<Q', ext_addr))
-        if self._srsp_event_wait(ZpiCommand.UTIL_APSME_LINK_KEY_DATA_GET_SRSP):
-            return self._util_apsme_link_key_data_get_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.UTIL_APSME_LINK_KEY_DATA_GET,
+                          self._util_apsme_link_key_data_get_srsp_handler,
+                    ext_addr=struct.pack('<Q', ext_addr))
 
     def _util_apsme_link_key_data_get_srsp_handler(self, rx_data):
         """ handler of UTIL_APSME_LINK_KEY_DATA_GET_SRSP """
@@ -2205,13 +2508,9 @@ class Zpi(Znp):
             NV ID code corresponding to a device with the specified extended
             address
         """
-        self._srsp_event_clear(ZpiCommand.UTIL_APSME_LINK_KEY_NV_ID_GET_SRSP)
-        self.send(ZpiCommand.UTIL_APSME_LINK_KEY_NV_ID_GET,
-                  ext_addr = struct.pack('<Q', ext_addr))
-        if self._srsp_event_wait(ZpiCommand.UTIL_APSME_LINK_KEY_NV_ID_GET_SRSP):
-            return self._util_apsme_link_key_nv_id_get_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.UTIL_APSME_LINK_KEY_NV_ID_GET,
+                          self._util_apsme_link_key_nv_id_get_srsp_handler,
+                          ext_addr = struct.pack('<Q', ext_addr))
 
     def _util_apsme_link_key_nv_id_get_srsp_handler(self, rx_data):
         """ handler of UTIL_APSME_LINK_KEY_MV_ID_GET_SRSP """
@@ -2228,13 +2527,9 @@ class Zpi(Znp):
             send a request key to the trust center from an originator device
             who wants to exchange messages with a partner device
         """
-        self._srsp_event_clear(ZpiCommand.UTIL_APSME_REQUEST_KEY_CMD_SRSP)
-        self.send(ZpiCommand.UTIL_APSME_REQUEST_KEY_CMD,
-            partner_addr=struct.pack('<Q', partner_addr))
-        if self._srsp_event_wait(ZpiCommand.UTIL_APSME_REQUEST_KEY_CMD_SRSP):
-            return self._util_apsme_request_key_cmd_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.UTIL_APSME_REQUEST_KEY_CMD,
+                          self._util_apsme_request_key_cmd_srsp_handler,
+                    partner_addr=struct.pack('<Q', partner_addr))
 
     def _util_apsme_request_key_cmd_srsp_handler(self, rx_data):
         """ handler of UTIL_APSME_REQUEST_KEY_CMD_SRSP"""
@@ -2251,14 +2546,10 @@ class Zpi(Znp):
                 #define NWK_MAX_DEVICE_LIST     20  // Maximum number of devices
                                                     //in the Assoc/Device list.
         """
-        self._srsp_event_clear(ZpiCommand.UTIL_ASSOC_COUNT_SRSP)
-        self.send(ZpiCommand.UTIL_ASSOC_COUNT,
-                  start_relation = struct.pack('<B', start_relation),
-                  end_relation = struct.pack('<B', end_relation))
-        if self._srsp_event_wait(ZpiCommand.UTIL_ASSOC_COUNT_SRSP):
-            return self._util_assoc_count_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException
+        return self._sreq(ZpiCommand.UTIL_ASSOC_COUNT,
+                          self._util_assoc_count_srsp_handler,
+                          start_relation = struct.pack('<B', start_relation),
+                          end_relation = struct.pack('<B', end_relation))
 
     def _util_assoc_count_srsp_handler(self, rx_data):
         """ handler for UTIL_ASSOC_COUNT srsp"""
@@ -2271,13 +2562,9 @@ class Zpi(Znp):
 
     def util_assoc_find_device(self, number):
         """ find the N-th assoc device """
-        self._srsp_event_clear(ZpiCommand.UTIL_ASSOC_FIND_DEVICE_SRSP)
-        self.send(ZpiCommand.UTIL_ASSOC_FIND_DEVICE,
-                  number = struct.pack('<B', number))
-        if self._srsp_event_wait(ZpiCommand.UTIL_ASSOC_FIND_DEVICE_SRSP):
-            return self._util_assoc_find_device_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException
+        return self._sreq(ZpiCommand.UTIL_ASSOC_FIND_DEVICE,
+                          self._util_assoc_find_device_srsp_handler,
+                          number = struct.pack('<B', number))
 
     def _util_assoc_find_device_srsp_handler(self, rx_data):
         """ handler for UTIL_ASSOC_FIND_DEVICE srsp"""
@@ -2310,8 +2597,6 @@ class Zpi(Znp):
 
     def aps_add_group(self, endpoint, group_id, group_name = b''):
         """ add a group in APS group table """
-        self._srsp_event_clear(ZpiCommand.APS_ADD_GROUP_SRSP)
-
         #group_name length check
         if group_name is None:
             group_name = b''
@@ -2322,16 +2607,13 @@ class Zpi(Znp):
         else :
             group_name = group_name[:16]   #only the leading 16chars left
 
-        self.send(ZpiCommand.APS_ADD_GROUP,
-                  endpoint = struct.pack('<B', endpoint),
-                  group_id = struct.pack('<H', group_id),
-                  group_name = group_name)
-
         #test result: add group needs ~230ms,
-        if self._srsp_event_wait(ZpiCommand.APS_ADD_GROUP_SRSP, 0.500):
-            return self._aps_add_group_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.APS_ADD_GROUP,
+                          self._aps_add_group_srsp_handler,
+                          srsp_timeout = 0.500,
+                          endpoint = struct.pack('<B', endpoint),
+                          group_id = struct.pack('<H', group_id),
+                          group_name = group_name)
 
     def _aps_add_group_srsp_handler(self, rx_data):
         """ handler of APS_ADD_GROUP_SRSP """
@@ -2345,14 +2627,11 @@ class Zpi(Znp):
 
     def aps_remove_group(self, endpoint, group_id):
         """ remove a group from the aps group table """
-        self._srsp_event_clear(ZpiCommand.APS_REMOVE_GROUP_SRSP)
-        self.send(ZpiCommand.APS_REMOVE_ALL_GROUP,
-                  endpoint = struct.pack('<B', endpoint),
-                  group_id = struct.pack('<H', group_id))
-        if self._srsp_event_wait(ZpiCommand.APS_REMOVE_GROUP_SRSP, 0.500):
-            return self._aps_remove_group_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.APS_REMOVE_ALL_GROUP,
+                          self._aps_remove_group_srsp_handler,
+                          srsp_timeout = 0.500,
+                          endpoint = struct.pack('<B', endpoint),
+                          group_id = struct.pack('<H', group_id))
 
     def _aps_remove_group_srsp_handler(self, rx_data):
         """ handler of APS_REMOVE_GROUP_SRSP """
@@ -2366,13 +2645,10 @@ class Zpi(Znp):
 
     def aps_remove_all_group(self, endpoint):
         """ remove all groups from aps group table for a specified endpoint """
-        self._srsp_event_clear(ZpiCommand.APS_REMOVE_ALL_GROUP_SRSP)
-        self.send(ZpiCommand.APS_REMOVE_ALL_GROUP,
-                  endpoint = struct.pack('<B', endpoint))
-        if self._srsp_event_wait(ZpiCommand.APS_REMOVE_ALL_GROUP_SRSP, 0.500):
-            return self._aps_remove_all_groups_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.APS_REMOVE_ALL_GROUP,
+                          self._aps_remove_all_groups_srsp_handler,
+                          srsp_timeout = 0.500,
+                          endpoint = struct.pack('<B', endpoint))
 
     def _aps_remove_all_groups_srsp_handler(self, rx_data):
         """ handler of APS_COUNT_ALL_GROUPS_SRSP """
@@ -2386,14 +2662,11 @@ class Zpi(Znp):
 
     def aps_find_group(self, endpoint, group_id):
         """ find a group in aps group table """
-        self._srsp_event_clear(ZpiCommand.APS_FIND_GROUP_SRSP)
-        self.send(ZpiCommand.APS_FIND_GROUP,
-                  endpoint = struct.pack('<B', endpoint),
-                  group_id = struct.pack('<H', group_id))
-        if self._srsp_event_wait(ZpiCommand.APS_FIND_GROUP_SRSP, 0.500):
-            return self._aps_find_group_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.APS_FIND_GROUP,
+                          self._aps_find_group_srsp_handler,
+                          srsp_timeout = 0.500,
+                          endpoint = struct.pack('<B', endpoint),
+                          group_id = struct.pack('<H', group_id))
 
     def _aps_find_group_srsp_handler(self, rx_data):
         """ handler of APS_FIND_GROUP_SRSP """
@@ -2410,13 +2683,9 @@ class Zpi(Znp):
 
     def aps_find_all_groups_for_endpoint(self, endpoint):
         """ find all groups for a specified endpoint in aps group table """
-        self._srsp_event_clear(ZpiCommand.APS_FIND_ALL_GROUPS_FOR_EP_SRSP)
-        self.send(ZpiCommand.APS_FIND_ALL_GROUPS_FOR_EP,
-                  endpoint = struct.pack('<B', endpoint))
-        if self._srsp_event_wait(ZpiCommand.APS_FIND_ALL_GROUPS_FOR_EP_SRSP):
-            return self._aps_find_all_groups_for_endpoint_srsp_handler(self._srsp_rx_msg)
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.APS_FIND_ALL_GROUPS_FOR_EP,
+                          self._aps_find_all_groups_for_endpoint_srsp_handler,
+                          endpoint = struct.pack('<B', endpoint))
 
     def _aps_find_all_groups_for_endpoint_srsp_handler(self, rx_data):
         """ handler of APS_COUNT_ALL_GROUPS_SRSP """
@@ -2439,12 +2708,8 @@ class Zpi(Znp):
 
     def aps_count_all_groups(self):
         """ """
-        self._srsp_event_clear(ZpiCommand.APS_COUNT_ALL_GROUPS_SRSP)
-        self.send(ZpiCommand.APS_COUNT_ALL_GROUPS)
-        if self._srsp_event_wait(ZpiCommand.APS_COUNT_ALL_GROUPS_SRSP):
-            return self._aps_count_all_groups_srsp_handler(self._srsp_rx_msg)  #FIXME
-        else:
-            raise SrspTimeoutException()
+        return self._sreq(ZpiCommand.APS_COUNT_ALL_GROUPS,
+                          self._aps_count_all_groups_srsp_handler)  #FIXME
 
     def _aps_count_all_groups_srsp_handler(self, rx_data):
         """ handler of APS_COUNT_ALL_GROUPS_SRSP """
@@ -2458,6 +2723,320 @@ class Zpi(Znp):
                     ZpiCommand.APS_COUNT_ALL_GROUPS_SRSP, rx_data['id']))
 
 
+class Zpi(ZpiBase):
+    """
+        A class implements TI ZPI (ZNP API) functions
+
+        with the helpers waiting for responses in the calling thread:
+        pipelines, concurrent ZDO exchanges, ZDO table iterators, the topology
+        crawler, the AF transmit queue and the huge AF messages.
+    """
+    RETRIEVE_LARGE_MSG = True
+
+    def _queue_large_msg(self, rx_data):
+        """
+            queue a huge message for the retrieving thread, SREQs cannot be
+            waited for in the reader thread
+        """
+        if self._large_msg_q is None:
+            self._large_msg_q = Queue.Queue()
+            thread = threading.Thread(target = self._large_msg_loop,
+                                      name = 'ZpiLargeMsg')
+            thread.daemon = True
+            thread.start()
+        self._large_msg_q.put(rx_data)
+
+    def _large_msg_loop(self):
+        """
+            retrieve the payload of huge messages and deliver them, a message
+            whose payload cannot be retrieved fails its waiter and is handed
+            to the subscriptions and the async callback without payload
+        """
+        while True:
+            rx_data = self._large_msg_q.get()
+            payload = None
+            try:
+                payload = self.receive_large(
+                    struct.unpack('<L', rx_data['time_stamp'])[0],
+                    struct.unpack('<H', rx_data['len'])[0])
+            except Exception as e:
+                log.warning('Large message retrieval failed: %s' % e)
+                future = self._areq_waiters.match(rx_data)
+                if future is not None:
+                    future.set_exception(e)
+            else:
+                rx_data['data'] = payload
+                rx_data.typed()['data'] = memoryview(payload)
+
+            subscriptions = self._subscriptions.match(rx_data.raw)
+            if subscriptions:
+                self._notify(subscriptions, rx_data.raw, payload)
+            self._deliver_areq(rx_data)
+
+    def _sreq_pipelined(self, pipeline, method, *args, **kwargs):
+        """ call an API method with its SREQ submitted to pipeline """
+        self._sreq_local.pipeline = pipeline
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._sreq_local.pipeline = None
+
+    def pipeline(self, window = 8,
+                 srsp_timeout = ZpiBase.SRSP_WAITING_TIMEOUT_DEFAULT):
+        """
+            get a ZpiPipeline which keeps up to window SREQs in flight, the
+            API methods called through it return the futures of their SRSP
+        """
+        return ZpiPipeline(self, window, srsp_timeout)
+
+    def af_transmit_queue(self, **kwargs):
+        """
+            get an AfTransmitQueue sending AF messages through this instance
+            with a congestion window driven by AF_DATA_CONFIRM
+        """
+        from zpi.aftx import AfTransmitQueue
+        return AfTransmitQueue(self, **kwargs)
+
+    def topology_crawler(self, concurrency = 8, **kwargs):
+        """
+            get a TopologyCrawler walking the network through this instance
+            with up to concurrency ZDO requests in flight
+        """
+        from zpi.topology import TopologyCrawler
+        return TopologyCrawler(self, concurrency, **kwargs)
+
+    def zdo_exchange_many(self, requests,
+                          areq_timeout = ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            run the ZDO exchanges [(zdo_cmd, args), ...] concurrently, all the
+            requests are sent before any response is waited for
+
+            return the results in the order of requests, a failed exchange
+            gives its exception instead of a result.
+        """
+        futures = []
+        for zdo_cmd, args in requests:
+            try:
+                futures.append(self.zdo_exchange_async(
+                    zdo_cmd, *args, areq_timeout = areq_timeout))
+            except Exception as e:
+                future = ZpiFuture(zdo_cmd)
+                future.set_exception(e)
+                futures.append(future)
+
+        results = []
+        for future in futures:
+            deadline = getattr(future, 'deadline', None)
+            if deadline is not None and \
+                    not future.wait(max(0, deadline - time.time())):
+                future.cancel()
+            try:
+                results.append(future.result(0))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _zdo_pages(self, zdo_cmd, args, start_index, areq_timeout):
+        """
+            generator of the record pages of a ZDO table, args are the request
+            arguments before start_index
+
+            the request of the next page is sent before the current page is
+            yielded, and cancelled when the generator is closed early.
+        """
+        future = self.zdo_exchange_async(zdo_cmd,
+                                         *(args + (start_index, )),
+                                         areq_timeout = areq_timeout)
+        try:
+            while future is not None:
+                if not future.wait(areq_timeout) and future.cancel():
+                    raise AreqTimeoutException(
+                        'Wait for %s page %d timeout.' % (zdo_cmd, start_index))
+
+                if zdo_cmd == ZpiCommand.ZDO_IEEE_ADDR_REQ:
+                    (status, ieee_addr, nwk_addr, index, entries,
+                     records) = future.result()
+                else:
+                    (src_addr, status, entries, index,
+                     records) = future.result()
+                if status != ZpiStatus.Z_SUCCESS:
+                    raise ZpiStatusException('%s failed: %s' % (zdo_cmd,
+                        ZpiStatus.status_names.get(status, status)), status)
+
+                future = None
+                start_index = index + len(records)
+                if records and start_index < entries:
+                    future = self.zdo_exchange_async(
+                        zdo_cmd, *(args + (start_index, )),
+                        areq_timeout = areq_timeout)
+                yield records
+        finally:
+            if future is not None:
+                future.cancel()
+
+    def zdo_mgmt_lqi_iter(self, dst_addr, start_index = 0,
+                          areq_timeout = ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            iterate the neighbor table of the destination device from
+            start_index, as decoded {column name: value} records
+        """
+        for records in self._zdo_pages(ZpiCommand.ZDO_MGMT_LQI_REQ,
+                                       (dst_addr, ), start_index, areq_timeout):
+            for record in decode_nbr_table(records).rows():
+                yield record
+
+    def zdo_mgmt_rtg_iter(self, dst_addr, start_index = 0,
+                          areq_timeout = ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            iterate the routing table of the destination device from
+            start_index, as decoded {column name: value} records
+        """
+        for records in self._zdo_pages(ZpiCommand.ZDO_MGMT_RTG_REQ,
+                                       (dst_addr, ), start_index, areq_timeout):
+            for record in decode_rtg_table(records).rows():
+                yield record
+
+    def zdo_mgmt_nwk_disc_iter(self, dst_addr, scan_channels, scan_duration,
+                               start_index = 0, areq_timeout =
+                               ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            iterate the networks discovered by the destination device from
+            start_index, as decoded {column name: value} records
+        """
+        for records in self._zdo_pages(ZpiCommand.ZDO_MGMT_NWK_DISC_REQ,
+                                       (dst_addr, scan_channels, scan_duration),
+                                       start_index, areq_timeout):
+            for record in decode_nwk_disc_table(records).rows():
+                yield record
+
+    def zdo_mgmt_bind_iter(self, dst_addr, start_index = 0,
+                           areq_timeout =
+                           ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            iterate the binding table of the destination device from
+            start_index, as raw binding table entries
+        """
+        for records in self._zdo_pages(ZpiCommand.ZDO_MGMT_BIND_REQ,
+                                       (dst_addr, ), start_index, areq_timeout):
+            for record in records:
+                yield record
+
+    def zdo_assoc_dev_iter(self, nwk_addr, start_index = 0,
+                           areq_timeout =
+                           ZpiBase.AREQ_WAITING_TIMEOUT_DEFAULT):
+        """
+            iterate the network addresses of the devices associated to
+            nwk_addr from start_index, through extended ZDO_IEEE_ADDR_REQs
+        """
+        for records in self._zdo_pages(ZpiCommand.ZDO_IEEE_ADDR_REQ,
+                                       (nwk_addr, 0x01), start_index,
+                                       areq_timeout):
+            for record in records:
+                yield record
+
+    def send_large(self, dst_addr_mode, dst_addr, dst_ep, dst_pan_id, src_ep,
+                   cluster_id, trans_id, options, radius, data, length = None,
+                   window = 8):
+        """
+            send a payload fragmented by APS, data is a buffer or a file-like
+            object read up to length bytes (to its end by default)
+
+            the payload is stored in ZNP by pipelined AF_DATA_STOREs of the
+            largest size, then sent; return the status of the final request,
+            a refused chunk raises ZpiStatusException. AF_DATA_CONFIRM
+            follows as for af_data_request_ext().
+        """
+        if hasattr(data, 'read'):
+            if length is None:
+                position = data.tell()
+                data.seek(0, 2)
+                length = data.tell() - position
+                data.seek(position)
+            read = data.read
+        else:
+            data = memoryview(data)
+            if length is None:
+                length = len(data)
+            read = None
+
+        if length <= self.AF_DATA_REQUEST_EXT_MAX:
+            payload = read(length) if read else data[:length].tobytes()
+            return self.af_data_request_ext(dst_addr_mode, dst_addr, dst_ep,
+                                            dst_pan_id, src_ep, cluster_id,
+                                            trans_id, options, radius, payload)
+
+        #a huge AF_DATA_REQUEST_EXT without data allocates the ZNP buffer
+        status = self._sreq(ZpiCommand.AF_DATA_REQUEST_EXT,
+                            self._af_data_request_ext_srsp_handler,
+                            dst_addr_mode = struct.pack('<B', dst_addr_mode),
+                            dst_addr = struct.pack('<Q', dst_addr),
+                            dst_ep = struct.pack('<B', dst_ep),
+                            dst_pan_id = struct.pack('<H', dst_pan_id),
+                            src_ep = struct.pack('<B', src_ep),
+                            cluster_id = struct.pack('<H', cluster_id),
+                            trans_id = struct.pack('<B', trans_id),
+                            options = struct.pack('<B', options),
+                            radius = struct.pack('<B', radius),
+                            len = struct.pack('<H', length),
+                            data = b'')
+        self._check_status(ZpiCommand.AF_DATA_REQUEST_EXT, status)
+
+        pipe = self.pipeline(window)
+        futures = collections.deque()
+        for index in range(0, length, self.AF_DATA_STORE_CHUNK):
+            size = min(self.AF_DATA_STORE_CHUNK, length - index)
+            chunk = read(size) if read else data[index:index + size].tobytes()
+            if len(chunk) != size:
+                raise ValueError('Payload ended at %d of %d bytes.' % (
+                    index + len(chunk), length))
+            futures.append(pipe.af_data_store(index, chunk))
+            while len(futures) > window:
+                self._check_status(ZpiCommand.AF_DATA_STORE,
+                                   pipe.result(futures.popleft()))
+        for status in pipe.gather(futures):
+            self._check_status(ZpiCommand.AF_DATA_STORE, status)
+
+        #an empty AF_DATA_STORE sends the stored payload
+        return self.af_data_store(length, b'')
+
+    def receive_large(self, time_stamp, length, out = None, window = 8):
+        """
+            retrieve the payload of a huge AF_INCOMING_MSG_EXT, identified by
+            its time_stamp and len fields, with pipelined AF_DATA_RETRIEVEs
+            of the largest size; the ZNP buffer is freed afterwards
+
+            return the payload, or write it to the file-like object out and
+            return length.
+        """
+        pipe = self.pipeline(window)
+        payload = bytearray()
+        futures = collections.deque()
+
+        def collect(future):
+            #the chunks are views of their SRSP frames
+            status, chunk = pipe.result(future)
+            self._check_status(ZpiCommand.AF_DATA_RETRIEVE, status)
+            if out is not None:
+                out.write(chunk.tobytes())
+            else:
+                payload.extend(chunk)
+
+        try:
+            for index in range(0, length, self.AF_DATA_RETRIEVE_CHUNK):
+                size = min(self.AF_DATA_RETRIEVE_CHUNK, length - index)
+                futures.append(pipe.af_data_retrieve(time_stamp, index, size))
+                while len(futures) > window:
+                    collect(futures.popleft())
+            while futures:
+                collect(futures.popleft())
+        finally:
+            pipe.drain()
+            #a zero length retrieve frees the message buffer
+            self.af_data_retrieve(time_stamp, length, 0)
+
+        return length if out is not None else bytes(payload)
+
+
 
 class SerialTimeoutException(Exception):
     """ just a user-defined exception class for serial read/write time out"""
@@ -2471,6 +3050,12 @@ class AreqTimeoutException(Exception):
     """ just a user-defined exception class for Areq response time out"""
     pass
 
+class ZpiStatusException(Exception):
+    """ a request refused by ZNP, status is its ZpiStatus """
+    def __init__(self, message, status):
+        super(ZpiStatusException, self).__init__(message)
+        self.status = status
+
 class ResetType(object):
     HARD_RESET = 0x00
     SOFT_RESET = 0x01